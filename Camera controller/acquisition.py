@@ -0,0 +1,1094 @@
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from pypylon import genicam, pylon
+
+from buffers import FramePool
+from instrumentation import METRICS
+from metadata import MetadataWriter
+from packed import is_packed
+
+# Packed pixel formats, grabbed as raw bytes (see packed.py)
+PACKED_PIXEL_TYPES = {
+    pylon.PixelType_Mono10p: "Mono10p",
+    pylon.PixelType_Mono12p: "Mono12p",
+    pylon.PixelType_Mono10packed: "Mono10Packed",
+    pylon.PixelType_Mono12packed: "Mono12Packed",
+}
+
+
+class Frame:
+    """A single grabbed image together with its grab bookkeeping.
+
+    Parameters
+    -----------
+
+    camera_idx
+      Index of the camera in the acquisition engine.
+
+    array
+      The image data as a read-only Numpy view into a ``FramePool`` buffer.
+      Packed pixel formats keep their packed bytes, one row per image row.
+
+    image_number
+      Image number reported by the camera (``GetImageNumber``).
+
+    timestamp
+      Camera tick timestamp (``GetTimeStamp``).
+
+    host_timestamp
+      ``time.perf_counter()`` value taken when the frame was retrieved.
+
+    lease
+      The ``FrameLease`` owning ``array``. Every consumer calls ``release()``
+      once it is done with the frame.
+
+    lost
+      Number of frames lost by the camera or the grab strategy right before
+      this one.
+
+    generation
+      Number of times grabbing was restarted before this frame, see
+      ``GrabThread.generation``. Image numbers start over in a new
+      generation.
+    """
+
+    __slots__ = (
+        "camera_idx",
+        "array",
+        "image_number",
+        "timestamp",
+        "host_timestamp",
+        "lease",
+        "lost",
+        "generation",
+    )
+
+    def __init__(
+        self,
+        camera_idx,
+        array,
+        image_number,
+        timestamp,
+        host_timestamp,
+        lease=None,
+        lost=0,
+        generation=0,
+    ):
+        self.camera_idx = camera_idx
+        self.array = array
+        self.image_number = image_number
+        self.timestamp = timestamp
+        self.host_timestamp = host_timestamp
+        self.lease = lease
+        self.lost = lost
+        self.generation = generation
+
+    def release(self):
+        if self.lease is not None:
+            self.lease.release()
+
+    def drop(self):
+        if self.lease is not None:
+            self.lease.drop()
+
+
+class FrameQueue:
+    """A bounded frame queue between a grab thread and one consumer.
+
+    When the queue is full the oldest frame is discarded so that the grab
+    thread never blocks on a slow consumer. Discarded frames are counted in
+    ``dropped``. A ``block`` queue instead makes the grab thread wait up to
+    ``block_timeout`` seconds for the consumer, this is used by lossless
+    recordings where the camera buffers absorb the delay. A ``close``d queue
+    drops every frame, for consumers that stopped reading.
+
+    A ``latest`` queue serves a consumer that only wants the newest frame
+    (the preview, the image statistics): frames it replaces, or discards
+    once closed, are released without being counted as dropped. Frames
+    skipped by ``get_latest`` are never counted.
+    """
+
+    def __init__(self, maxsize=8, block=False, block_timeout=1.0, latest=False):
+        self.maxsize = maxsize
+        self.block = block
+        self.block_timeout = block_timeout
+        self.latest = latest
+        self.dropped = 0
+        self.closed = False
+        self._frames = deque()
+        self._cond = threading.Condition()
+
+    def put(self, frame):
+        with self._cond:
+            if self.closed:
+                self._discard(frame)
+                return
+            if self.block and len(self._frames) >= self.maxsize:
+                self._cond.wait_for(
+                    lambda: len(self._frames) < self.maxsize, self.block_timeout
+                )
+            if len(self._frames) >= self.maxsize:
+                self._discard(self._frames.popleft())
+            self._frames.append(frame)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest frame, waiting up to ``timeout`` seconds.
+
+        Raises ``queue.Empty`` if no frame arrived in time."""
+        with self._cond:
+            if not self._frames and not self._cond.wait_for(
+                lambda: self._frames, timeout
+            ):
+                raise queue.Empty
+            frame = self._frames.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def get_latest(self):
+        """Returns the newest frame and discards the older ones, or None."""
+        with self._cond:
+            if not self._frames:
+                return None
+            frame = self._frames.pop()
+            # Skipped on purpose, the pipeline did not fall behind
+            while self._frames:
+                self._frames.popleft().release()
+            return frame
+
+    def qsize(self):
+        return len(self._frames)
+
+    def _discard(self, frame):
+        if self.latest:
+            frame.release()
+        else:
+            frame.drop()
+            self.dropped += 1
+
+    def close(self):
+        """Drops the queued frames and every frame put from now on."""
+        with self._cond:
+            self.closed = True
+            while self._frames:
+                self._discard(self._frames.popleft())
+            self._cond.notify_all()
+
+
+class GrabStats:
+    """Per-camera grab latency and frame rate over a sliding window."""
+
+    def __init__(self, window=100):
+        self.frames = 0
+        self.failed = 0
+        self.lost = 0
+        self.first_frame = None
+        self._times = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, host_timestamp, latency):
+        with self._lock:
+            if self.first_frame is None:
+                self.first_frame = host_timestamp
+            self.frames += 1
+            self._times.append(host_timestamp)
+            self._latencies.append(latency)
+
+    def loss_rate(self):
+        """Fraction of the frames produced by the camera that were lost."""
+        total = self.frames + self.lost
+        return self.lost / total if total else 0.0
+
+    def fps(self):
+        with self._lock:
+            if len(self._times) < 2:
+                return 0.0
+            span = self._times[-1] - self._times[0]
+            return (len(self._times) - 1) / span if span > 0 else 0.0
+
+    def latency_ms(self):
+        """Mean and max time spent in ``RetrieveResult`` per frame, in ms."""
+        with self._lock:
+            if not self._latencies:
+                return 0.0, 0.0
+            return (
+                1000 * sum(self._latencies) / len(self._latencies),
+                1000 * max(self._latencies),
+            )
+
+
+class GrabThread(threading.Thread):
+    """Grabs frames from one ``InstantCamera`` and publishes them to its
+    subscribers.
+
+    Each frame is copied once from the pylon buffer into a ``FramePool``
+    buffer which is shared by all subscribers. The camera must already be
+    grabbing. The thread stops when ``stop()`` is called or the camera stops
+    grabbing.
+
+    Lost frames are detected from gaps in the camera block IDs, which also
+    cover the images skipped by the grab strategy, or from the skipped
+    images alone for cameras without block IDs, and counted in
+    ``stats.lost``. In lossless mode the camera grabs
+    with ``GrabStrategy_OneByOne`` into ``MaxNumBuffer`` buffers and the
+    thread waits for free pool buffers instead of dropping frames.
+
+    ``crop`` is a (rows, columns) pair of slices applied as a view before the
+    copy, for the ROI and decimation the camera cannot do itself (see
+    ``apply_geometry``). Packed pixel formats are not cropped.
+
+    The pool holds at least ``pool_size`` buffers and grows to the sizes of
+    the subscriber queues plus two buffers per subscriber, the frame it is
+    working on and the one being published, so that a slow consumer fills
+    its own queue, where the drop policy applies, before the pool runs out
+    for the others.
+    """
+
+    def __init__(self, camera, camera_idx, timeout_ms=1000, pool_size=16):
+        super().__init__(name=f"grab-{camera_idx}", daemon=True)
+        self.camera = camera
+        self.camera_idx = camera_idx
+        self.timeout_ms = timeout_ms
+        self.pool_size = pool_size
+        self.pool = None
+        self.crop = None
+        self.stats = GrabStats()
+        self.subscribers = []
+        self.lossless = False
+        self._strategy_request = None
+        self._restart_request = None
+        self.restart_error = None
+        # Counts the restarts of grabbing, the camera numbers its images
+        # from the start again after each
+        self.generation = 0
+        self._last_block_id = None
+        self._stop_event = threading.Event()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        labels = {"camera": self.camera_idx}
+        self.retrieve_time = METRICS.histogram("grab_retrieve_seconds", **labels)
+        self.copy_time = METRICS.histogram("grab_copy_seconds", **labels)
+        self.publish_time = METRICS.histogram("grab_publish_seconds", **labels)
+        METRICS.gauge("grab_frames", lambda: self.stats.frames, **labels)
+        METRICS.gauge("grab_lost", lambda: self.stats.lost, **labels)
+        METRICS.gauge("grab_failed", lambda: self.stats.failed, **labels)
+        METRICS.gauge(
+            "grab_pool_overruns",
+            lambda: self.pool.overruns if self.pool else 0,
+            **labels,
+        )
+        METRICS.gauge(
+            "subscriber_queue_depth_max",
+            lambda: max((q.qsize() for q in self.subscribers), default=0),
+            **labels,
+        )
+        METRICS.gauge(
+            "subscriber_queue_dropped",
+            lambda: sum(q.dropped for q in self.subscribers),
+            **labels,
+        )
+
+    def set_lossless(self, lossless, max_num_buffer=None):
+        """Switches between ``GrabStrategy_OneByOne`` (lossless) and
+        ``GrabStrategy_LatestImageOnly``. The grab thread restarts grabbing
+        with the new strategy before the next frame."""
+        self._strategy_request = (lossless, max_num_buffer)
+
+    def _apply_strategy(self):
+        lossless, max_num_buffer = self._strategy_request
+        self._strategy_request = None
+        self.camera.StopGrabbing()
+        self.generation += 1
+        if max_num_buffer is not None:
+            self.camera.MaxNumBuffer.SetValue(max_num_buffer)
+        self.lossless = lossless
+        self._last_block_id = None
+        if lossless:
+            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne)
+        else:
+            self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+
+    def restart(self, apply):
+        """Stops grabbing, calls ``apply(camera)`` and restarts grabbing with
+        the current strategy, from the grab thread between two frames.
+
+        Returns an event that is set once the camera grabs again. A pylon
+        error or ValueError raised by ``apply`` is kept in ``restart_error``."""
+        done = threading.Event()
+        self._restart_request = (apply, done)
+        return done
+
+    def _apply_restart(self):
+        apply, done = self._restart_request
+        self._restart_request = None
+        self.restart_error = None
+        self.camera.StopGrabbing()
+        self.generation += 1
+        try:
+            apply(self.camera)
+        except (pylon.GenericException, ValueError) as exc:
+            self.restart_error = exc
+        self._last_block_id = None
+        if self.lossless:
+            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne)
+        else:
+            self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        done.set()
+
+    def _count_lost(self, grabResult):
+        block_id = grabResult.GetBlockID()
+        # Cameras without block IDs report the maximum value
+        if block_id == 2**64 - 1:
+            lost = grabResult.GetNumberOfSkippedImages()
+        else:
+            # Skipped images used up block IDs too, they are in the gap
+            lost = 0
+            if self._last_block_id is not None and block_id > self._last_block_id:
+                lost = block_id - self._last_block_id - 1
+            self._last_block_id = block_id
+        self.stats.lost += lost
+        return lost
+
+    def _ensure_pool(self, shape, dtype, subscribers):
+        size = max(self.pool_size, sum(q.maxsize + 2 for q in subscribers))
+        pool = self.pool
+        if pool is None or not pool.matches(shape, dtype) or pool.size < size:
+            # Leases of the old pool stay valid until they are released
+            self.pool = FramePool(shape, dtype, size)
+
+    def _copy_to_pool(self, array, subscribers):
+        self._ensure_pool(array.shape, array.dtype, subscribers)
+        lease = self.pool.acquire(
+            refs=len(subscribers),
+            timeout=self.timeout_ms / 1000 if self.lossless else 0,
+        )
+        if lease is not None:
+            start = time.perf_counter()
+            self.pool.fill(lease, array)
+            self.copy_time.observe(time.perf_counter() - start)
+        return lease
+
+    def frame_shape(self):
+        """(height, width) of the published frames, after the crop."""
+        shape = (self.camera.Height.GetValue(), self.camera.Width.GetValue())
+        if self.crop is None:
+            return shape
+        return tuple(
+            len(range(*part.indices(size))) for part, size in zip(self.crop, shape)
+        )
+
+    def subscribe(self, maxsize=8, block=False, latest=False):
+        frame_queue = FrameQueue(maxsize, block, latest=latest)
+        self.attach(frame_queue)
+        return frame_queue
+
+    def attach(self, frame_queue):
+        self.subscribers = self.subscribers + [frame_queue]
+
+    def unsubscribe(self, frame_queue):
+        self.subscribers = [q for q in self.subscribers if q is not frame_queue]
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set() and self.camera.IsGrabbing():
+            if self._strategy_request is not None:
+                self._apply_strategy()
+            if self._restart_request is not None:
+                self._apply_restart()
+            start = time.perf_counter()
+            try:
+                grabResult = self.camera.RetrieveResult(
+                    self.timeout_ms, pylon.TimeoutHandling_Return
+                )
+            except pylon.GenericException:
+                # Raised when the camera is stopped or removed while waiting
+                break
+            if grabResult is None or not grabResult.IsValid():
+                continue
+            subscribers = self.subscribers
+            try:
+                if not grabResult.GrabSucceeded():
+                    self.stats.failed += 1
+                    continue
+                host_timestamp = time.perf_counter()
+                self.retrieve_time.observe(host_timestamp - start)
+                lost = self._count_lost(grabResult)
+                if not subscribers:
+                    self.stats.add(host_timestamp, host_timestamp - start)
+                    continue
+                packed_format = PACKED_PIXEL_TYPES.get(grabResult.GetPixelType())
+                if packed_format is None:
+                    with grabResult.GetArrayZeroCopy() as array:
+                        crop = self.crop
+                        if crop is not None:
+                            array = array[crop]
+                        lease = self._copy_to_pool(array, subscribers)
+                else:
+                    # pypylon cannot map packed formats, their bytes are
+                    # stored as delivered with one packed row per array row
+                    view = grabResult.GetImageMemoryView()
+                    try:
+                        lease = self._copy_to_pool(
+                            np.frombuffer(view, np.uint8).reshape(
+                                grabResult.GetHeight(), -1
+                            ),
+                            subscribers,
+                        )
+                    finally:
+                        view.release()
+                if lease is None:
+                    # Every buffer is still held by a consumer
+                    self.stats.lost += 1
+                    continue
+                frame = Frame(
+                    self.camera_idx,
+                    lease.array,
+                    grabResult.GetImageNumber(),
+                    grabResult.GetTimeStamp(),
+                    host_timestamp,
+                    lease,
+                    lost,
+                    self.generation,
+                )
+            finally:
+                grabResult.Release()
+            self.stats.add(host_timestamp, host_timestamp - start)
+            for frame_queue in subscribers:
+                frame_queue.put(frame)
+            self.publish_time.observe(time.perf_counter() - host_timestamp)
+
+
+class AcquisitionEngine:
+    """Runs one ``GrabThread`` per camera.
+
+    Consumers (the preview, the writers) ``subscribe`` to a camera and read
+    frames from their own bounded queue at their own pace.
+
+    Parameters
+    -----------
+
+    cameras
+      List of opened ``InstantCamera`` objects that are already grabbing.
+    """
+
+    def __init__(self, cameras):
+        self.cameras = cameras
+        self.threads = [GrabThread(camera, idx) for idx, camera in enumerate(cameras)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            thread.stop()
+        for thread in self.threads:
+            # Threads of cameras that never came up were not started
+            if thread.ident is not None:
+                thread.join()
+
+    def subscribe(self, camera_idx, maxsize=8, block=False, latest=False):
+        return self.threads[camera_idx].subscribe(maxsize, block, latest)
+
+    def unsubscribe(self, camera_idx, frame_queue):
+        self.threads[camera_idx].unsubscribe(frame_queue)
+
+    def subscribe_all(self, maxsize=64, block=False):
+        """Returns one queue receiving the frames of every camera, use
+        ``Frame.camera_idx`` to tell them apart."""
+        frame_queue = FrameQueue(maxsize, block)
+        for thread in self.threads:
+            thread.attach(frame_queue)
+        return frame_queue
+
+    def unsubscribe_all(self, frame_queue):
+        for thread in self.threads:
+            thread.unsubscribe(frame_queue)
+
+    def stats(self):
+        """Returns a list of per-camera dicts with fps, grab latency and the
+        frame pool counters."""
+        report = []
+        for thread in self.threads:
+            mean_ms, max_ms = thread.stats.latency_ms()
+            pool = thread.pool
+            report.append(
+                {
+                    "camera": thread.camera_idx,
+                    "frames": thread.stats.frames,
+                    "failed": thread.stats.failed,
+                    "lost": thread.stats.lost,
+                    "loss_rate": thread.stats.loss_rate(),
+                    "fps": thread.stats.fps(),
+                    "latency_mean_ms": mean_ms,
+                    "latency_max_ms": max_ms,
+                    "pool_overruns": pool.overruns if pool else 0,
+                    "pool_dropped": pool.dropped if pool else 0,
+                }
+            )
+        return report
+
+    def aggregate_fps(self):
+        return sum(thread.stats.fps() for thread in self.threads)
+
+
+class RecordingWorker(threading.Thread):
+    """Drains a ``FrameQueue`` into a writer on its own thread.
+
+    Frames missing from the recording (lost by the camera or dropped from a
+    full queue) are found from the image numbers and kept in ``gaps`` as
+    (image number after the gap, number of frames missing). After ``stop()``
+    the frames still queued are written, the writer is closed and the gaps
+    and loss rate are saved next to the output in ``<filename>.gaps.json``.
+
+    The image number, timestamps and grab-to-write latency of every written
+    frame go to the ``<filename>.meta`` sidecar (see ``metadata.py``). For
+    async writers the latency ends when the frame is handed to the writer.
+
+    An exception raised by the writer ends the recording early and is kept
+    in ``error``. The queue is then closed so that the grab thread does not
+    wait for it, and the writer, the sidecar and the gap log are closed as
+    after ``stop()``.
+    """
+
+    def __init__(self, frame_queue, writer, file_loc="."):
+        super().__init__(daemon=True)
+        self.frame_queue = frame_queue
+        self.writer = writer
+        self.filename = writer.filename if writer is not None else None
+        self.file_loc = file_loc
+        self.written = 0
+        self.lost = 0
+        self.gaps = []
+        self.error = None
+        self.metadata = None
+        self._last_image_number = None
+        self._stop_event = threading.Event()
+
+    def _register_metrics(self):
+        labels = {"file": self.filename}
+        self.write_time = METRICS.histogram("record_write_seconds", **labels)
+        self.bytes_written = METRICS.counter("record_bytes", **labels)
+        METRICS.gauge("record_frames", lambda: self.written, **labels)
+        METRICS.gauge("record_missing", lambda: self.lost, **labels)
+        METRICS.gauge(
+            "record_queue_depth", lambda: self.frame_queue.qsize(), **labels
+        )
+        METRICS.gauge(
+            "record_queue_dropped", lambda: self.frame_queue.dropped, **labels
+        )
+
+    def _unregister_metrics(self):
+        METRICS.unregister(
+            "record_write_seconds",
+            "record_bytes",
+            "record_frames",
+            "record_missing",
+            "record_queue_depth",
+            "record_queue_dropped",
+            file=self.filename,
+        )
+
+    def _track_gaps(self, frame):
+        missing = frame.lost
+        last = self._last_image_number
+        # Image numbers restart when the grab strategy is changed
+        if last is not None and frame.image_number > last:
+            # The image number gap holds the frames skipped by the grab
+            # strategy, like frame.lost, and the frames dropped from the
+            # queue. Frames lost by the camera are only in frame.lost.
+            missing = max(missing, frame.image_number - last - 1)
+        if missing:
+            self.gaps.append((frame.image_number, missing))
+            self.lost += missing
+        self._last_image_number = frame.image_number
+        self.written += 1
+
+    def loss_rate(self):
+        total = self.written + self.lost
+        return self.lost / total if total else 0.0
+
+    def write_gap_log(self):
+        log = {
+            "frames": self.written,
+            "lost": self.lost,
+            "loss_rate": self.loss_rate(),
+            "gaps": self.gaps,
+        }
+        if self.error is not None:
+            log["error"] = str(self.error)
+        filename = os.path.join(self.file_loc, f"{self.filename}.gaps.json")
+        with open(filename, "w") as file:
+            json.dump(log, file)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _open(self):
+        self.metadata = MetadataWriter(
+            os.path.join(self.file_loc, f"{self.filename}.meta")
+        )
+
+    def _write(self, frame):
+        if getattr(self.writer, "async_mode", False):
+            # The writer thread releases the frame once it is written
+            self.writer.write_frame(frame.array, self.file_loc, frame.release)
+        else:
+            try:
+                self.writer.write_frame(frame.array, self.file_loc)
+            finally:
+                frame.release()
+        self.metadata.append(
+            frame.image_number,
+            frame.timestamp,
+            frame.host_timestamp,
+            time.perf_counter() - frame.host_timestamp,
+        )
+
+    def _close(self):
+        self.writer.close()
+        if self.metadata is not None:
+            self.metadata.close()
+
+    def run(self):
+        self._register_metrics()
+        try:
+            self._open()
+            while True:
+                try:
+                    frame = self.frame_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                self._track_gaps(frame)
+                start = time.perf_counter()
+                nbytes = frame.array.nbytes
+                self._write(frame)
+                self.write_time.observe(time.perf_counter() - start)
+                self.bytes_written.inc(nbytes)
+        except Exception as exc:
+            self.error = exc
+            # Nothing reads the queue anymore
+            self.frame_queue.close()
+        finally:
+            # Every step runs, the first error is kept
+            for step in (self._close, self.write_gap_log, self._unregister_metrics):
+                try:
+                    step()
+                except Exception as exc:
+                    if self.error is None:
+                        self.error = exc
+
+
+def configure_camera(camera, frameRate=40, pix_format="Mono8", expTime=1000):
+    """Applies the acquisition settings to an opened camera."""
+    camera.AcquisitionFrameRateEnable.SetValue(True)
+    camera.AcquisitionFrameRateAbs.SetValue(frameRate)
+    camera.AcquisitionMode.SetValue("Continuous")
+    camera.PixelFormat.SetValue(pix_format)
+    camera.ExposureTimeAbs.SetValue(expTime)
+
+
+def open_cameras(frameRate=40, pix_format="Mono8", expTime=1000):
+    """Enumerates, opens and configures every camera and starts grabbing."""
+    tlFactory = pylon.TlFactory.GetInstance()
+    devices = tlFactory.EnumerateDevices()
+    cameras = []
+    for device in devices:
+        camera = pylon.InstantCamera(tlFactory.CreateDevice(device))
+        camera.Open()
+        configure_camera(camera, frameRate, pix_format, expTime)
+        camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        cameras.append(camera)
+    return cameras
+
+
+def _writable(nodemap, name):
+    node = nodemap.GetNode(name)
+    return node is not None and genicam.IsWritable(node)
+
+
+def check_geometry(camera, pixel_format, roi=None, binning=1, decimation=1):
+    """Raises ValueError if ``apply_geometry`` would leave part of the
+    geometry to the grab thread with a packed ``pixel_format``, whose frames
+    are not cropped. Call it on a camera that is not grabbing, the nodes are
+    only writable then."""
+    if not is_packed(pixel_format):
+        return
+    nodemap = camera.GetNodeMap()
+    for kind, factor in (("Binning", binning), ("Decimation", decimation)):
+        names = (f"{kind}Horizontal", f"{kind}Vertical")
+        if factor > 1 and not all(_writable(nodemap, name) for name in names):
+            raise ValueError(
+                f"The camera cannot do {kind.lower()} itself, which {pixel_format} "
+                "frames need"
+            )
+    if roi is not None and not all(
+        _writable(nodemap, name) for name in ("OffsetX", "OffsetY")
+    ):
+        raise ValueError(
+            f"The camera cannot crop to the ROI itself, which {pixel_format} "
+            "frames need"
+        )
+
+
+def apply_geometry(camera, roi=None, binning=1, decimation=1):
+    """Applies the region of interest, binning and decimation to a camera
+    that is not grabbing.
+
+    ``roi`` is (x, y, width, height) in sensor pixels, None for the full
+    sensor. Binning and decimation factors apply to both directions. Each is
+    set on the camera if its nodes are writable, otherwise the grab thread
+    does it on a view of the frame: a crop for the ROI and every n-th pixel
+    for decimation and binning (sampled, not summed). Packed pixel formats
+    cannot be cropped in software, see ``check_geometry``.
+
+    Returns the ``GrabThread.crop`` doing the rest in software, or None.
+    """
+    check_geometry(camera, camera.PixelFormat.GetValue(), roi, binning, decimation)
+    nodemap = camera.GetNodeMap()
+    hardware = software = 1
+    for kind, factor in (("Binning", binning), ("Decimation", decimation)):
+        names = (f"{kind}Horizontal", f"{kind}Vertical")
+        if all(_writable(nodemap, name) for name in names):
+            for name in names:
+                nodemap.GetNode(name).SetValue(factor)
+            hardware *= factor
+        else:
+            software *= factor
+
+    crop = None
+    if all(_writable(nodemap, name) for name in ("OffsetX", "OffsetY")):
+        camera.OffsetX.SetValue(0)
+        camera.OffsetY.SetValue(0)
+        if roi is None:
+            camera.Width.SetValue(camera.Width.GetMax())
+            camera.Height.SetValue(camera.Height.GetMax())
+        else:
+            # Camera ROI values are in binned pixels and must be multiples
+            # of the node increments
+            x, y, width, height = (value // hardware for value in roi)
+            for node, value in (
+                (camera.Width, width),
+                (camera.Height, height),
+                (camera.OffsetX, x),
+                (camera.OffsetY, y),
+            ):
+                value = min(value - value % node.GetInc(), node.GetMax())
+                node.SetValue(max(value, node.GetMin()))
+    elif roi is not None:
+        x, y, width, height = (value // hardware for value in roi)
+        crop = (slice(y, y + height), slice(x, x + width))
+    if software > 1:
+        rows, columns = crop or (slice(None), slice(None))
+        crop = (
+            slice(rows.start, rows.stop, software),
+            slice(columns.start, columns.stop, software),
+        )
+    return crop
+
+
+# Camera nodes of the settings handled by ``CameraManager``
+SETTING_NODES = {
+    "frame_rate": "AcquisitionFrameRateAbs",
+    "exposure": "ExposureTimeAbs",
+    "pixel_format": "PixelFormat",
+}
+# Settings that can be changed while the camera is grabbing
+LIVE_SETTINGS = ("frame_rate", "exposure")
+# Settings applied by ``apply_geometry``
+GEOMETRY_SETTINGS = {"roi": None, "binning": 1, "decimation": 1}
+
+
+def apply_settings(camera, **settings):
+    for name, value in settings.items():
+        getattr(camera, SETTING_NODES[name]).SetValue(value)
+
+
+class CameraManager:
+    """Keeps the cameras opened and grabbing across reconfigurations.
+
+    ``open()`` enumerates the cameras, then opens and configures them once,
+    concurrently on a thread pool, and starts the grab thread of each camera
+    as soon as it grabs. The engine is returned right away, so subscribers
+    see the frames of every camera as it comes up. ``wait_ready()`` waits for
+    all cameras and ``startup_report()`` times the phases of the startup.
+    ``reconfigure()`` compares the requested
+    settings with the current ones of each camera. The frame rate and
+    exposure are changed while the camera grabs, a new pixel format or
+    geometry (``roi``, ``binning``, ``decimation``, see ``apply_geometry``)
+    stops and restarts grabbing of that camera only, from its grab thread,
+    which keeps its subscribers. Cameras whose settings did not change, and the
+    recordings reading from them, are not touched.
+
+    The duration of every ``reconfigure()`` is kept in ``last_reconfigure``
+    and the ``camera_reconfigure_seconds`` histogram.
+    """
+
+    def __init__(self, restart_timeout=5.0, max_workers=None):
+        self.restart_timeout = restart_timeout
+        self.max_workers = max_workers
+        self.cameras = []
+        self.settings = []
+        self.engine = None
+        self.startup = {}
+        self.last_reconfigure = None
+        self.reconfigure_time = METRICS.histogram("camera_reconfigure_seconds")
+        self._startup_futures = []
+
+    def open(self, frame_rate=40, pixel_format="Mono8", exposure=1000):
+        start = time.perf_counter()
+        tlFactory = pylon.TlFactory.GetInstance()
+        devices = tlFactory.EnumerateDevices()
+        self.cameras = [
+            pylon.InstantCamera(tlFactory.CreateDevice(device)) for device in devices
+        ]
+        self.settings = [
+            {
+                "frame_rate": frame_rate,
+                "pixel_format": pixel_format,
+                "exposure": exposure,
+                **GEOMETRY_SETTINGS,
+            }
+            for _ in self.cameras
+        ]
+        self.startup = {
+            "start": start,
+            "enumerate_s": time.perf_counter() - start,
+            "cameras": [{} for _ in self.cameras],
+        }
+        self.engine = AcquisitionEngine(self.cameras)
+        if self.cameras:
+            executor = ThreadPoolExecutor(
+                self.max_workers or len(self.cameras), thread_name_prefix="open"
+            )
+            self._startup_futures = [
+                executor.submit(self._bring_up, idx, frame_rate, pixel_format, exposure)
+                for idx in range(len(self.cameras))
+            ]
+            executor.shutdown(wait=False)
+        return self.engine
+
+    def _bring_up(self, idx, frame_rate, pixel_format, exposure):
+        camera = self.cameras[idx]
+        timing = self.startup["cameras"][idx]
+        start = time.perf_counter()
+        try:
+            camera.Open()
+            opened = time.perf_counter()
+            timing["open_s"] = opened - start
+            configure_camera(camera, frame_rate, pixel_format, exposure)
+            # Clears the ROI left on the camera by an earlier session
+            apply_geometry(camera)
+            timing["configure_s"] = time.perf_counter() - opened
+            camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+            self.engine.threads[idx].start()
+        except Exception as exc:
+            # Any failure marks the camera failed, the startup report and
+            # wait_ready() must not wait for it
+            timing["error"] = str(exc)
+            raise
+
+    def wait_ready(self, timeout=None):
+        """Waits until every camera is opened and grabbing. Returns the
+        indices of the cameras that failed to come up."""
+        wait(self._startup_futures, timeout)
+        return [
+            idx
+            for idx, future in enumerate(self._startup_futures)
+            if future.done() and future.exception() is not None
+        ]
+
+    def startup_report(self):
+        """Returns the durations of the startup phases in seconds: the
+        enumeration, and per camera the open, the configuration and the time
+        from the start of ``open()`` to its first frame (None until then)."""
+        if not self.startup:
+            return {}
+        start = self.startup["start"]
+        cameras = []
+        for timing, thread in zip(self.startup["cameras"], self.engine.threads):
+            first_frame = thread.stats.first_frame
+            cameras.append(
+                dict(
+                    timing,
+                    first_frame_s=None if first_frame is None else first_frame - start,
+                )
+            )
+        first_frames = [c["first_frame_s"] for c in cameras]
+        return {
+            "enumerate_s": self.startup["enumerate_s"],
+            "cameras": cameras,
+            "all_first_frames_s": (
+                max(first_frames) if first_frames and None not in first_frames else None
+            ),
+        }
+
+    def reconfigure(self, camera_indices=None, **settings):
+        """Applies ``settings`` (``frame_rate``, ``pixel_format``,
+        ``exposure``, ``roi``, ``binning``, ``decimation``) to the cameras in
+        ``camera_indices``, all cameras by default. Returns a dict of camera
+        index to "unchanged", "live" or "restarted"."""
+        unknown = set(settings) - set(SETTING_NODES) - set(GEOMETRY_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown camera settings: {sorted(unknown)}")
+        if camera_indices is None:
+            camera_indices = range(len(self.cameras))
+        # Cameras that failed to come up are left alone
+        failed = self.wait_ready()
+        camera_indices = [idx for idx in camera_indices if idx not in failed]
+        start = time.perf_counter()
+        actions = {}
+        restarts = []
+        previous = {}
+        for idx in camera_indices:
+            current = self.settings[idx]
+            changes = {
+                name: value
+                for name, value in settings.items()
+                if current[name] != value
+            }
+            if not changes:
+                actions[idx] = "unchanged"
+            elif all(name in LIVE_SETTINGS for name in changes):
+                apply_settings(self.cameras[idx], **changes)
+                actions[idx] = "live"
+            else:
+                requested = {**current, **changes}
+                geometry = None
+                # The software crop depends on the pixel format too
+                if any(
+                    name in GEOMETRY_SETTINGS or name == "pixel_format"
+                    for name in changes
+                ):
+                    geometry = {name: requested[name] for name in GEOMETRY_SETTINGS}
+                # The restarts of several cameras run in parallel
+                done = self.engine.threads[idx].restart(
+                    functools.partial(
+                        self._restart_camera,
+                        idx,
+                        changes,
+                        geometry,
+                        requested["pixel_format"],
+                    )
+                )
+                restarts.append((idx, done))
+                previous[idx] = {name: current[name] for name in changes}
+                actions[idx] = "restarted"
+            current.update(changes)
+        for idx, done in restarts:
+            thread = self.engine.threads[idx]
+            if not done.wait(self.restart_timeout):
+                raise RuntimeError(f"Camera {idx} did not restart grabbing")
+            if thread.restart_error is not None:
+                # Rejected settings are checked before any is applied
+                self.settings[idx].update(previous[idx])
+                raise RuntimeError(
+                    f"Camera {idx} rejected the settings: {thread.restart_error}"
+                )
+        elapsed = time.perf_counter() - start
+        self.reconfigure_time.observe(elapsed)
+        self.last_reconfigure = {"seconds": elapsed, "cameras": actions}
+        return actions
+
+    def _restart_camera(self, idx, changes, geometry, pixel_format, camera):
+        # Runs on the grab thread while the camera is stopped
+        if geometry is not None:
+            check_geometry(camera, pixel_format, **geometry)
+        apply_settings(
+            camera,
+            **{name: value for name, value in changes.items() if name in SETTING_NODES},
+        )
+        if geometry is not None:
+            self.engine.threads[idx].crop = apply_geometry(camera, **geometry)
+
+    def close(self):
+        self.wait_ready()
+        if self.engine is not None:
+            self.engine.stop()
+        for camera in self.cameras:
+            camera.StopGrabbing()
+            camera.Close()
+
+
+if __name__ == "__main__":
+    # Shows that aggregate throughput scales with the number of emulated cameras
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--fps", type=float, default=100)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="time the parallel startup of the cameras instead",
+    )
+    args = parser.parse_args()
+
+    if args.startup:
+        for n in args.cams:
+            os.environ["PYLON_CAMEMU"] = str(n)
+            manager = CameraManager()
+            manager.open(frame_rate=args.fps)
+            manager.wait_ready()
+            deadline = time.perf_counter() + args.seconds
+            while time.perf_counter() < deadline:
+                report = manager.startup_report()
+                if report["all_first_frames_s"] is not None:
+                    break
+                time.sleep(0.001)
+            manager.close()
+            print(f"{n} cameras: enumerate {1000 * report['enumerate_s']:.0f} ms")
+            for idx, timing in enumerate(report["cameras"]):
+                if "error" in timing:
+                    print(f"  cam {idx}: {timing['error']}")
+                    continue
+                first_frame = timing["first_frame_s"]
+                print(
+                    f"  cam {idx}: open {1000 * timing['open_s']:.0f} ms, "
+                    f"configure {1000 * timing['configure_s']:.0f} ms, "
+                    "first frame "
+                    + (f"{1000 * first_frame:.0f} ms" if first_frame else "none")
+                )
+        raise SystemExit
+
+    for n in args.cams:
+        os.environ["PYLON_CAMEMU"] = str(n)
+        cameras = open_cameras(frameRate=args.fps)
+        engine = AcquisitionEngine(cameras)
+        consumers = [engine.subscribe(i, latest=True) for i in range(len(cameras))]
+        engine.start()
+        end = time.perf_counter() + args.seconds
+        while time.perf_counter() < end:
+            for frame_queue in consumers:
+                frame = frame_queue.get_latest()
+                if frame is not None:
+                    frame.release()
+            time.sleep(0.005)
+        engine.stop()
+        for camera in cameras:
+            camera.StopGrabbing()
+            camera.Close()
+        for cam_stats in engine.stats():
+            print(
+                f"  cam {cam_stats['camera']}: {cam_stats['fps']:.1f} fps, "
+                f"grab latency {cam_stats['latency_mean_ms']:.2f} ms "
+                f"(max {cam_stats['latency_max_ms']:.2f} ms), "
+                f"{cam_stats['pool_overruns']} overruns, "
+                f"{cam_stats['pool_dropped']} dropped"
+            )
+        print(f"{n} cameras: {engine.aggregate_fps():.1f} fps aggregate")
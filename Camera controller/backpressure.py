@@ -0,0 +1,223 @@
+import json
+import threading
+import time
+
+from segments import SegmentedWriter
+from writers import ChunkedCompressed_Writer, FFMPEG_VideoWriter
+
+# Degradation levels, in the order they are applied
+LEVELS = ("normal", "slow_preview", "no_preview", "cheap_writers", "drop_frames")
+# Cheapest level of each codec of the compressed writers. The level is not
+# stored per chunk, any level decodes the same. zlib level 0 stores the data
+# without compressing it, lz4 levels below 3 are all its fast mode and
+# negative zstd levels are its fast levels
+CHEAP_LEVELS = {"zlib": 0, "lz4": 0, "zstd": -5}
+# ffmpeg encoders taking a speed preset
+PRESET_CODECS = ("libx264", "libx265")
+
+
+def cheap_spec(writer_spec):
+    """Returns the spec of a cheaper writer of the same kind as
+    ``writer_spec``, or None if there is none: compressed writers at the
+    cheapest level of their codec, x264/x265 ffmpeg writers with the
+    ultrafast preset."""
+    writer_cls, args, kwargs = writer_spec
+    if issubclass(writer_cls, ChunkedCompressed_Writer):
+        level = CHEAP_LEVELS.get(kwargs.get("codec", "zlib"))
+        if level is not None and kwargs.get("level", 1) != level:
+            return (writer_cls, args, {**kwargs, "level": level})
+    elif issubclass(writer_cls, FFMPEG_VideoWriter):
+        if (
+            kwargs.get("codec") in PRESET_CODECS
+            and kwargs.get("preset", "medium") != "ultrafast"
+        ):
+            return (writer_cls, args, {**kwargs, "preset": "ultrafast"})
+    return None
+
+
+class LoadController(threading.Thread):
+    """Degrades the pipeline step by step when recording falls behind.
+
+    Every ``interval`` seconds the load of each camera is measured as the
+    larger of the fill level of its recording queues and the fraction of
+    time its grab thread spent handing frames to full queues. When the
+    highest load stays above ``high`` for ``escalate_after`` checks the
+    controller moves one level up ``LEVELS``:
+
+    1. slow_preview: the previews run at ``preview_fps``.
+    2. no_preview: the previews stop converting frames.
+    3. cheap_writers: compressed writers switch to the cheapest level of
+       their codec (zlib stops compressing), segmented writers start their
+       next segment with their fallback writer, or else with the cheaper
+       writer of ``cheap_spec``. Plain ffmpeg writers cannot change their
+       encoder settings while recording and are left alone.
+    4. drop_frames: lossless recordings stop holding up the grab threads,
+       their queues drop the oldest frames when full.
+
+    Once the load stays below ``low`` for ``recover_after`` checks it moves
+    back down one level, undoing the step. Segmented writers keep their
+    fallback or cheaper writer. Every transition is kept in ``transitions`` with a
+    timestamp, appended as a JSON line to ``log_file`` and passed to
+    ``on_transition``.
+    """
+
+    def __init__(
+        self,
+        engine,
+        previews=(),
+        interval=0.5,
+        high=0.75,
+        low=0.25,
+        escalate_after=2,
+        recover_after=10,
+        preview_fps=2,
+        log_file=None,
+        on_transition=None,
+    ):
+        super().__init__(name="load-controller", daemon=True)
+        self.engine = engine
+        self.previews = list(previews)
+        self.interval = interval
+        self.high = high
+        self.low = low
+        self.escalate_after = escalate_after
+        self.recover_after = recover_after
+        self.preview_fps = preview_fps
+        self.log_file = log_file
+        self.on_transition = on_transition
+        self.workers = []
+        self.level = 0
+        self.load = 0.0
+        self.transitions = []
+        self._above = 0
+        self._below = 0
+        self._preview_fps = {}
+        self._levels = {}
+        self._blocking = {}
+        self._previous = {}
+        self._stop_event = threading.Event()
+
+    def add(self, worker):
+        """Watches a ``RecordingWorker``, the current degradation is applied
+        to it."""
+        self.workers = self.workers + [worker]
+        if self.level >= LEVELS.index("cheap_writers"):
+            self._cheapen(worker)
+        if self.level >= LEVELS.index("drop_frames"):
+            self._unblock(worker)
+
+    def remove(self, worker):
+        self.workers = [w for w in self.workers if w is not worker]
+        self._levels.pop(id(worker), None)
+        self._blocking.pop(id(worker), None)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def measure(self):
+        """Returns the highest load of all cameras, 0 to 1."""
+        now = time.perf_counter()
+        load = 0.0
+        for thread in self.engine.threads:
+            # Time spent in FrameQueue.put, i.e. waiting for lossless queues
+            publish = thread.publish_time.total
+            previous = self._previous.get(thread.camera_idx)
+            self._previous[thread.camera_idx] = (now, publish)
+            if previous is not None and now > previous[0]:
+                load = max(load, (publish - previous[1]) / (now - previous[0]))
+        for worker in self.workers:
+            frame_queue = worker.frame_queue
+            load = max(load, frame_queue.qsize() / frame_queue.maxsize)
+        return min(load, 1.0)
+
+    def check(self):
+        """Takes one measurement and changes the level if due. Returns the
+        current level name."""
+        self.load = load = self.measure()
+        if load > self.high:
+            self._above += 1
+            self._below = 0
+        elif load < self.low:
+            self._below += 1
+            self._above = 0
+        else:
+            self._above = self._below = 0
+        if self._above >= self.escalate_after and self.level < len(LEVELS) - 1:
+            self._above = 0
+            self._set_level(self.level + 1, load)
+        elif self._below >= self.recover_after and self.level > 0:
+            self._below = 0
+            self._set_level(self.level - 1, load)
+        return LEVELS[self.level]
+
+    def _set_level(self, level, load):
+        step = LEVELS[max(level, self.level)]
+        apply = level > self.level
+        if step == "slow_preview":
+            for preview in self.previews:
+                if apply:
+                    self._preview_fps[id(preview)] = preview.fps
+                    preview.fps = min(preview.fps, self.preview_fps)
+                else:
+                    preview.fps = self._preview_fps.pop(id(preview), preview.fps)
+        elif step == "no_preview":
+            for preview in self.previews:
+                preview.paused = apply
+        elif step == "cheap_writers":
+            for worker in self.workers:
+                if apply:
+                    self._cheapen(worker)
+                else:
+                    self._restore_writer(worker)
+        elif step == "drop_frames":
+            for worker in self.workers:
+                if apply:
+                    self._unblock(worker)
+                else:
+                    self._restore_blocking(worker)
+        transition = {
+            "time": time.time(),
+            "from": LEVELS[self.level],
+            "to": LEVELS[level],
+            "load": load,
+        }
+        self.level = level
+        self.transitions.append(transition)
+        if self.log_file:
+            with open(self.log_file, "a") as file:
+                file.write(json.dumps(transition) + "\n")
+        if self.on_transition:
+            self.on_transition(transition)
+
+    def _cheapen(self, worker):
+        writer = worker.writer
+        if isinstance(writer, SegmentedWriter):
+            if not writer.downgrade():
+                spec = cheap_spec(writer.writer_spec)
+                if spec is not None:
+                    writer.downgrade(spec)
+        elif (
+            isinstance(writer, ChunkedCompressed_Writer)
+            and id(worker) not in self._levels
+        ):
+            self._levels[id(worker)] = writer.level
+            writer.level = CHEAP_LEVELS.get(writer.codec, writer.level)
+
+    def _restore_writer(self, worker):
+        level = self._levels.pop(id(worker), None)
+        if level is not None:
+            worker.writer.level = level
+
+    def _unblock(self, worker):
+        frame_queue = worker.frame_queue
+        if frame_queue.block and id(worker) not in self._blocking:
+            self._blocking[id(worker)] = True
+            frame_queue.block = False
+
+    def _restore_blocking(self, worker):
+        if self._blocking.pop(id(worker), False):
+            worker.frame_queue.block = True
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
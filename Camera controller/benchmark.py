@@ -0,0 +1,726 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from packed import (
+    PACKED_FORMATS,
+    frame_nbytes,
+    pack,
+    pixel_bits,
+    preview_8bit,
+    to_8bit,
+    unpack,
+)
+from preview import decimate, decimation_step
+from synthetic import synthetic_images
+from writers import (
+    FFMPEG_BINARY,
+    ChunkedCompressed_Writer,
+    Raw_Writer,
+    RawFile_Writer,
+    make_writer_spec,
+)
+
+# Numpy dtype of the frames delivered for each pixel format
+PIXEL_DTYPES = {
+    "Mono8": np.uint8,
+    "Mono10": np.uint16,
+    "Mono12": np.uint16,
+    "Mono16": np.uint16,
+    # Packed formats are stored as delivered
+    "Mono10p": np.uint8,
+    "Mono12p": np.uint8,
+}
+
+
+def synthetic_frames(n_frames, shape, dtype=np.uint8, pool=8):
+    """Yields ``n_frames`` frames cycling through ``pool`` synthetic images."""
+    images = synthetic_images(shape, dtype, pool)
+    for i in range(n_frames):
+        yield images[i % pool]
+
+
+def make_engine(source, n_cams, shape, pixel_format, fps):
+    """Returns a started-up but not yet running engine and its cameras."""
+    from acquisition import AcquisitionEngine, open_cameras
+
+    if source == "synthetic":
+        from synthetic import SyntheticEngine
+
+        engine = SyntheticEngine(
+            n_cams, shape, PIXEL_DTYPES[pixel_format], fps, pixel_format
+        )
+        return engine, []
+    os.environ["PYLON_CAMEMU"] = str(n_cams)
+    cameras = open_cameras(frameRate=fps, pix_format=pixel_format, expTime=100)
+    for camera in cameras:
+        camera.StopGrabbing()
+        camera.Width.SetValue(shape[1])
+        camera.Height.SetValue(shape[0])
+        camera.StartGrabbing()
+    return AcquisitionEngine(cameras), cameras
+
+
+def run_case(
+    source,
+    writer,
+    n_cams,
+    shape,
+    pixel_format,
+    fps,
+    seconds=5,
+    backend="thread",
+    ffmpeg_binary=FFMPEG_BINARY,
+    image_stats=False,
+):
+    """Records ``n_cams`` cameras for ``seconds`` and measures the pipeline
+    from grab to disk. With ``image_stats`` the live image statistics run
+    alongside (see ``imagestats.py``).
+
+    Returns a dict with the sustained written fps, dropped frames, p50/p99
+    grab-to-write latency (from the metadata sidecars), CPU use in percent of
+    one core and the MB/s written."""
+    from acquisition import RecordingWorker
+    from metadata import load_metadata
+    from multiproc import ProcessRecordingWorker
+
+    engine, cameras = make_engine(source, n_cams, shape, pixel_format, fps)
+    frame_bytes = frame_nbytes(shape, pixel_format, PIXEL_DTYPES[pixel_format])
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Raw_Writer keeps its temporary frames relative to the working
+        # directory
+        os.chdir(tmpdir)
+        try:
+            workers = []
+            for idx in range(n_cams):
+                frame_queue = engine.subscribe(idx, maxsize=64)
+                spec = make_writer_spec(
+                    writer, f"cam_{idx}", shape, fps, pixel_format, ffmpeg_binary
+                )
+                if backend == "process":
+                    worker = ProcessRecordingWorker(frame_queue, spec, tmpdir)
+                else:
+                    writer_cls, args, kwargs = spec
+                    worker = RecordingWorker(
+                        frame_queue, writer_cls(*args, **kwargs), tmpdir
+                    )
+                workers.append(worker)
+                worker.start()
+            stats_thread = None
+            if image_stats:
+                from imagestats import ImageStats
+
+                stats_thread = ImageStats(engine, pixel_format)
+                stats_thread.start()
+            cpu_start = os.times()
+            start = time.perf_counter()
+            engine.start()
+            time.sleep(seconds)
+            if stats_thread is not None:
+                stats_thread.stop()
+            for idx, worker in enumerate(workers):
+                engine.unsubscribe(idx, worker.frame_queue)
+                worker.stop()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            cpu_end = os.times()
+            engine.stop()
+            for camera in cameras:
+                camera.StopGrabbing()
+                camera.Close()
+            latencies = np.concatenate(
+                [
+                    load_metadata(os.path.join(tmpdir, f"{worker.filename}.meta"))[
+                        "latency"
+                    ]
+                    for worker in workers
+                ]
+            )
+        finally:
+            os.chdir(cwd)
+
+    cpu = sum(cpu_end[:4]) - sum(cpu_start[:4])
+    written = sum(worker.written for worker in workers)
+    dropped = sum(worker.frame_queue.dropped for worker in workers)
+    lost = sum(cam_stats["lost"] for cam_stats in engine.stats())
+    return {
+        "source": source,
+        "writer": writer,
+        "backend": backend,
+        "cameras": n_cams,
+        "width": shape[1],
+        "height": shape[0],
+        "pixel_format": pixel_format,
+        "target_fps": fps,
+        "seconds": elapsed,
+        "written_fps": written / elapsed,
+        "written_fps_per_camera": written / elapsed / n_cams,
+        "dropped": dropped + lost,
+        "latency_p50_ms": (
+            1000 * float(np.percentile(latencies, 50)) if len(latencies) else None
+        ),
+        "latency_p99_ms": (
+            1000 * float(np.percentile(latencies, 99)) if len(latencies) else None
+        ),
+        "cpu_percent": 100 * cpu / elapsed,
+        "MBps": written * frame_bytes / elapsed / 1e6,
+    }
+
+
+def sweep(
+    sources,
+    writers,
+    backends,
+    cam_counts,
+    resolutions,
+    pixel_formats,
+    frame_rates,
+    seconds,
+    ffmpeg_binary=FFMPEG_BINARY,
+):
+    """Runs ``run_case`` for every combination of the parameters."""
+    results = []
+    for case in itertools.product(
+        sources, writers, backends, cam_counts, resolutions, pixel_formats, frame_rates
+    ):
+        source, writer, backend, n_cams, shape, pixel_format, fps = case
+        if writer == "ffmpeg" and shutil.which(ffmpeg_binary) is None:
+            print(f"Skipping ffmpeg, '{ffmpeg_binary}' not found", file=sys.stderr)
+            continue
+        result = run_case(
+            source,
+            writer,
+            n_cams,
+            shape,
+            pixel_format,
+            fps,
+            seconds,
+            backend,
+            ffmpeg_binary,
+        )
+        print(
+            f"{source} {writer}/{backend} {n_cams}x {shape[1]}x{shape[0]} "
+            f"{pixel_format} @{fps:g}: {result['written_fps']:.0f} fps, "
+            f"{result['dropped']} dropped, p99 {result['latency_p99_ms'] or 0:.1f} ms, "
+            f"{result['cpu_percent']:.0f}% CPU, {result['MBps']:.0f} MB/s",
+            file=sys.stderr,
+        )
+        results.append(result)
+    return results
+
+
+def bench_metrics(
+    sources,
+    writers,
+    backends,
+    cam_counts,
+    resolutions,
+    pixel_formats,
+    frame_rates,
+    seconds,
+    ffmpeg_binary=FFMPEG_BINARY,
+    repeats=2,
+):
+    """Runs the ``sweep`` with the metric updates on and off (see
+    ``MetricsRegistry.enabled``), alternating ``repeats`` times to even out
+    drift. Writer processes keep their metrics.
+
+    Returns per case the mean CPU use, written fps and p99 latency of both
+    runs and the CPU overhead of the metrics in percent, and the cost of one
+    histogram update and one counter increment in us."""
+    from instrumentation import METRICS, Counter, Histogram
+
+    runs = {True: [], False: []}
+    try:
+        for _ in range(repeats):
+            for enabled in (True, False):
+                METRICS.enabled = enabled
+                runs[enabled].append(
+                    sweep(
+                        sources,
+                        writers,
+                        backends,
+                        cam_counts,
+                        resolutions,
+                        pixel_formats,
+                        frame_rates,
+                        seconds,
+                        ffmpeg_binary,
+                    )
+                )
+    finally:
+        METRICS.enabled = True
+
+    def mean(enabled, case, key):
+        values = [run[case][key] for run in runs[enabled]]
+        return sum(values) / len(values)
+
+    cases = []
+    for case, result in enumerate(runs[True][0]):
+        row = {
+            key: result[key]
+            for key in ("source", "writer", "backend", "cameras", "width", "height")
+        }
+        for key in ("cpu_percent", "written_fps", "latency_p99_ms"):
+            row[f"{key}_on"] = mean(True, case, key)
+            row[f"{key}_off"] = mean(False, case, key)
+        row["overhead_percent"] = (
+            100 * (row["cpu_percent_on"] - row["cpu_percent_off"])
+            / max(row["cpu_percent_off"], 1e-9)
+        )
+        cases.append(row)
+
+    histogram, counter = Histogram(), Counter()
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        histogram.observe(1e-4)
+    observe_us = 1e6 * (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for _ in range(n):
+        counter.inc()
+    inc_us = 1e6 * (time.perf_counter() - start) / n
+    return {"cases": cases, "observe_us": observe_us, "inc_us": inc_us}
+
+
+def environment():
+    import numpy
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(height), int(width)
+
+
+def bench_writer(make_writer, n_frames, shape, dtype=np.uint8):
+    """Writes ``n_frames`` synthetic frames in a temporary directory.
+
+    Returns a dict with the sustained write rate in MB/s (frames only) and
+    the time spent in ``close()``."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Raw_Writer keeps its temporary frames relative to the working
+        # directory
+        os.chdir(tmpdir)
+        try:
+            writer = make_writer()
+            frame_bytes = 0
+            start = time.perf_counter()
+            for frame in synthetic_frames(n_frames, shape, dtype):
+                writer.write_frame(frame, tmpdir)
+                frame_bytes += frame.nbytes
+            write_time = time.perf_counter() - start
+            start = time.perf_counter()
+            writer.close()
+            close_time = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return {
+        "frames": n_frames,
+        "write_s": write_time,
+        "write_MBps": frame_bytes / write_time / 1e6,
+        "close_s": close_time,
+        "total_MBps": frame_bytes / (write_time + close_time) / 1e6,
+        "writer_stats": writer.stats() if hasattr(writer, "stats") else None,
+    }
+
+
+def bench_raw_writers(n_frames=500, shape=(1040, 1024), codec="zlib", level=1):
+    return {
+        "Raw_Writer": bench_writer(
+            lambda: Raw_Writer("bench_output.npz"), n_frames, shape
+        ),
+        "RawFile_Writer": bench_writer(
+            lambda: RawFile_Writer("bench_output.raw"), n_frames, shape
+        ),
+        "ChunkedCompressed_Writer": bench_writer(
+            lambda: ChunkedCompressed_Writer(
+                "bench_output.bcz", codec=codec, level=level, filters=("delta",)
+            ),
+            n_frames,
+            shape,
+        ),
+    }
+
+
+# Journal settings of the raw writers compared by bench_durability
+DURABILITY_SETTINGS = {
+    "no_journal": {"sync_frames": None, "sync_seconds": None},
+    "sync_1s": {"sync_frames": None, "sync_seconds": 1.0},
+    "sync_64_frames": {"sync_frames": 64, "sync_seconds": None},
+    "sync_every_frame": {"sync_frames": 1, "sync_seconds": None},
+}
+
+
+def bench_durability(n_frames=500, shape=(1040, 1024)):
+    """Write rate of ``RawFile_Writer`` and ``Raw_Writer`` for each of the
+    ``DURABILITY_SETTINGS``, with the number of journal commits and the time
+    spent in them."""
+    results = {}
+    for writer_cls, filename in (
+        (RawFile_Writer, "bench_output.raw"),
+        (Raw_Writer, "bench_output.npz"),
+    ):
+        for name, settings in DURABILITY_SETTINGS.items():
+            writers = []
+
+            def make_writer():
+                writers.append(writer_cls(filename, **settings))
+                return writers[-1]
+
+            result = bench_writer(make_writer, n_frames, shape)
+            journal = writers[0].journal
+            result["commits"] = journal.commits if journal else 0
+            result["sync_s"] = journal.sync_time if journal else 0.0
+            results[f"{writer_cls.__name__}/{name}"] = result
+    return results
+
+
+def bench_unpack(shape=(1040, 1024), repeats=20):
+    """Measures the unpacking and 8-bit tone mapping of the packed formats.
+
+    Returns a dict per format with the stored bytes relative to uint16 and
+    the throughput in MPix/s of ``unpack``, ``to_8bit`` and the whole
+    preview conversion."""
+    results = {}
+    for pixel_format in PACKED_FORMATS:
+        shift = 16 - pixel_bits(pixel_format)
+        image = synthetic_images(shape, np.uint16, 1)[0] >> shift
+        packed = pack(image, pixel_format)
+        timings = {}
+        for name, func, arg in (
+            ("unpack", lambda a: unpack(a, pixel_format), packed),
+            ("to_8bit", lambda a: to_8bit(a, pixel_bits(pixel_format)), image),
+            ("preview", lambda a: preview_8bit(a, pixel_format), packed),
+        ):
+            func(arg)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                func(arg)
+            elapsed = (time.perf_counter() - start) / repeats
+            timings[f"{name}_MPixps"] = image.size / elapsed / 1e6
+        results[pixel_format] = {"bytes_vs_uint16": packed.nbytes / image.nbytes}
+        results[pixel_format].update(timings)
+    return results
+
+
+def bench_preview(shape=(1040, 1024), tile=(250, 250), repeats=50):
+    """Compares the time to make a full resolution 8-bit preview image with
+    the decimated thumbnails of ``preview.py``, in ms per frame."""
+    results = {}
+    step = decimation_step(shape, tile)
+    for pixel_format in ("Mono8", "Mono12", "Mono12p"):
+        bits = pixel_bits(pixel_format)
+        image = synthetic_images(shape, np.uint16, 1)[0] >> (16 - bits)
+        if pixel_format == "Mono8":
+            image = image.astype(np.uint8)
+        frame = pack(image, pixel_format) if pixel_format in PACKED_FORMATS else image
+        timings = {}
+        for name, func in (
+            ("full_ms", lambda: preview_8bit(frame, pixel_format).copy()),
+            ("stride_ms", lambda: decimate(frame, step, pixel_format)),
+            ("bin_ms", lambda: decimate(frame, step, pixel_format, "bin")),
+        ):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                func()
+            timings[name] = 1000 * (time.perf_counter() - start) / repeats
+        results[pixel_format] = timings
+    return results
+
+
+def bench_image_stats(
+    n_cams=2, shape=(1040, 1024), fps=200, seconds=5, pixel_format="Mono8"
+):
+    """Records synthetic cameras with and without the live image statistics.
+
+    Returns the two ``run_case`` results and the cost of one statistics
+    update in ms, full resolution for comparison."""
+    from imagestats import frame_stats
+
+    results = {
+        name: run_case(
+            "synthetic",
+            "raw_file",
+            n_cams,
+            shape,
+            pixel_format,
+            fps,
+            seconds,
+            image_stats=image_stats,
+        )
+        for name, image_stats in (("without", False), ("with", True))
+    }
+    image = synthetic_images(shape, PIXEL_DTYPES[pixel_format], 1)[0]
+    for name, step in (("stats_ms", 4), ("full_ms", 1)):
+        start = time.perf_counter()
+        for _ in range(20):
+            frame_stats(image, pixel_format, step)
+        results[name] = 1000 * (time.perf_counter() - start) / 20
+    return results
+
+
+def bench_recording_backends(
+    cam_counts=(1, 2, 4, 8), seconds=5, fps=200, writer_cls=ChunkedCompressed_Writer
+):
+    """Records emulated cameras with in-process ``RecordingWorker`` threads
+    and with ``ProcessRecordingWorker`` writer processes.
+
+    Returns a list of dicts with the number of cameras, the backend and the
+    frames written per second over all cameras."""
+    from acquisition import AcquisitionEngine, RecordingWorker, open_cameras
+    from multiproc import ProcessRecordingWorker
+
+    results = []
+    for n_cams in cam_counts:
+        for backend in ("thread", "process"):
+            os.environ["PYLON_CAMEMU"] = str(n_cams)
+            cameras = open_cameras(frameRate=fps, expTime=100)
+            engine = AcquisitionEngine(cameras)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                workers = []
+                for idx in range(n_cams):
+                    frame_queue = engine.subscribe(idx, maxsize=64)
+                    spec = (writer_cls, (f"cam_{idx}_bench",), {})
+                    if backend == "thread":
+                        worker = RecordingWorker(
+                            frame_queue, writer_cls(*spec[1], **spec[2]), tmpdir
+                        )
+                    else:
+                        worker = ProcessRecordingWorker(frame_queue, spec, tmpdir)
+                    workers.append(worker)
+                    worker.start()
+                engine.start()
+                time.sleep(seconds)
+                for idx, worker in enumerate(workers):
+                    engine.unsubscribe(idx, worker.frame_queue)
+                    worker.stop()
+                for worker in workers:
+                    worker.join()
+                engine.stop()
+            for camera in cameras:
+                camera.StopGrabbing()
+                camera.Close()
+            grabbed = sum(cam_stats["frames"] for cam_stats in engine.stats())
+            written = sum(worker.written for worker in workers)
+            dropped = sum(worker.frame_queue.dropped for worker in workers)
+            results.append(
+                {
+                    "cameras": n_cams,
+                    "backend": backend,
+                    "grabbed_fps": grabbed / seconds,
+                    "written_fps": written / seconds,
+                    "dropped": dropped,
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Headless benchmarks of the acquisition and writer paths"
+    )
+    parser.add_argument(
+        "--source", nargs="+", default=["synthetic"], choices=["synthetic", "camemu"]
+    )
+    parser.add_argument(
+        "--writers",
+        nargs="+",
+        default=["raw_file", "compressed"],
+        choices=["raw_npz", "raw_file", "compressed", "ffmpeg"],
+    )
+    parser.add_argument(
+        "--backend", nargs="+", default=["thread"], choices=["thread", "process"]
+    )
+    parser.add_argument("--cams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--resolutions", nargs="+", default=["1024x1040"], help="WIDTHxHEIGHT"
+    )
+    parser.add_argument(
+        "--pixel-formats", nargs="+", default=["Mono8"], choices=list(PIXEL_DTYPES)
+    )
+    parser.add_argument("--fps", type=float, nargs="+", default=[100])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--ffmpeg", default=FFMPEG_BINARY)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--close-time",
+        action="store_true",
+        help="compare the sustained MB/s and close time of the raw writers",
+    )
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--codec", default="zlib")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument(
+        "--backends",
+        action="store_true",
+        help="compare in-process and per-camera process recording",
+    )
+    parser.add_argument(
+        "--unpack",
+        action="store_true",
+        help="measure unpacking and tone mapping of the packed pixel formats",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="compare full resolution and decimated preview conversion",
+    )
+    parser.add_argument(
+        "--durability",
+        action="store_true",
+        help="compare the raw writers with different journal sync settings",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="run the sweep with the metric updates on and off",
+    )
+    parser.add_argument(
+        "--image-stats",
+        action="store_true",
+        help="compare recording latency with and without live image statistics",
+    )
+    args = parser.parse_args()
+
+    if args.durability:
+        height, width = parse_resolution(args.resolutions[0])
+        for name, result in bench_durability(args.frames, (height, width)).items():
+            print(
+                f"{name}: {result['write_MBps']:.0f} MB/s, "
+                f"{result['commits']} commits, {result['sync_s']:.3f} s syncing"
+            )
+        raise SystemExit
+
+    if args.metrics:
+        results = bench_metrics(
+            args.source,
+            args.writers,
+            args.backend,
+            args.cams,
+            [parse_resolution(r) for r in args.resolutions],
+            args.pixel_formats,
+            args.fps,
+            args.seconds,
+            args.ffmpeg,
+        )
+        for case in results["cases"]:
+            print(
+                f"{case['writer']}/{case['backend']} {case['cameras']}x "
+                f"{case['width']}x{case['height']}: "
+                f"{case['cpu_percent_on']:.1f}% CPU with metrics, "
+                f"{case['cpu_percent_off']:.1f}% without "
+                f"({case['overhead_percent']:+.2f}%), "
+                f"{case['written_fps_on']:.0f}/{case['written_fps_off']:.0f} fps"
+            )
+        print(
+            f"one histogram update {results['observe_us']:.3f} us, "
+            f"one counter increment {results['inc_us']:.3f} us"
+        )
+        raise SystemExit
+
+    if args.image_stats:
+        height, width = parse_resolution(args.resolutions[0])
+        results = bench_image_stats(
+            args.cams[0], (height, width), args.fps[0], args.seconds
+        )
+        for name in ("without", "with"):
+            result = results[name]
+            print(
+                f"{name} image stats: {result['written_fps']:.0f} fps written, "
+                f"{result['dropped']} dropped, "
+                f"latency p50 {result['latency_p50_ms']:.2f} ms, "
+                f"p99 {result['latency_p99_ms']:.2f} ms, "
+                f"{result['cpu_percent']:.0f}% CPU"
+            )
+        print(
+            f"one update {results['stats_ms']:.2f} ms per camera "
+            f"({results['full_ms']:.2f} ms at full resolution)"
+        )
+        raise SystemExit
+
+    if args.preview:
+        height, width = parse_resolution(args.resolutions[0])
+        for name, result in bench_preview((height, width)).items():
+            print(
+                f"{name}: full {result['full_ms']:.2f} ms, "
+                f"stride {result['stride_ms']:.2f} ms, "
+                f"bin {result['bin_ms']:.2f} ms per frame"
+            )
+        raise SystemExit
+
+    if args.unpack:
+        height, width = parse_resolution(args.resolutions[0])
+        for name, result in bench_unpack((height, width)).items():
+            print(
+                f"{name}: {100 * result['bytes_vs_uint16']:.1f}% of uint16, "
+                f"unpack {result['unpack_MPixps']:.0f} MPix/s, "
+                f"to_8bit {result['to_8bit_MPixps']:.0f} MPix/s, "
+                f"preview {result['preview_MPixps']:.0f} MPix/s"
+            )
+        raise SystemExit
+
+    if args.close_time:
+        height, width = parse_resolution(args.resolutions[0])
+        results = bench_raw_writers(
+            args.frames, (height, width), args.codec, args.level
+        )
+        for name, result in results.items():
+            print(
+                f"{name}: {result['write_MBps']:.0f} MB/s sustained, "
+                f"close {result['close_s']:.3f} s, "
+                f"{result['total_MBps']:.0f} MB/s including close"
+            )
+            if result["writer_stats"]:
+                print(
+                    f"  ratio {result['writer_stats']['ratio']:.2f}, "
+                    f"{result['writer_stats']['MBps_per_thread']:.0f} MB/s per "
+                    "compression thread"
+                )
+        raise SystemExit
+
+    if args.backends:
+        for result in bench_recording_backends(args.cams):
+            print(
+                f"{result['cameras']} cameras, {result['backend']}: "
+                f"{result['written_fps']:.0f} frames/s written of "
+                f"{result['grabbed_fps']:.0f} grabbed, "
+                f"{result['dropped']} dropped"
+            )
+        raise SystemExit
+
+    results = sweep(
+        args.source,
+        args.writers,
+        args.backend,
+        args.cams,
+        [parse_resolution(r) for r in args.resolutions],
+        args.pixel_formats,
+        args.fps,
+        args.seconds,
+        args.ffmpeg,
+    )
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class FrameLease:
+    """A lease on one buffer of a ``FramePool``.
+
+    ``array`` is a read-only view of the pooled buffer. The buffer goes back
+    to the pool once every holder called ``release()``, after that the view
+    must not be used anymore.
+    """
+
+    __slots__ = ("pool", "index", "array", "refs")
+
+    def __init__(self, pool, index, array):
+        self.pool = pool
+        self.index = index
+        self.array = array
+        self.refs = 0
+
+    def retain(self, count=1):
+        with self.pool._lock:
+            self.refs += count
+
+    def release(self):
+        self.pool._release(self)
+
+    def drop(self):
+        """Releases the lease of a frame that no consumer has seen."""
+        with self.pool._lock:
+            self.pool.dropped += 1
+        self.pool._release(self)
+
+
+class FramePool:
+    """A fixed-size ring of preallocated Numpy buffers for one camera.
+
+    Grabbed data is copied once into a free buffer, consumers get read-only
+    views through ``FrameLease`` objects.
+
+    Parameters
+    -----------
+
+    shape
+      Shape of one frame, (height, width).
+
+    dtype
+      Numpy dtype of one frame.
+
+    size
+      Number of buffers in the pool.
+
+    Counters
+    -----------
+
+    overruns
+      Number of frames that arrived while every buffer was leased. These
+      frames are lost.
+
+    dropped
+      Number of frames discarded from a full consumer queue before they were
+      read, i.e. a consumer fell behind. Frames that preview-like consumers
+      skip on purpose (see ``FrameQueue.latest``) are not counted.
+    """
+
+    def __init__(self, shape, dtype, size=16):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.buffers = np.empty((size,) + self.shape, dtype=self.dtype)
+        self.acquired = 0
+        self.overruns = 0
+        self.dropped = 0
+        self._free = deque(range(size))
+        self._leases = []
+        for index in range(size):
+            view = self.buffers[index].view()
+            view.flags.writeable = False
+            self._leases.append(FrameLease(self, index, view))
+        self._lock = threading.Condition()
+
+    def matches(self, shape, dtype):
+        return self.shape == tuple(shape) and self.dtype == dtype
+
+    def acquire(self, refs=1, timeout=0):
+        """Returns a free lease held ``refs`` times, or None on overrun.
+
+        With a ``timeout`` (in seconds, None waits forever) the call waits for
+        a consumer to release a buffer before giving up."""
+        with self._lock:
+            if not self._free and (
+                timeout == 0 or not self._lock.wait_for(lambda: self._free, timeout)
+            ):
+                self.overruns += 1
+                return None
+            lease = self._leases[self._free.popleft()]
+            lease.refs = refs
+            self.acquired += 1
+            return lease
+
+    def fill(self, lease, array):
+        """Copies ``array`` into the buffer of ``lease``."""
+        np.copyto(self.buffers[lease.index], array)
+
+    def _release(self, lease):
+        with self._lock:
+            lease.refs -= 1
+            if lease.refs == 0:
+                self._free.append(lease.index)
+                self._lock.notify()
+
+    def in_use(self):
+        with self._lock:
+            return self.size - len(self._free)
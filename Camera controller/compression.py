@@ -0,0 +1,92 @@
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_codecs():
+    """Returns the names of the codecs usable in this environment."""
+    codecs = ["none", "zlib"]
+    if lz4_frame is not None:
+        codecs.append("lz4")
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+
+def check_codec(codec):
+    if codec not in available_codecs():
+        raise ValueError(
+            f"Codec '{codec}' is not available, choose one of {available_codecs()}. "
+            "lz4 and zstd need the 'lz4' and 'zstandard' packages."
+        )
+
+
+def compress(data, codec="zlib", level=1):
+    if codec == "none":
+        return bytes(data)
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "lz4":
+        return lz4_frame.compress(data, compression_level=level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    check_codec(codec)
+
+
+def decompress(data, codec="zlib"):
+    if codec == "none":
+        return data
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "lz4":
+        return lz4_frame.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    check_codec(codec)
+
+
+def apply_filters(chunk, filters):
+    """Returns the bytes of a (frames, height, width) chunk after the filters.
+
+    'delta' stores every frame but the first as the difference to the
+    previous one, which is mostly zeros for static scenes. 'shuffle' groups
+    the bytes of multi-byte pixels by significance."""
+    if "delta" in filters:
+        delta = np.empty_like(chunk)
+        delta[0] = chunk[0]
+        np.subtract(chunk[1:], chunk[:-1], out=delta[1:])
+        chunk = delta
+    data = chunk.view(np.uint8).reshape(-1)
+    if "shuffle" in filters and chunk.itemsize > 1:
+        data = np.ascontiguousarray(data.reshape(-1, chunk.itemsize).T).reshape(-1)
+    return data
+
+
+def undo_filters(data, n_frames, shape, dtype, filters):
+    """Inverse of ``apply_filters``, returns the (frames, height, width) chunk."""
+    dtype = np.dtype(dtype)
+    data = np.frombuffer(data, dtype=np.uint8)
+    if "shuffle" in filters and dtype.itemsize > 1:
+        data = np.ascontiguousarray(data.reshape(dtype.itemsize, -1).T)
+    chunk = data.view(dtype).reshape((n_frames, *shape))
+    if "delta" in filters:
+        chunk = np.cumsum(chunk, axis=0, dtype=dtype)
+    return chunk
+
+
+def encode_chunk(chunk, codec="zlib", level=1, filters=()):
+    return compress(apply_filters(chunk, filters), codec, level)
+
+
+def decode_chunk(data, n_frames, shape, dtype, codec="zlib", filters=()):
+    return undo_filters(decompress(data, codec), n_frames, shape, dtype, filters)
@@ -1,24 +1,44 @@
+import time
+
+# Start of the startup timing report, before any other import
+IMPORT_START = time.perf_counter()
+import math
 import os
 import sys
-import time
-from pypylon import pylon
-from PySide6.QtCore import QObject, Qt, QThread, QTimer, Signal, Slot
-from PySide6.QtGui import QImage, QPixmap, QAction
+
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QImage, QPixmap, QAction, QPainter, QPen
 from PySide6.QtWidgets import (
     QApplication,
+    QCheckBox,
     QComboBox,
     QGridLayout,
     QHBoxLayout,
     QLabel,
     QLineEdit,
     QPushButton,
+    QSpinBox,
     QVBoxLayout,
     QWidget,
     QMainWindow,
     QFileDialog,
 )
+from backpressure import LEVELS, LoadController
+from instrumentation import METRICS, MetricsExporter
+from preview import Mosaic, PreviewSource
+from segments import DiskMonitor, SegmentedWriter
 from settings import SettingsWindow
-from writers import FFMPEG_VideoWriter, Raw_Writer
+from writers import (
+    ChunkedCompressed_Writer,
+    FFMPEG_VideoWriter,
+    Raw_Writer,
+    RawFile_Writer,
+    ffmpeg_pixfmt,
+)
+
+# pypylon (with acquisition.py) is imported when the cameras are opened,
+# writer processes, pre-roll and image statistics when they are switched on
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 
 # No of virtual cameras
@@ -26,32 +46,138 @@ os.environ["PYLON_CAMEMU"] = "2"
 n_cams = int(os.environ["PYLON_CAMEMU"])
 # n_cams = 1
 
-
-# Creates the signals to send the array
-class RecordingAgents(QObject):
-    for i in range(n_cams):
-        name = f"array_signal_{i}"
-        locals()[name] = Signal(tuple)
+# Pre-roll length and the memory shared by the pre-roll of all cameras
+PREROLL_SECONDS = 5
+PREROLL_MAX_MB = 1024
+# Length of the segments of segmented recordings
+SEGMENT_SECONDS = 300
+# Default preview rate, the thumbnails do not follow the acquisition rate
+PREVIEW_FPS = 15
+PREVIEW_TILE = (250, 250)
+# Size of the mosaic preview of all cameras
+MOSAIC_SIZE = (500, 980)
+# Rate of the live image statistics under each tile
+IMAGE_STATS_RATE = 2
+# Refresh interval of the stats panel and of the metrics export in ms
+STATS_INTERVAL_MS = 1000
+
+
+def format_metrics(rows):
+    """One line per metric of a ``MetricsRegistry.snapshot()``, durations
+    in ms."""
+    lines = []
+    for row in rows:
+        labels = " ".join(f"{value}" for value in row["labels"].values())
+        if row["type"] == "histogram":
+            if not row["count"]:
+                continue
+            lines.append(
+                f"{row['name']:<28} {labels:<24} "
+                f"mean {row['mean'] * 1e3:7.3f}  p99 {row['p99'] * 1e3:7.3f}  "
+                f"max {row['max'] * 1e3:7.3f} ms"
+            )
+        else:
+            lines.append(f"{row['name']:<28} {labels:<24} {row['value']}")
+    return "\n".join(lines)
+
+
+class MosaicWidget(QWidget):
+    """Paints the thumbnails of all cameras from one ``Mosaic`` buffer, with
+    a recording frame and an fps overlay per tile."""
+
+    def __init__(self, mosaic, parent=None):
+        super().__init__(parent)
+        self.mosaic = mosaic
+        buffer = mosaic.buffer
+        # Wraps the buffer without a copy, tiles written later show up too
+        self.image = QImage(
+            buffer,
+            buffer.shape[1],
+            buffer.shape[0],
+            buffer.strides[0],
+            QImage.Format_Grayscale8,
+        )
+        self.overlays = [("", False)] * mosaic.n_tiles
+        self.setFixedSize(buffer.shape[1], buffer.shape[0])
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawImage(0, 0, self.image)
+        for idx, (text, recording) in enumerate(self.overlays):
+            x, y, width, height = self.mosaic.tile_rect(idx)
+            if recording:
+                painter.setPen(QPen(Qt.red, 3))
+            else:
+                painter.setPen(QPen(Qt.darkGray, 1))
+            painter.drawRect(x + 1, y + 1, width - 3, height - 3)
+            painter.setPen(Qt.green)
+            painter.drawText(x + 6, y + 16, text)
+        painter.end()
 
 
 class CameraStream(QMainWindow):
-    recordSignal = Signal(tuple)
-
     def __init__(self):
         super().__init__()
 
-        self.recording_threads = [None] * n_cams
-        self.recordingAgent = RecordingAgents()
+        self.recording_workers = [None] * n_cams
+        self.engine = None
+        self.preroll = None
         self.fileLocation = (
             "."  # Current directory is default file location for storing output
         )
         self.counter = 0
         self.initUI()
         self.runCameras()
+        # Warns about the disk, segmented recordings fall back to the
+        # compressed writer when it cannot keep up
+        self.diskMonitor = DiskMonitor(self.fileLocation, downgrade=True)
+        self.diskMonitor.start()
+        self.diskWarning = None
+        # Degrades the preview, then the writers when recording falls behind
+        self.loadController = LoadController(
+            self.engine,
+            self.previews,
+            log_file=os.path.join(self.fileLocation, "load_controller.jsonl"),
+        )
+        self.loadController.start()
+        self.loadLevel = 0
+        # Reports the startup once every camera delivered its first frame
+        self.startupTimer = QTimer(self)
+        self.startupTimer.timeout.connect(self.reportStartup)
+        self.startupTimer.start(50)
+
+    def reportStartup(self):
+        report = self.cameraManager.startup_report()
+        cameras = report["cameras"]
+        failed = [idx for idx, timing in enumerate(cameras) if "error" in timing]
+        pending = [
+            idx
+            for idx, timing in enumerate(cameras)
+            if timing.get("first_frame_s") is None and idx not in failed
+        ]
+        if pending:
+            return
+        self.startupTimer.stop()
+        opened = [timing for timing in cameras if "error" not in timing]
+        message = (
+            f"Startup: import {1000 * IMPORT_SECONDS:.0f} ms, "
+            f"import pylon {1000 * self.pylonImportSeconds:.0f} ms, "
+            f"enumerate {1000 * report['enumerate_s']:.0f} ms"
+        )
+        if opened:
+            message += (
+                f", open {1000 * max(t['open_s'] for t in opened):.0f} ms, "
+                f"configure {1000 * max(t['configure_s'] for t in opened):.0f} ms, "
+                "first frames after "
+                f"{1000 * max(t['first_frame_s'] for t in opened):.0f} ms"
+            )
+        if failed:
+            message += f", cameras {failed} failed to open"
+        print(message)
+        self.statusBar().showMessage(message)
 
     def initUI(self):
         self.setWindowTitle("Basler Camera Stream")
-        self.recordSignal.connect(self.startRecordingThread)
         self.setFixedSize(1000, 950)
         widget = QWidget(self)
         menuBar = self.menuBar()
@@ -59,16 +185,55 @@ class CameraStream(QMainWindow):
         fileSaveAction = QAction("Save At", self)
         fileSaveAction.triggered.connect(self.getFileLocation)
         fileMenu.addAction(fileSaveAction)
+        exportAction = QAction("Export Metrics", self)
+        exportAction.triggered.connect(self.exportMetrics)
+        fileMenu.addAction(exportAction)
+        self.metricsExporter = None
 
         settingsMenu = menuBar.addMenu("&Settings")
         settingsAction = QAction("Open", self)
         settingsAction.triggered.connect(self.getCameraParams)
         settingsMenu.addAction(settingsAction)
+        self.processAction = QAction("Writer Process Per Camera", self)
+        self.processAction.setCheckable(True)
+        settingsMenu.addAction(self.processAction)
+        self.prerollAction = QAction(
+            f"Pre-roll Recording ({PREROLL_SECONDS} s)", self
+        )
+        self.prerollAction.setCheckable(True)
+        self.prerollAction.toggled.connect(self.togglePreRoll)
+        settingsMenu.addAction(self.prerollAction)
+        self.segmentAction = QAction(
+            f"Segment Recordings ({SEGMENT_SECONDS // 60} min)", self
+        )
+        self.segmentAction.setCheckable(True)
+        settingsMenu.addAction(self.segmentAction)
+        self.mosaicAction = QAction("Mosaic Preview", self)
+        self.mosaicAction.setCheckable(True)
+        self.mosaicAction.toggled.connect(self.toggleMosaic)
+        settingsMenu.addAction(self.mosaicAction)
+        self.mosaic = None
+        self.mosaicWidget = None
+        self.statsAction = QAction("Pipeline Stats", self)
+        self.statsAction.setCheckable(True)
+        self.statsAction.toggled.connect(self.toggleStats)
+        settingsMenu.addAction(self.statsAction)
+        self.imageStatsAction = QAction("Image Statistics", self)
+        self.imageStatsAction.setCheckable(True)
+        self.imageStatsAction.toggled.connect(self.toggleImageStats)
+        settingsMenu.addAction(self.imageStatsAction)
+        self.imageStats = None
 
         # Create labels and record buttons for displaying video streams
         self.labels = []
         self.stop_record_buttons = []
         self.combo_boxes = []
+        self.lossless_boxes = []
+        self.lost_labels = []
+        self.preview_fps_boxes = []
+        self.image_stats_labels = []
+        self.histogram_labels = []
+        self.shown_stats = [None] * n_cams
         self.is_recording = [False] * n_cams
 
         for k in range(n_cams):
@@ -78,8 +243,31 @@ class CameraStream(QMainWindow):
             self.labels.append(label)
             combobox = QComboBox()
             combobox.setPlaceholderText("Choose Recording Method")
-            combobox.addItems(["Raw_writer", "FFmpeg"])
+            combobox.addItems(["Raw_writer", "Raw_file", "Compressed", "FFmpeg"])
             self.combo_boxes.append(combobox)
+            lossless_box = QCheckBox("Lossless", self)
+            lossless_box.setToolTip(
+                "Record with GrabStrategy_OneByOne so that no frame is skipped"
+            )
+            self.lossless_boxes.append(lossless_box)
+            lost_label = QLabel("Lost: 0", self)
+            self.lost_labels.append(lost_label)
+            preview_fps_box = QSpinBox(self)
+            preview_fps_box.setRange(1, 60)
+            preview_fps_box.setValue(PREVIEW_FPS)
+            preview_fps_box.setSuffix(" fps")
+            preview_fps_box.setToolTip("Preview rate")
+            preview_fps_box.valueChanged.connect(
+                lambda value, cnt=k: setattr(self.previews[cnt], "fps", value)
+            )
+            self.preview_fps_boxes.append(preview_fps_box)
+            image_stats_label = QLabel(self)
+            image_stats_label.setStyleSheet("font-size: 10px;")
+            image_stats_label.setVisible(False)
+            self.image_stats_labels.append(image_stats_label)
+            histogram_label = QLabel(self)
+            histogram_label.setVisible(False)
+            self.histogram_labels.append(histogram_label)
             button = QPushButton("Stop Recording", self)
             self.stop_record_buttons.append(button)
             button.clicked.connect(
@@ -96,18 +284,35 @@ class CameraStream(QMainWindow):
             layout = QVBoxLayout()
             layout.addWidget(self.labels[i])
             layout.addWidget(self.combo_boxes[i])
+            recordOptions = QHBoxLayout()
+            recordOptions.addWidget(self.lossless_boxes[i])
+            recordOptions.addWidget(self.lost_labels[i])
+            recordOptions.addWidget(self.preview_fps_boxes[i])
+            layout.addLayout(recordOptions)
+            imageStatsLayout = QHBoxLayout()
+            imageStatsLayout.addWidget(self.histogram_labels[i])
+            imageStatsLayout.addWidget(self.image_stats_labels[i])
+            layout.addLayout(imageStatsLayout)
             layout.addWidget(self.stop_record_buttons[i])
             gridLayout.addLayout(layout, i // 4, i % 4)
         gridLayout.setContentsMargins(5, 5, 5, 5)  # left, top, right, bottom
         self.totalLayout.addLayout(gridLayout)
         self.totalLayout.addSpacing(1)
+        # Counters and latencies of the grab threads and recordings
+        self.statsPanel = QLabel(self)
+        self.statsPanel.setStyleSheet("font-family: monospace; font-size: 10px;")
+        self.statsPanel.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.statsPanel.setVisible(False)
+        self.totalLayout.addWidget(self.statsPanel)
+        self.statsTimer = QTimer(self)
+        self.statsTimer.timeout.connect(self.updateStats)
         widget.setLayout(self.totalLayout)
         self.setCentralWidget(widget)
         
         # Create a timer to update the video streams
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.updateStreams)
-        self.timer.start(1)
+        self.timer.start(5)
 
     def getFileLocation(self):
         options = QFileDialog.Options()
@@ -119,8 +324,39 @@ class CameraStream(QMainWindow):
         if dialog.exec() == QFileDialog.Accepted:
             selected_directory = dialog.selectedFiles()[0]
             self.fileLocation = selected_directory
+            self.diskMonitor.path = selected_directory
+            self.loadController.log_file = os.path.join(
+                selected_directory, "load_controller.jsonl"
+            )
             self.fileLoc_line.setText(f"{selected_directory}")
 
+    def exportMetrics(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Metrics",
+            os.path.join(self.fileLocation, "metrics.csv"),
+            "CSV (*.csv);;JSON (*.json)",
+        )
+        if not filename:
+            return
+        if self.metricsExporter is not None:
+            self.metricsExporter.stop()
+        self.metricsExporter = MetricsExporter(filename, STATS_INTERVAL_MS / 1000)
+        self.metricsExporter.start()
+        self.statusBar().showMessage(f"Exporting metrics to {filename}")
+
+    def toggleStats(self, checked):
+        # The metrics are only read while the panel is shown
+        self.statsPanel.setVisible(checked)
+        if checked:
+            self.updateStats()
+            self.statsTimer.start(STATS_INTERVAL_MS)
+        else:
+            self.statsTimer.stop()
+
+    def updateStats(self):
+        self.statsPanel.setText(format_metrics(METRICS.snapshot()))
+
     def getHLayouts(self, label_1, label_2):
         lab1 = QLabel(str(label_1), self)
         lab2 = QLabel(str(label_2), self)
@@ -131,32 +367,60 @@ class CameraStream(QMainWindow):
 
         return self.hLayout
 
-    def runCameras(self, cam_params=("Mono8", 40, 1000)):
+    def runCameras(self, cam_params=("Mono8", 40, 1000, 64)):
         self.counter += 1
-        # Open the cameras
-        self.cameras = []
-        self.raw_writer_arr = [None] * n_cams
-        self.ffmpeg_arr = [None] * n_cams
-        pix_format, frameRate, expTime = cam_params
-
-        tlFactory = pylon.TlFactory.GetInstance()
-        devices = tlFactory.EnumerateDevices()
-
-        for i in range(len(devices)):
-            camera = pylon.InstantCamera(tlFactory.CreateDevice(devices[i]))
-            self.cameras.append(camera)
-            camera.Open()
-
-            # Start recording from the cameras
-            camera.AcquisitionFrameRateEnable.SetValue(True)
-            camera.AcquisitionFrameRateAbs.SetValue(frameRate)
-            camera.AcquisitionMode.SetValue("Continuous")
-            camera.PixelFormat.SetValue(pix_format)
-            camera.ExposureTimeAbs.SetValue(expTime)
-            camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
-
-        # Get the resulting frame rate
-        resultingFR = camera.ResultingFrameRateAbs.GetValue()
+        pix_format, frameRate, expTime, maxNumBuffer = cam_params
+        # Used the next time a camera switches to lossless grabbing
+        self.max_num_buffer = maxNumBuffer
+
+        if self.engine is None:
+            # Open the cameras once and in parallel, one grab thread per
+            # camera, the GUI only reads the latest frames. The previews show
+            # each camera as soon as it is up
+            start = time.perf_counter()
+            from acquisition import CameraManager
+
+            self.pylonImportSeconds = time.perf_counter() - start
+            self.cameraManager = CameraManager()
+            self.engine = self.cameraManager.open(frameRate, pix_format, expTime)
+            self.cameras = self.cameraManager.cameras
+            self.raw_writer_arr = [None] * n_cams
+            self.ffmpeg_arr = [None] * n_cams
+            self.pix_format = pix_format
+            self.preview_queues = [
+                self.engine.subscribe(i, maxsize=2, latest=True)
+                for i in range(len(self.cameras))
+            ]
+            self.previews = [
+                PreviewSource(frame_queue, PREVIEW_TILE, PREVIEW_FPS, pix_format)
+                for frame_queue in self.preview_queues
+            ]
+        else:
+            # Only the changed settings are applied, a pixel format change
+            # restarts grabbing and is refused while recording
+            if pix_format != self.pix_format and any(self.recording_workers):
+                self.statusBar().showMessage(
+                    "Stop the recordings to change the pixel format"
+                )
+                pix_format = self.pix_format
+            try:
+                self.cameraManager.reconfigure(
+                    frame_rate=frameRate, pixel_format=pix_format, exposure=expTime
+                )
+            except RuntimeError as err:
+                self.statusBar().showMessage(str(err))
+                return
+            self.pix_format = pix_format
+            for preview in self.previews:
+                preview.pixel_format = pix_format
+            if self.imageStats is not None:
+                self.imageStats.pixel_format = pix_format
+            seconds = self.cameraManager.last_reconfigure["seconds"]
+            if pix_format == cam_params[0]:
+                self.statusBar().showMessage(
+                    f"Cameras reconfigured in {seconds * 1000:.0f} ms"
+                )
+
         self.paramsVLayout = QVBoxLayout()
         if self.counter == 1:
             self.fr_line = QLineEdit("Frame Rate: 20")
@@ -179,20 +443,41 @@ class CameraStream(QMainWindow):
             self.totalLayout.addLayout(self.paramsVLayout)
 
         elif self.counter > 1:
+            # Get the resulting frame rate
+            resultingFR = self.cameras[-1].ResultingFrameRateAbs.GetValue()
             self.fr_line.setText(f"Frame Rate: {resultingFR}")
             self.pf_line.setText(f"Pixel Format: {pix_format}")
             self.et_line.setText(f"Exposure Time: {expTime}")
 
     def getCameraParams(self):
+        self.cameraManager.wait_ready()
         cam_object = self.cameras[0]
         self.pixel_formats = cam_object.PixelFormat.Symbolics
-        self.settingsWindow = SettingsWindow()
+        self.settingsWindow = SettingsWindow(n_cams)
 
         for format_name in self.pixel_formats:
             self.settingsWindow.combo_box.addItem(format_name)
 
         self.settingsWindow.show()
         self.settingsWindow.cam_parameters.connect(self.runCameras)
+        self.settingsWindow.cam_geometry.connect(self.setCameraGeometry)
+
+    def setCameraGeometry(self, geometry):
+        # ROI, binning and decimation restart grabbing and change the frame
+        # size, so cameras that are recording keep their geometry
+        camera_idx, settings = geometry
+        indices = range(len(self.cameras)) if camera_idx is None else [camera_idx]
+        indices = [i for i in indices if self.recording_workers[i] is None]
+        try:
+            actions = self.cameraManager.reconfigure(indices, **settings)
+        except RuntimeError as err:
+            self.statusBar().showMessage(str(err))
+            return
+        if any(action != "unchanged" for action in actions.values()):
+            seconds = self.cameraManager.last_reconfigure["seconds"]
+            self.statusBar().showMessage(
+                f"Camera geometry applied in {seconds * 1000:.0f} ms"
+            )
 
     # First point of contact after the button click
     def toggleRecording(self, camera_idx, obj):
@@ -202,25 +487,57 @@ class CameraStream(QMainWindow):
         record_method = str(self.combo_boxes[camera_idx].currentText())
 
         if flag:
+            if self.recording_workers[camera_idx] is not None:
+                return
             if record_method == "Raw_writer":
-                raw_writer = Raw_Writer(f"cam_{camera_idx}_output.npz")
-                self.raw_writer_arr[camera_idx] = raw_writer
+                writer_spec = (Raw_Writer, (f"cam_{camera_idx}_output.npz",), {})
+            elif record_method == "Raw_file":
+                writer_spec = (
+                    RawFile_Writer,
+                    (f"cam_{camera_idx}_output.raw",),
+                    {"pixel_format": self.pix_format},
+                )
+            elif record_method == "Compressed":
+                writer_spec = (
+                    ChunkedCompressed_Writer,
+                    (f"cam_{camera_idx}_output.bcz",),
+                    {"pixel_format": self.pix_format},
+                )
             else:
-                ffmpeg_writer = FFMPEG_VideoWriter(
-                    f"cam_{camera_idx}_output_t2.avi",
+                writer_spec = (
+                    FFMPEG_VideoWriter,
                     (
-                        self.cameras[camera_idx].Height.Value,
-                        self.cameras[camera_idx].Width.Value,
+                        f"cam_{camera_idx}_output_t2.avi",
+                        # The frame size after the ROI, binning and decimation
+                        self.engine.threads[camera_idx].frame_shape(),
                     ),
-                    fps=25,
+                    {
+                        "fps": self.cameras[camera_idx].ResultingFrameRateAbs.GetValue(),
+                        "pixfmt": ffmpeg_pixfmt(self.pix_format),
+                        "pixel_format": self.pix_format,
+                        "async_mode": True,
+                    },
                 )
-                self.ffmpeg_arr[camera_idx] = ffmpeg_writer
 
-            self.recordSignal.emit((camera_idx, flag))
+            if self.segmentAction.isChecked():
+                fallback_spec = None
+                if record_method != "Compressed":
+                    fallback_spec = (
+                        ChunkedCompressed_Writer,
+                        (f"cam_{camera_idx}_output.bcz",),
+                        {"pixel_format": self.pix_format},
+                    )
+                writer_spec = (
+                    SegmentedWriter,
+                    (writer_spec[1][0], writer_spec),
+                    {"max_seconds": SEGMENT_SECONDS, "fallback_spec": fallback_spec},
+                )
+
+            self.startRecordingWorker(camera_idx, writer_spec)
             self.labels[camera_idx].setStyleSheet("border: 3px solid red;")
 
         else:
-            self.recordSignal.emit((camera_idx, flag))
+            self.stopRecordingWorker(camera_idx)
             self.labels[camera_idx].setStyleSheet("border: None;")
             self.combo_boxes[camera_idx].setCurrentIndex(-1)
 
@@ -228,97 +545,217 @@ class CameraStream(QMainWindow):
         widgetList = QApplication.topLevelWidgets()
         numWindows = len(widgetList)
         if numWindows >= 1:
+            workers = [w for w in self.recording_workers if w is not None]
+            for camera_idx in range(n_cams):
+                self.stopRecordingWorker(camera_idx)
+            for worker in workers:
+                worker.join()
+            if self.preroll is not None:
+                self.preroll.close()
+            self.diskMonitor.stop()
+            self.loadController.stop()
+            if self.imageStats is not None:
+                self.imageStats.stop()
+            if self.metricsExporter is not None:
+                self.metricsExporter.stop()
+                self.metricsExporter.join()
+            self.cameraManager.close()
             event.accept()
         else:
             event.ignore()
 
-    # Starts/stops corresponding camera's recording thread
-    @Slot(tuple)
-    def startRecordingThread(self, tup_val):
-        camera_idx, recordFlag = tup_val
-
-        if self.recording_threads[camera_idx] is None:
-            self.recording_threads[camera_idx] = QThread()
-
-        self.recording_threads[camera_idx].run = lambda: self.recordFrames(
-            camera_idx, recordFlag
-        )
-        self.recording_threads[camera_idx].start()
-        time.sleep(0.02)
-
-        if recordFlag is False:
-            self.recording_threads[camera_idx].quit()
-            self.recording_threads[camera_idx] = None
+    def toggleMosaic(self, checked):
+        # One buffer and one widget for all cameras instead of a label each
+        if checked:
+            cols = math.ceil(math.sqrt(n_cams))
+            rows = math.ceil(n_cams / cols)
+            tile = (MOSAIC_SIZE[0] // rows, MOSAIC_SIZE[1] // cols)
+            self.mosaic = Mosaic(n_cams, tile, cols)
+            self.mosaicWidget = MosaicWidget(self.mosaic, self)
+            self.totalLayout.insertWidget(0, self.mosaicWidget)
+        else:
+            self.totalLayout.removeWidget(self.mosaicWidget)
+            self.mosaicWidget.deleteLater()
+            self.mosaic = self.mosaicWidget = None
+            tile = PREVIEW_TILE
+        for label in self.labels:
+            label.setVisible(not checked)
+        for preview in self.previews:
+            preview.tile = tile
+
+    def toggleImageStats(self, checked):
+        # Computed on subsampled frames off the GUI thread, see imagestats.py
+        if checked:
+            from imagestats import ImageStats
+
+            self.imageStats = ImageStats(
+                self.engine, self.pix_format, rate=IMAGE_STATS_RATE
+            )
+            self.imageStats.start()
+        elif self.imageStats is not None:
+            self.imageStats.stop()
+            self.imageStats = None
+            self.shown_stats = [None] * n_cams
+        for label in self.image_stats_labels + self.histogram_labels:
+            label.setVisible(checked)
+
+    def updateImageStats(self):
+        from imagestats import histogram_image
+
+        for i, stats in enumerate(self.imageStats.latest):
+            if stats is None or stats is self.shown_stats[i]:
+                continue
+            self.shown_stats[i] = stats
+            hist = histogram_image(stats["histogram"])
+            self.histogram_labels[i].setPixmap(
+                QPixmap.fromImage(
+                    QImage(
+                        hist,
+                        hist.shape[1],
+                        hist.shape[0],
+                        hist.strides[0],
+                        QImage.Format_Grayscale8,
+                    )
+                )
+            )
+            self.image_stats_labels[i].setText(
+                f"mean {stats['mean']:.0f} [{stats['min']}, {stats['max']}]\n"
+                f"sat {stats['saturated']:.1f}%  focus {stats['focus']:.0f}"
+            )
 
-    # Connects to getArray method to record frames
-    @Slot()
-    def recordFrames(self, camera_idx, recFlag):
-        name = f"array_signal_{camera_idx}"
-        sig_connect = getattr(self.recordingAgent, name)
+    def togglePreRoll(self, checked):
+        # Keeps the last seconds of every camera so recordings start early
+        if checked:
+            from preroll import PreRollManager
 
-        if recFlag:
-            sig_connect.connect(self.getArray)
+            # The memory budget reads the nodes of configured cameras
+            failed = self.cameraManager.wait_ready()
+            self.preroll = PreRollManager(
+                self.engine, PREROLL_SECONDS, PREROLL_MAX_MB, failed
+            )
+        elif self.preroll is not None:
+            self.preroll.close()
+            self.preroll = None
 
+    # Starts/stops corresponding camera's recording thread
+    def startRecordingWorker(self, camera_idx, writer_spec):
+        lossless = self.lossless_boxes[camera_idx].isChecked()
+        if lossless:
+            self.engine.threads[camera_idx].set_lossless(True, self.max_num_buffer)
+        self.lossless_boxes[camera_idx].setEnabled(False)
+        # The pre-roll buffers cannot be switched while they feed a recording
+        self.prerollAction.setEnabled(False)
+        if self.preroll is not None:
+            frame_queue = self.preroll.start_recording(
+                camera_idx, maxsize=64, block=lossless
+            )
         else:
-            sig_connect.disconnect(self.getArray)
-
-    # Receives the image array from the cameras and records
-    @Slot(tuple)
-    def getArray(self, tup):
-        arr_val, camera_idx, file_path = tup
-        record_str = str(self.combo_boxes[camera_idx].currentText())
-        if record_str == "Raw_writer":
-            self.raw_writer_arr[camera_idx].write_frame(arr_val, file_path)
-        elif record_str == "FFmpeg":
-            self.ffmpeg_arr[camera_idx].write_frame(arr_val, file_path)
+            frame_queue = self.engine.subscribe(
+                camera_idx, maxsize=64, block=lossless
+            )
+        if self.processAction.isChecked():
+            # The writer is created in its own process
+            from multiproc import ProcessRecordingWorker
+
+            worker = ProcessRecordingWorker(
+                frame_queue, writer_spec, self.fileLocation
+            )
         else:
+            writer_cls, args, kwargs = writer_spec
+            writer = writer_cls(*args, **kwargs)
+            if isinstance(writer, FFMPEG_VideoWriter):
+                self.ffmpeg_arr[camera_idx] = writer
+            else:
+                self.raw_writer_arr[camera_idx] = writer
+            if isinstance(writer, SegmentedWriter):
+                self.diskMonitor.add(writer)
+            from acquisition import RecordingWorker
+
+            worker = RecordingWorker(frame_queue, writer, self.fileLocation)
+        self.recording_workers[camera_idx] = worker
+        self.loadController.add(worker)
+        worker.start()
+
+    def stopRecordingWorker(self, camera_idx):
+        worker = self.recording_workers[camera_idx]
+        if worker is None:
             return
+        if self.preroll is not None:
+            self.preroll.stop_recording(camera_idx)
+        else:
+            self.engine.unsubscribe(camera_idx, worker.frame_queue)
+        # The worker writes the frames still queued and closes the writer
+        worker.stop()
+        self.recording_workers[camera_idx] = None
+        self.loadController.remove(worker)
+        if isinstance(worker.writer, SegmentedWriter):
+            self.diskMonitor.remove(worker.writer)
+        if self.engine.threads[camera_idx].lossless:
+            self.engine.threads[camera_idx].set_lossless(False)
+        self.lossless_boxes[camera_idx].setEnabled(True)
+        if not any(self.recording_workers):
+            self.prerollAction.setEnabled(True)
 
     def updateStreams(self):
-        # Get the latest frames from the cameras
-
-        # converter = pylon.ImageFormatConverter()
-        # converter.OutputPixelFormat = pylon.PixelType_BGR8packed
-        # converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
-        # converter = pylon.ImageFormatConverter()
-        # converter.OutputPixelFormat = pylon.PixelType_BGR8packed
-        # converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
-
-        rawGrabResult = []
-
-        for i, camera in enumerate(self.cameras):
-            grabResult = camera.RetrieveResult(
-                5000, pylon.TimeoutHandling_ThrowException
-            )
-            rawGrabResult.append(grabResult)
-
-            # if grabResult.GrabSucceeded():
-            #     temp = converter.Convert(grabResult)
-            #     grabResultArr.append(temp)
-            # if grabResult.GrabSucceeded():
-            #     temp = converter.Convert(grabResult)
-            #     grabResultArr.append(temp)
-
-        images = []
+        # Show rate-capped thumbnails of the latest frames, the grab threads
+        # keep acquiring at full rate while the GUI is busy
+        mosaic = self.mosaic
+        updated = False
+        for i, label in enumerate(self.labels):
+            imgVal = self.previews[i].poll()
+            if imgVal is None:
+                continue
+            if mosaic is not None:
+                mosaic.put(i, imgVal)
+                updated = True
+            else:
+                image = QImage(
+                    imgVal,
+                    imgVal.shape[1],
+                    imgVal.shape[0],
+                    imgVal.strides[0],
+                    QImage.Format_Grayscale8,
+                )
+                label.setPixmap(QPixmap.fromImage(image))  # set the pixmap for the labels
+
+            # Frames missing from the recording, or lost by the camera
+            worker = self.recording_workers[i]
+            lost = worker.lost if worker else self.engine.threads[i].stats.lost
+            self.lost_labels[i].setText(f"Lost: {lost}")
+
+        if updated:
+            # A single repaint of the whole mosaic
+            self.mosaicWidget.overlays = [
+                (
+                    f"cam {i}  {thread.stats.fps():.0f} fps",
+                    self.recording_workers[i] is not None,
+                )
+                for i, thread in enumerate(self.engine.threads)
+            ]
+            self.mosaicWidget.update()
+
+        if self.imageStats is not None:
+            self.updateImageStats()
+
+        for i, worker in enumerate(self.recording_workers):
+            if worker is not None and worker.error is not None:
+                # The worker closed the writer, only the recording state is left
+                self.toggleRecording(i, self.stop_record_buttons[i])
+                self.statusBar().showMessage(
+                    f"Recording of camera {i} failed: {worker.error}"
+                )
 
-        for i, _ in enumerate(rawGrabResult):
-            imgVal = rawGrabResult[i].Array
-            imgNum = rawGrabResult[i].GetImageNumber()
+        warning = self.diskMonitor.warning
+        if warning != self.diskWarning:
+            self.diskWarning = warning
+            self.statusBar().showMessage(warning or "")
 
-            name = f"array_signal_{i}"
-            sig = getattr(self.recordingAgent, name)
-            image = QImage(
-                imgVal, imgVal.shape[1], imgVal.shape[0], QImage.Format_Grayscale8
+        level = self.loadController.level
+        if level != self.loadLevel:
+            self.loadLevel = level
+            self.statusBar().showMessage(
+                f"Load {self.loadController.load:.0%}: {LEVELS[level]}"
             )
-            images.append(image)
-            sig.emit((imgVal, i, self.fileLocation))
-
-        for item in rawGrabResult:
-            item.Release()
-
-        for i, label in enumerate(self.labels):
-            pxmap = QPixmap.fromImage(images[i])
-            label.setPixmap(pxmap) #set the pixmap for the labels
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+
+from packed import is_packed, pixel_bits, unpack
+
+
+def subsample(array, step, pixel_format="Mono8"):
+    """Every ``step``-th pixel of a frame as stored, as a view where
+    possible. Packed frames only unpack the rows kept."""
+    if is_packed(pixel_format):
+        return unpack(array[::step], pixel_format)[:, ::step]
+    return array[::step, ::step]
+
+
+def frame_stats(array, pixel_format="Mono8", step=4, bins=64):
+    """Exposure and focus statistics of a frame from a strided subsample.
+
+    Returns a dict with the ``histogram`` (``bins`` counts over the full
+    range of the pixel format, ``bins`` a power of two), ``mean``, ``min``,
+    ``max``, the percentage of ``saturated`` pixels and ``focus``, the mean
+    squared gradient, which is higher for sharper images of the same
+    scene."""
+    bits = pixel_bits(pixel_format)
+    image = subsample(array, step, pixel_format)
+    top = (1 << bits) - 1
+    histogram = np.bincount(
+        (image >> max(bits - int(np.log2(bins)), 0)).ravel(), minlength=bins
+    )[:bins]
+    pixels = image.astype(np.float32)
+    dx = np.diff(pixels, axis=1)
+    dy = np.diff(pixels, axis=0)
+    return {
+        "histogram": histogram,
+        "mean": float(pixels.mean()),
+        "min": int(image.min()),
+        "max": int(image.max()),
+        "saturated": 100.0 * np.count_nonzero(image >= top) / image.size,
+        "focus": float((dx * dx).mean() + (dy * dy).mean()),
+    }
+
+
+def histogram_image(histogram, height=40):
+    """Returns a uint8 (height, bins) image of the histogram bars, log
+    scaled, for display next to a preview."""
+    counts = np.log1p(histogram.astype(np.float32))
+    levels = np.round(counts / max(counts.max(), 1e-6) * height)
+    rows = np.arange(height, 0, -1)[:, None]
+    return np.where(rows <= levels[None, :], 255, 40).astype(np.uint8)
+
+
+class ImageStats(threading.Thread):
+    """Computes ``frame_stats`` of every camera at most ``rate`` times per
+    second on its own thread.
+
+    Each camera gets a one-frame ``FrameQueue`` subscription, so the
+    statistics share the frames already grabbed (no extra copy) and never
+    hold more than one pool buffer per camera. The latest statistics of
+    camera ``i`` are in ``latest[i]`` (None until the first frame).
+    """
+
+    def __init__(self, engine, pixel_format="Mono8", rate=2, step=4, bins=64):
+        super().__init__(name="image-stats", daemon=True)
+        self.engine = engine
+        self.pixel_format = pixel_format
+        self.rate = rate
+        self.step = step
+        self.bins = bins
+        self.compute_time = 0.0
+        self.computed = 0
+        self.queues = [
+            engine.subscribe(idx, maxsize=1, latest=True)
+            for idx in range(len(engine.threads))
+        ]
+        self.latest = [None] * len(self.queues)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        for idx, frame_queue in enumerate(self.queues):
+            self.engine.unsubscribe(idx, frame_queue)
+            # Releases the frame left in the queue, and any the grab thread
+            # still puts
+            frame_queue.close()
+
+    def update(self):
+        for idx, frame_queue in enumerate(self.queues):
+            frame = frame_queue.get_latest()
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            try:
+                stats = frame_stats(
+                    frame.array, self.pixel_format, self.step, self.bins
+                )
+            finally:
+                frame.release()
+            self.compute_time += time.perf_counter() - start
+            self.computed += 1
+            stats["image_number"] = frame.image_number
+            self.latest[idx] = stats
+
+    def run(self):
+        while not self._stop_event.wait(1.0 / self.rate):
+            self.update()
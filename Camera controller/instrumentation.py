@@ -0,0 +1,261 @@
+import bisect
+import csv
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the duration histograms in seconds, 4 buckets per decade
+# from 10 us to 10 s
+DURATION_BOUNDS = tuple(10 ** (exponent / 4) for exponent in range(-20, 5))
+
+
+class Counter:
+    """A counter owned by one thread.
+
+    Only the owning thread increments it and readers take plain reads, so
+    updates need no lock."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """A fixed-size histogram owned by one thread, see ``Counter``.
+
+    ``bounds`` are the bucket upper bounds, values above the last bound go
+    into an overflow bucket. Quantiles are estimated from the buckets."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=DURATION_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile ``q``."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[bucket] if bucket < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class _NullCounter(Counter):
+    """A ``Counter`` whose updates do nothing."""
+
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+
+class _NullHistogram(Histogram):
+    """A ``Histogram`` whose updates do nothing."""
+
+    __slots__ = ()
+
+    def observe(self, value):
+        pass
+
+
+class MetricsRegistry:
+    """Named counters, histograms and gauges with labels.
+
+    Asking twice for the same name and labels returns the same object, so a
+    restarted thread continues the metrics of its predecessor. Gauges are
+    functions called when a snapshot is taken, used for values that are
+    already counted elsewhere (queue depths, drop counters). Gauges keep
+    their object alive, so objects that come and go (writers, recordings)
+    ``unregister`` their metrics when they are closed.
+
+    With ``enabled`` set to False, counters and histograms asked for are not
+    registered and ignore their updates, and gauges are not registered, so
+    that ``benchmark.py --metrics`` can measure what the updates cost. It
+    applies to the metrics created afterwards. The ``LoadController`` reads
+    the grab histograms and does not work without them."""
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, labels, make):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._metrics.get(key)
+            if entry is None or entry[0] != kind:
+                entry = (kind, make())
+                self._metrics[key] = entry
+            return entry[1]
+
+    def counter(self, name, **labels):
+        if not self.enabled:
+            return _NullCounter()
+        return self._get("counter", name, labels, Counter)
+
+    def histogram(self, name, bounds=DURATION_BOUNDS, **labels):
+        if not self.enabled:
+            return _NullHistogram(bounds)
+        return self._get("histogram", name, labels, lambda: Histogram(bounds))
+
+    def gauge(self, name, read, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._metrics[key] = ("gauge", read)
+
+    def unregister(self, *names, **labels):
+        """Removes the metrics ``names`` with exactly these labels."""
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            for name in names:
+                self._metrics.pop((name, labels), None)
+
+    def snapshot(self):
+        """Returns a list of dicts with name, labels, type and value (or the
+        histogram summary)."""
+        with self._lock:
+            items = list(self._metrics.items())
+        rows = []
+        for (name, labels), (kind, metric) in sorted(items, key=lambda i: i[0]):
+            row = {"name": name, "labels": dict(labels), "type": kind}
+            if kind == "histogram":
+                row.update(metric.summary())
+            elif kind == "gauge":
+                try:
+                    row["value"] = metric()
+                except Exception:
+                    continue
+            else:
+                row["value"] = metric.value
+            rows.append(row)
+        return rows
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = list(self._metrics.items())
+        lines = []
+        for (name, labels), (kind, metric) in sorted(items, key=lambda i: i[0]):
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.bounds, metric.counts):
+                    cumulative += count
+                    le = f'le="{bound:.6g}"'
+                    lines.append(
+                        f"{name}_bucket{{{','.join(filter(None, (label_text, le)))}}}"
+                        f" {cumulative}"
+                    )
+                le = 'le="+Inf"'
+                lines.append(
+                    f"{name}_bucket{{{','.join(filter(None, (label_text, le)))}}}"
+                    f" {metric.count}"
+                )
+                lines.append(f"{name}_sum{{{label_text}}} {metric.total}")
+                lines.append(f"{name}_count{{{label_text}}} {metric.count}")
+            else:
+                try:
+                    value = metric() if kind == "gauge" else metric.value
+                except Exception:
+                    continue
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# The registry of the acquisition and recording pipeline
+METRICS = MetricsRegistry()
+
+
+class MetricsExporter(threading.Thread):
+    """Writes a snapshot of ``registry`` to ``filename`` every ``interval``
+    seconds. A '.csv' file gets one row per metric and snapshot appended,
+    any other file is overwritten with the latest snapshot as JSON."""
+
+    def __init__(self, filename, interval=5.0, registry=METRICS):
+        super().__init__(name="metrics-exporter", daemon=True)
+        self.filename = filename
+        self.interval = interval
+        self.registry = registry
+        self._stop_event = threading.Event()
+
+    def export(self):
+        now = time.time()
+        rows = self.registry.snapshot()
+        if self.filename.endswith(".csv"):
+            fields = ["time", "name", "labels", "type", "value"]
+            fields += ["count", "mean", "p50", "p99", "max"]
+            new_file = not os.path.exists(self.filename)
+            with open(self.filename, "a", newline="") as file:
+                writer = csv.DictWriter(file, fields)
+                if new_file:
+                    writer.writeheader()
+                for row in rows:
+                    labels = ";".join(f"{k}={v}" for k, v in row["labels"].items())
+                    writer.writerow(dict(row, time=now, labels=labels))
+        else:
+            with open(self.filename, "w") as file:
+                json.dump({"time": now, "metrics": rows}, file, indent=1)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.export()
+        self.export()
+
+
+def serve_metrics(port=9100, host="127.0.0.1", registry=METRICS):
+    """Serves ``registry.prometheus()`` on http://host:port/metrics from a
+    background thread. Returns the server, call ``shutdown()`` to stop it."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
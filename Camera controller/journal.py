@@ -0,0 +1,123 @@
+import os
+import time
+
+import numpy as np
+
+JOURNAL_MAGIC = b"BCJRNL01"
+# One record per commit: the number of frames that are durable, and the
+# same number xor a constant so that a torn record is recognized
+JOURNAL_DTYPE = np.dtype([("frames", "<i8"), ("check", "<i8")])
+JOURNAL_CHECK = 0x4A524E4C
+
+
+def fsync_file(filename):
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path):
+    """Makes the files created or removed in directory ``path`` durable.
+
+    Windows cannot open directories for this, NTFS journals the directory
+    entries itself."""
+    if os.name == "nt":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """An append-only journal of the frames of a recording that reached the
+    disk.
+
+    The writer calls ``written()`` after every frame. Once ``sync_frames``
+    frames or ``sync_seconds`` seconds have passed since the last commit
+    (whichever comes first, None disables a limit) ``sync`` is called to
+    flush the frame data and a record with the frame count is appended and
+    flushed too. The fsyncs are paid once per batch instead of once per
+    frame: one for the journal plus those of ``sync``, which are one for a
+    single-file recording but one per new file and one for their directory
+    for a file per frame. The first commit also flushes the directory of the
+    journal, so that the journal and the recording next to it are found
+    after a power loss. After a crash ``read_journal`` returns the frames
+    that can be recovered.
+
+    Parameters
+    -----------
+
+    filename
+      Journal file, '<recording>.journal' is used by the writers.
+
+    sync
+      Function flushing the frame data to disk.
+
+    sync_frames, sync_seconds
+      Commit limits.
+    """
+
+    def __init__(self, filename, sync, sync_frames=None, sync_seconds=1.0):
+        self.filename = filename
+        self.sync = sync
+        self.sync_frames = sync_frames
+        self.sync_seconds = sync_seconds
+        self.frames = 0
+        self.committed = 0
+        self.commits = 0
+        self.sync_time = 0.0
+        self._last_commit = time.perf_counter()
+        self.file = open(filename, "wb", buffering=0)
+        self.file.write(JOURNAL_MAGIC)
+
+    def written(self, count=1):
+        self.frames += count
+        pending = self.frames - self.committed
+        if (self.sync_frames is not None and pending >= self.sync_frames) or (
+            self.sync_seconds is not None
+            and time.perf_counter() - self._last_commit >= self.sync_seconds
+        ):
+            self.commit()
+
+    def commit(self):
+        if self.frames == self.committed:
+            return
+        start = time.perf_counter()
+        self.sync()
+        if self.commits == 0:
+            fsync_dir(os.path.dirname(self.filename))
+        record = np.array([(self.frames, self.frames ^ JOURNAL_CHECK)], JOURNAL_DTYPE)
+        self.file.write(record.tobytes())
+        os.fsync(self.file.fileno())
+        self.committed = self.frames
+        self.commits += 1
+        self._last_commit = time.perf_counter()
+        self.sync_time += self._last_commit - start
+
+    def close(self, remove=True):
+        """Closes the journal, and removes it once the recording is complete."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if remove:
+            os.remove(self.filename)
+            # A journal reappearing after a power loss would make recover.py
+            # cut the finished recording back to the last commit
+            fsync_dir(os.path.dirname(self.filename))
+
+
+def read_journal(filename):
+    """Returns the number of frames committed to a journal, 0 if none."""
+    with open(filename, "rb") as file:
+        if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f"{filename} is not a journal")
+        data = file.read()
+    usable = len(data) - len(data) % JOURNAL_DTYPE.itemsize
+    records = np.frombuffer(data[:usable], dtype=JOURNAL_DTYPE)
+    valid = records[(records["frames"] ^ JOURNAL_CHECK) == records["check"]]
+    return int(valid["frames"].max()) if len(valid) else 0
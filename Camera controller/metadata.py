@@ -0,0 +1,84 @@
+import json
+
+import numpy as np
+
+META_MAGIC = b"BCMETA01"
+META_HEADER_SIZE = 256
+METADATA_DTYPE = np.dtype(
+    [
+        ("image_number", "<i8"),
+        ("timestamp", "<i8"),
+        ("host_timestamp", "<f8"),
+        ("latency", "<f8"),
+    ]
+)
+
+
+class MetadataWriter:
+    """A class to write per-frame metadata next to a recording
+
+    Every frame gets one fixed-width record: the camera image number, the
+    camera tick timestamp, the host monotonic timestamp (``time.perf_counter``)
+    at retrieval and the grab-to-write latency in seconds. Records are
+    collected in a preallocated array and appended to the file in binary
+    chunks of ``chunk_records``. Use ``load_metadata`` to read the file back.
+
+    Parameters
+    -----------
+
+    filename
+      Any filename, '<recording>.meta' is used by the recorder.
+
+    chunk_records
+      Number of records buffered before they are written.
+    """
+
+    def __init__(self, filename, chunk_records=1024):
+        self.filename = filename
+        self.records = np.zeros(chunk_records, dtype=METADATA_DTYPE)
+        self.fill = 0
+        self.count = 0
+        self.file = open(filename, "wb")
+        header = META_MAGIC + json.dumps({"dtype": METADATA_DTYPE.descr}).encode()
+        self.file.write(header.ljust(META_HEADER_SIZE - 1) + b"\n")
+
+    def append(self, image_number, timestamp, host_timestamp, latency):
+        self.records[self.fill] = (image_number, timestamp, host_timestamp, latency)
+        self.fill += 1
+        self.count += 1
+        if self.fill == len(self.records):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.records[: self.fill].tobytes())
+        self.file.flush()
+        self.fill = 0
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+
+def load_metadata(filename):
+    """Returns the records of a metadata file as a structured array with the
+    fields image_number, timestamp, host_timestamp and latency."""
+    with open(filename, "rb") as file:
+        header = file.read(META_HEADER_SIZE)
+        if not header.startswith(META_MAGIC):
+            raise ValueError(f"{filename} is not a metadata file")
+        dtype = np.dtype(
+            [tuple(field) for field in json.loads(header[len(META_MAGIC) :])["dtype"]]
+        )
+        data = file.read()
+    # A partially written last record is ignored
+    usable = len(data) - len(data) % dtype.itemsize
+    return np.frombuffer(data[:usable], dtype=dtype)
+
+
+def interval_histogram(metadata, field="host_timestamp", bins=50):
+    """Histogram of the intervals between consecutive frames, for jitter
+    analysis. Returns (counts, bin_edges) as ``np.histogram``."""
+    return np.histogram(np.diff(metadata[field]), bins=bins)
@@ -0,0 +1,198 @@
+import functools
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from acquisition import RecordingWorker
+from metadata import MetadataWriter
+
+
+class SharedFrameRing:
+    """A ring of frame slots in ``multiprocessing.shared_memory``.
+
+    Parameters
+    -----------
+
+    shape, dtype
+      Shape and dtype of one frame.
+
+    n_slots
+      Number of frame slots.
+
+    name
+      Name of an existing ring to attach to, None creates a new one.
+    """
+
+    def __init__(self, shape, dtype, n_slots=16, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_slots = n_slots
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(frame_bytes * n_slots, 1)
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.slots = np.ndarray(
+            (n_slots, *self.shape), dtype=self.dtype, buffer=self.shm.buf
+        )
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self, unlink=False):
+        self.slots = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def writer_process(conn, ring_args, writer_spec, file_loc):
+    """Entry point of a writer process.
+
+    Receives (slot, image_number, timestamp, host_timestamp) messages on
+    ``conn``, writes the frame of that slot and sends the slot back once it
+    may be reused. Async writers only queue a view of the slot, the slot is
+    then sent back from their release callback once the frame is written.
+    A None message closes the writer and the process replies with its
+    statistics."""
+    ring = SharedFrameRing(*ring_args)
+    writer_cls, args, kwargs = writer_spec
+    writer = writer_cls(*args, **kwargs)
+    metadata = MetadataWriter(os.path.join(file_loc, f"{writer.filename}.meta"))
+    # Segmented writers release frames from the drain threads of several
+    # segments at once
+    send_lock = threading.Lock()
+
+    def free(slot):
+        with send_lock:
+            conn.send(slot)
+
+    written = 0
+    write_time = 0.0
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        slot, image_number, timestamp, host_timestamp = message
+        start = time.perf_counter()
+        if getattr(writer, "async_mode", False):
+            writer.write_frame(
+                ring.slots[slot], file_loc, functools.partial(free, slot)
+            )
+        else:
+            try:
+                writer.write_frame(ring.slots[slot], file_loc)
+            finally:
+                free(slot)
+        write_time += time.perf_counter() - start
+        written += 1
+        metadata.append(
+            image_number,
+            timestamp,
+            host_timestamp,
+            time.perf_counter() - host_timestamp,
+        )
+    writer.close()
+    metadata.close()
+    ring.close()
+    conn.send({"written": written, "write_s": write_time})
+    conn.close()
+
+
+class ProcessRecordingWorker(RecordingWorker):
+    """Records one camera in a separate writer process.
+
+    Works like ``RecordingWorker``, but the frames are copied into the slots
+    of a ``SharedFrameRing`` and only the slot index and the frame metadata
+    are sent to the process over a pipe, so pixel data is never pickled. The
+    writer is created inside the process from ``writer_spec``, a
+    (writer class, args, kwargs) tuple.
+
+    When all slots are in use the thread waits for the process, frames then
+    pile up in the ``FrameQueue`` which drops the oldest ones.
+    """
+
+    def __init__(self, frame_queue, writer_spec, file_loc=".", n_slots=16):
+        super().__init__(frame_queue, None, file_loc)
+        self.writer_spec = writer_spec
+        # Every writer takes the output filename as its first argument
+        self.filename = writer_spec[1][0]
+        self.n_slots = n_slots
+        self.ring = None
+        self.process = None
+        self.conn = None
+        self.free_slots = []
+        self.sent = 0
+        self.process_stats = None
+
+    def _start_process(self, frame):
+        self.ring = SharedFrameRing(frame.array.shape, frame.array.dtype, self.n_slots)
+        self.free_slots = list(range(self.n_slots))
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(
+            target=writer_process,
+            args=(
+                child_conn,
+                (self.ring.shape, self.ring.dtype, self.n_slots, self.ring.name),
+                self.writer_spec,
+                self.file_loc,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def _collect_free_slots(self, timeout=0):
+        if self.conn.poll(timeout):
+            while self.conn.poll():
+                self.free_slots.append(self.conn.recv())
+
+    def _send(self, frame):
+        while not self.free_slots:
+            if not self.process.is_alive():
+                raise RuntimeError("Writer process exited unexpectedly")
+            self._collect_free_slots(timeout=0.1)
+        slot = self.free_slots.pop()
+        self.ring.slots[slot] = frame.array
+        self.conn.send(
+            (slot, frame.image_number, frame.timestamp, frame.host_timestamp)
+        )
+        self.sent += 1
+
+    def _open(self):
+        # The process is started with the first frame, it has the frame shape
+        pass
+
+    def _write(self, frame):
+        try:
+            if self.process is None:
+                self._start_process(frame)
+            self._collect_free_slots()
+            self._send(frame)
+        finally:
+            frame.release()
+
+    def _close(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+            # Freed slots arrive before the final statistics
+            while True:
+                message = self.conn.recv()
+                if isinstance(message, dict):
+                    self.process_stats = message
+                    break
+        except (EOFError, OSError):
+            raise RuntimeError("Writer process exited unexpectedly")
+        finally:
+            self.process.join()
+            self.conn.close()
+            self.ring.close(unlink=True)
@@ -0,0 +1,155 @@
+"""Packed 10/12-bit pixel formats and 8-bit tone mapping.
+
+Packed frames are stored as delivered by the camera: a uint8 array with one
+row of packed pixels per image row, (height, width * bytes per group /
+pixels per group). ``unpack`` turns them into uint16 images and
+``to_8bit`` maps any bit depth to uint8 for display, both vectorized with
+Numpy.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# Bit depth, pixels per group and bytes per group of the packed formats.
+# The "p" formats are the GenICam PFNC layouts (LSB first, used by USB3 and
+# newer GigE cameras), the "Packed" ones the older GigE Vision layouts.
+PACKED_FORMATS = {
+    "Mono10p": (10, 4, 5),
+    "Mono12p": (12, 2, 3),
+    "Mono10Packed": (10, 2, 3),
+    "Mono12Packed": (12, 2, 3),
+}
+
+
+def is_packed(pixel_format):
+    return pixel_format in PACKED_FORMATS
+
+
+def pixel_bits(pixel_format):
+    """Bit depth of a pixel format, 'Mono12p' gives 12 and 'BayerRG8' 8."""
+    if pixel_format in PACKED_FORMATS:
+        return PACKED_FORMATS[pixel_format][0]
+    match = re.search(r"(\d+)", pixel_format or "")
+    return int(match.group(1)) if match else 8
+
+
+def packed_shape(shape, pixel_format):
+    """Shape of the stored packed array of an image of ``shape``."""
+    _, pixels, nbytes = PACKED_FORMATS[pixel_format]
+    height, width = shape
+    if width % pixels:
+        raise ValueError(f"{pixel_format} needs a width divisible by {pixels}")
+    return height, width // pixels * nbytes
+
+
+def unpacked_shape(shape, pixel_format):
+    """Shape of the image stored in a packed array of ``shape``."""
+    _, pixels, nbytes = PACKED_FORMATS[pixel_format]
+    height, row_bytes = shape
+    return height, row_bytes // nbytes * pixels
+
+
+def frame_nbytes(shape, pixel_format, dtype=np.uint8):
+    """Bytes stored per frame of an image of ``shape``."""
+    if is_packed(pixel_format):
+        return int(np.prod(packed_shape(shape, pixel_format)))
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+def _groups(packed, nbytes):
+    packed = np.ascontiguousarray(packed, dtype=np.uint8)
+    groups = packed.reshape(-1, nbytes)
+    return [groups[:, k].astype(np.uint16) for k in range(nbytes)]
+
+
+def unpack(packed, pixel_format):
+    """Returns the uint16 image of a packed array."""
+    bits, pixels, nbytes = PACKED_FORMATS[pixel_format]
+    shape = unpacked_shape(packed.shape, pixel_format)
+    b = _groups(packed, nbytes)
+    out = np.empty((len(b[0]), pixels), dtype=np.uint16)
+    if pixel_format == "Mono12p":
+        out[:, 0] = b[0] | ((b[1] & 0x0F) << 8)
+        out[:, 1] = (b[1] >> 4) | (b[2] << 4)
+    elif pixel_format == "Mono10p":
+        out[:, 0] = b[0] | ((b[1] & 0x03) << 8)
+        out[:, 1] = (b[1] >> 2) | ((b[2] & 0x0F) << 6)
+        out[:, 2] = (b[2] >> 4) | ((b[3] & 0x3F) << 4)
+        out[:, 3] = (b[3] >> 6) | (b[4] << 2)
+    elif pixel_format == "Mono12Packed":
+        out[:, 0] = (b[0] << 4) | (b[1] & 0x0F)
+        out[:, 1] = (b[2] << 4) | (b[1] >> 4)
+    else:
+        out[:, 0] = (b[0] << 2) | (b[1] & 0x03)
+        out[:, 1] = (b[2] << 2) | ((b[1] >> 4) & 0x03)
+    return out.reshape(shape)
+
+
+def pack(image, pixel_format):
+    """Packs a uint16 image the way the camera delivers ``pixel_format``.
+
+    Used to make synthetic packed frames, the recording path never packs."""
+    bits, pixels, nbytes = PACKED_FORMATS[pixel_format]
+    shape = packed_shape(image.shape, pixel_format)
+    p = np.ascontiguousarray(image, dtype=np.uint16).reshape(-1, pixels)
+    p = [p[:, k] & ((1 << bits) - 1) for k in range(pixels)]
+    out = np.empty((len(p[0]), nbytes), dtype=np.uint8)
+    if pixel_format == "Mono12p":
+        out[:, 0] = p[0] & 0xFF
+        out[:, 1] = (p[0] >> 8) | ((p[1] & 0x0F) << 4)
+        out[:, 2] = p[1] >> 4
+    elif pixel_format == "Mono10p":
+        out[:, 0] = p[0] & 0xFF
+        out[:, 1] = (p[0] >> 8) | ((p[1] & 0x3F) << 2)
+        out[:, 2] = (p[1] >> 6) | ((p[2] & 0x0F) << 4)
+        out[:, 3] = (p[2] >> 4) | ((p[3] & 0x03) << 6)
+        out[:, 4] = p[3] >> 2
+    elif pixel_format == "Mono12Packed":
+        out[:, 0] = p[0] >> 4
+        out[:, 1] = (p[0] & 0x0F) | ((p[1] & 0x0F) << 4)
+        out[:, 2] = p[1] >> 4
+    else:
+        out[:, 0] = p[0] >> 2
+        out[:, 1] = (p[0] & 0x03) | ((p[1] & 0x03) << 4)
+        out[:, 2] = p[1] >> 2
+    return out.reshape(shape)
+
+
+@lru_cache(maxsize=16)
+def tone_lut(lo, hi, size=2**16):
+    """Lookup table mapping [lo, hi] linearly to [0, 255]."""
+    values = np.arange(size, dtype=np.float32)
+    scale = 255.0 / max(hi - lo, 1)
+    lut = np.clip((values - lo) * scale, 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def auto_levels(image, low=0.5, high=99.5, step=8):
+    """Returns the ``low`` and ``high`` percentiles of a subsample of the
+    image, to be used as ``lo`` and ``hi`` of ``to_8bit``."""
+    lo, hi = np.percentile(image[::step, ::step], (low, high))
+    return int(lo), int(hi)
+
+
+def to_8bit(image, bits=None, lo=None, hi=None):
+    """Tone maps an image to uint8 with a lookup table.
+
+    The range [lo, hi] is stretched to [0, 255], by default the full range
+    of ``bits`` (taken from the dtype when not given)."""
+    if image.dtype == np.uint8 and lo is None and hi is None:
+        return image
+    if bits is None:
+        bits = image.dtype.itemsize * 8
+    lo = 0 if lo is None else lo
+    hi = (1 << bits) - 1 if hi is None else hi
+    return tone_lut(lo, hi, 1 << (image.dtype.itemsize * 8))[image]
+
+
+def preview_8bit(array, pixel_format, lo=None, hi=None):
+    """Returns a uint8 image of a frame as stored, unpacking packed formats."""
+    if is_packed(pixel_format):
+        array = unpack(array, pixel_format)
+    return to_8bit(array, pixel_bits(pixel_format), lo, hi)
@@ -0,0 +1,238 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from acquisition import Frame, FrameQueue
+from buffers import FramePool
+
+
+class PreRollBuffer(threading.Thread):
+    """Keeps the last ``seconds`` of one camera in memory so that a
+    recording can start before the event that triggered it.
+
+    While idle every frame is copied into a ``FramePool`` of its own, sized
+    to ``max_bytes``, and the oldest frames are recycled. ``start_recording``
+    hands the buffered frames to a new ``FrameQueue`` and then forwards the
+    live frames behind them, so a ``RecordingWorker`` reading that queue
+    writes the pre-roll and the live frames in order with their original
+    image numbers and timestamps. Writing happens on the worker thread,
+    neither the grab thread nor the caller waits for the flush.
+
+    Parameters
+    -----------
+
+    engine
+      The ``AcquisitionEngine`` grabbing the camera.
+
+    camera_idx
+      Index of the camera in the engine.
+
+    seconds
+      Length of the pre-roll.
+
+    max_bytes
+      Memory budget of the buffer, caps the pre-roll of large or fast
+      frames.
+    """
+
+    def __init__(self, engine, camera_idx, seconds=5, max_bytes=256 * 2**20):
+        super().__init__(name=f"preroll-{camera_idx}", daemon=True)
+        self.camera_idx = camera_idx
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.input_queue = engine.subscribe(camera_idx, maxsize=16)
+        self.pool = None
+        self.ring = deque()
+        self.output_queue = None
+        # Live frames arriving while start_recording hands the ring over
+        self._handoff = None
+        self.overruns = 0
+        self.flushes = []
+        self._flush = None
+        self._put = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _buffer(self, frame):
+        array = frame.array
+        if self.pool is None or not self.pool.matches(array.shape, array.dtype):
+            while self.ring:
+                self.ring.popleft().release()
+            self.pool = FramePool(
+                array.shape, array.dtype, max(self.max_bytes // array.nbytes, 1)
+            )
+        lease = self.pool.acquire()
+        while lease is None and self.ring:
+            self.ring.popleft().release()
+            lease = self.pool.acquire()
+        if lease is None:
+            # Every buffer still holds a flushed frame that is not written
+            self.overruns += 1
+            frame.release()
+            return
+        self.pool.fill(lease, array)
+        self.ring.append(
+            Frame(
+                frame.camera_idx,
+                lease.array,
+                frame.image_number,
+                frame.timestamp,
+                frame.host_timestamp,
+                lease,
+                frame.lost,
+            )
+        )
+        frame.release()
+        while frame.host_timestamp - self.ring[0].host_timestamp > self.seconds:
+            self.ring.popleft().release()
+
+    def _check_drained(self):
+        flush = self._flush
+        if flush is None:
+            return
+        if self._put - self.output_queue.qsize() >= flush["frames"]:
+            flush["drain_ms"] = 1000 * (time.perf_counter() - flush["start"])
+            self._flush = None
+
+    def start_recording(self, maxsize=64, block=False):
+        """Returns a ``FrameQueue`` holding the buffered frames, followed by
+        the live frames until ``stop_recording()``."""
+        with self._lock:
+            start = time.perf_counter()
+            ring, self.ring = self.ring, deque()
+            self._handoff = deque()
+            self.input_queue.block = block
+        # The ring is moved without the lock, so the buffer thread keeps
+        # taking live frames meanwhile and queues them behind it
+        frames = len(ring)
+        output_queue = FrameQueue(maxsize + frames, block)
+        if frames:
+            duration = ring[-1].host_timestamp - ring[0].host_timestamp
+        else:
+            duration = 0.0
+        while ring:
+            output_queue.put(ring.popleft())
+        with self._lock:
+            self._put = frames + len(self._handoff)
+            while self._handoff:
+                output_queue.put(self._handoff.popleft())
+            self._handoff = None
+            self.output_queue = output_queue
+            flush = {
+                "frames": frames,
+                "seconds": duration,
+                "start": start,
+                "handoff_ms": 1000 * (time.perf_counter() - start),
+                "drain_ms": None,
+            }
+            self.flushes.append(flush)
+            self._flush = flush if frames else None
+        return output_queue
+
+    def stop_recording(self):
+        with self._lock:
+            self.output_queue = None
+            self._flush = None
+            self.input_queue.block = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                frame = None
+            with self._lock:
+                if self._handoff is not None:
+                    if frame is not None:
+                        self._handoff.append(frame)
+                elif self.output_queue is not None:
+                    if frame is not None:
+                        self.output_queue.put(frame)
+                        self._put += 1
+                    self._check_drained()
+                elif frame is not None:
+                    self._buffer(frame)
+        while self.ring:
+            self.ring.popleft().release()
+        frame = self.input_queue.get_latest()
+        if frame is not None:
+            frame.release()
+
+
+class PreRollManager:
+    """One ``PreRollBuffer`` per camera sharing a memory budget.
+
+    Every camera is given the memory it needs for ``seconds`` of frames
+    (``PayloadSize`` times ``ResultingFrameRateAbs``). When the total exceeds
+    ``max_mb`` all shares are scaled down by the same factor, so no camera
+    can take the memory of the others. Engines without cameras split the
+    budget evenly.
+
+    The camera nodes are read here, so the cameras must be open and
+    configured: with a ``CameraManager`` pass the indices returned by
+    ``wait_ready()`` as ``failed``, those cameras get no memory.
+    """
+
+    def __init__(self, engine, seconds=5, max_mb=1024, failed=()):
+        self.engine = engine
+        self.seconds = seconds
+        budget = max_mb * 2**20
+        n_cams = len(engine.threads)
+        if engine.cameras:
+            demands = [
+                0
+                if idx in failed
+                else camera.PayloadSize.GetValue()
+                * camera.ResultingFrameRateAbs.GetValue()
+                * seconds
+                for idx, camera in enumerate(engine.cameras)
+            ]
+            scale = min(1.0, budget / max(sum(demands), 1))
+            shares = [int(demand * scale) for demand in demands]
+        else:
+            shares = [budget // n_cams] * n_cams
+        self.buffers = [
+            PreRollBuffer(engine, idx, seconds, share)
+            for idx, share in enumerate(shares)
+        ]
+        for buffer in self.buffers:
+            buffer.start()
+
+    def start_recording(self, camera_idx, maxsize=64, block=False):
+        return self.buffers[camera_idx].start_recording(maxsize, block)
+
+    def stop_recording(self, camera_idx):
+        self.buffers[camera_idx].stop_recording()
+
+    def close(self):
+        for idx, buffer in enumerate(self.buffers):
+            self.engine.unsubscribe(idx, buffer.input_queue)
+            buffer.stop()
+        for buffer in self.buffers:
+            buffer.join()
+
+    def stats(self):
+        """Returns per-camera dicts with the buffered frames and memory and
+        the measurements of the last flush."""
+        report = []
+        for buffer in self.buffers:
+            pool = buffer.pool
+            flush = buffer.flushes[-1] if buffer.flushes else {}
+            report.append(
+                {
+                    "camera": buffer.camera_idx,
+                    "buffered": len(buffer.ring),
+                    "slots": pool.size if pool else 0,
+                    "max_bytes": buffer.max_bytes,
+                    "overruns": buffer.overruns,
+                    "flushed_frames": flush.get("frames", 0),
+                    "flushed_seconds": flush.get("seconds", 0.0),
+                    "flush_handoff_ms": flush.get("handoff_ms"),
+                    "flush_drain_ms": flush.get("drain_ms"),
+                }
+            )
+        return report
@@ -0,0 +1,151 @@
+import math
+import time
+
+import numpy as np
+
+from packed import is_packed, pixel_bits, to_8bit, unpack, unpacked_shape
+
+
+def decimation_step(shape, tile):
+    """Smallest integer step that fits an image of ``shape`` into ``tile``."""
+    height, width = shape
+    tile_height, tile_width = tile
+    return max(1, math.ceil(height / tile_height), math.ceil(width / tile_width))
+
+
+def decimate(array, step, pixel_format="Mono8", mode="stride"):
+    """Downsamples a frame as stored by ``step`` and returns it as uint8.
+
+    'stride' keeps every ``step``-th pixel and only touches those, packed
+    frames are unpacked after dropping the rows. 'bin' averages
+    ``step`` x ``step`` blocks, which is smoother but reads every pixel."""
+    if mode == "stride":
+        if is_packed(pixel_format):
+            image = unpack(array[::step], pixel_format)[:, ::step]
+        else:
+            image = array[::step, ::step]
+    else:
+        image = unpack(array, pixel_format) if is_packed(pixel_format) else array
+        height = image.shape[0] // step * step
+        width = image.shape[1] // step * step
+        blocks = image[:height, :width].reshape(
+            height // step, step, width // step, step
+        )
+        image = (blocks.sum(axis=(1, 3), dtype=np.uint32) // step**2).astype(
+            image.dtype
+        )
+    return np.ascontiguousarray(to_8bit(image, pixel_bits(pixel_format)))
+
+
+class PreviewSource:
+    """Rate-capped thumbnails of one camera.
+
+    ``poll()`` returns a uint8 image no larger than ``tile`` at most ``fps``
+    times per second, taking only the newest frame of ``frame_queue``. The
+    older frames are dropped unseen, so a lagging GUI never works through a
+    backlog, and the frame is downsampled before any conversion.
+
+    Parameters
+    -----------
+
+    frame_queue
+      ``FrameQueue`` subscribed to the camera, a small ``maxsize`` is enough.
+
+    tile
+      (height, width) of the preview in pixels.
+
+    fps
+      Preview rate cap, independent of the acquisition rate.
+
+    pixel_format
+      Pixel format of the frames.
+
+    mode
+      'stride' or 'bin', see ``decimate``.
+    """
+
+    def __init__(
+        self, frame_queue, tile=(250, 250), fps=15, pixel_format="Mono8", mode="stride"
+    ):
+        self.frame_queue = frame_queue
+        self.tile = tile
+        self.fps = fps
+        self.pixel_format = pixel_format
+        self.mode = mode
+        # Set by the load controller, no frame is converted while paused
+        self.paused = False
+        self.shown = 0
+        self.convert_time = 0.0
+        self._next = 0.0
+
+    def poll(self, now=None):
+        """Returns the next thumbnail, or None if none is due or available."""
+        now = time.perf_counter() if now is None else now
+        if self.paused or now < self._next:
+            return None
+        frame = self.frame_queue.get_latest()
+        if frame is None:
+            return None
+        # Keep the cadence but do not burst after a stall
+        self._next = max(self._next + 1.0 / self.fps, now)
+        start = time.perf_counter()
+        try:
+            step = decimation_step(self._image_shape(frame.array.shape), self.tile)
+            image = decimate(frame.array, step, self.pixel_format, self.mode)
+        finally:
+            frame.release()
+        self.convert_time += time.perf_counter() - start
+        self.shown += 1
+        return image
+
+    def _image_shape(self, shape):
+        if is_packed(self.pixel_format):
+            return unpacked_shape(shape, self.pixel_format)
+        return shape[:2]
+
+    def stats(self):
+        """Returns the thumbnails shown, the frames skipped and the mean
+        conversion time."""
+        return {
+            "shown": self.shown,
+            "skipped": self.frame_queue.dropped,
+            "convert_ms": 1000 * self.convert_time / max(self.shown, 1),
+        }
+
+
+class Mosaic:
+    """The thumbnails of all cameras in one preallocated uint8 buffer.
+
+    Tiles are laid out row by row in ``cols`` columns (a square grid by
+    default) and every thumbnail is centered in its tile. The buffer is
+    meant to be wrapped once in a single image and drawn in one go.
+    """
+
+    def __init__(self, n_tiles, tile=(250, 250), cols=None):
+        self.n_tiles = n_tiles
+        self.tile = tile
+        self.cols = cols or math.ceil(math.sqrt(n_tiles))
+        self.rows = math.ceil(n_tiles / self.cols)
+        self.buffer = np.zeros(
+            (self.rows * tile[0], self.cols * tile[1]), dtype=np.uint8
+        )
+        self._shapes = [None] * n_tiles
+
+    def tile_rect(self, idx):
+        """Returns (x, y, width, height) of tile ``idx`` in the buffer."""
+        tile_height, tile_width = self.tile
+        row, col = divmod(idx, self.cols)
+        return col * tile_width, row * tile_height, tile_width, tile_height
+
+    def put(self, idx, image):
+        x, y, tile_width, tile_height = self.tile_rect(idx)
+        tile = self.buffer[y : y + tile_height, x : x + tile_width]
+        height = min(image.shape[0], tile_height)
+        width = min(image.shape[1], tile_width)
+        if self._shapes[idx] != (height, width):
+            # Clear the border left by a thumbnail of another size
+            tile[:] = 0
+            self._shapes[idx] = (height, width)
+        top = (tile_height - height) // 2
+        left = (tile_width - width) // 2
+        tile[top : top + height, left : left + width] = image[:height, :width]
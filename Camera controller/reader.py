@@ -0,0 +1,258 @@
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from compression import decode_chunk
+from metadata import load_metadata
+from packed import is_packed, pixel_bits, to_8bit, unpack
+from writers import (
+    CHUNKED_MAGIC,
+    RAW_HEADER_SIZE,
+    RAW_MAGIC,
+    load_raw,
+    read_chunk_index,
+    read_chunked_header,
+    read_raw_header,
+)
+
+FRAME_INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<i8"),
+        ("size", "<i8"),
+        ("image_number", "<i8"),
+        ("timestamp", "<i8"),
+    ]
+)
+
+
+class LRUCache:
+    """A bounded least recently used cache."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        value = load(key)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+
+class RecordingReader:
+    """Random access to the frames of a recording.
+
+    Supports the npz archives of ``Raw_Writer``, the single files of
+    ``RawFile_Writer`` (memory mapped) and the files of
+    ``ChunkedCompressed_Writer``. Frames are addressed like a Numpy array::
+
+        reader = RecordingReader("cam_0_output.raw")
+        frame = reader[10]
+        every_tenth = reader[::10]
+
+    Parameters
+    -----------
+
+    filename
+      The recording to open.
+
+    cache_size
+      Number of decoded frames (npz) or chunks (compressed files) kept in
+      the LRU cache.
+
+    Attributes
+    -----------
+
+    index
+      Structured array with one row per frame: byte offset and size of the
+      stored frame (or of its chunk), image number and camera timestamp
+      (-1 when there is no metadata sidecar).
+
+    metadata
+      The records of the ``<filename>.meta`` sidecar, or None.
+
+    Frames are returned as stored, ``image(i)`` unpacks packed pixel formats
+    and ``image_8bit(i)`` tone maps to uint8.
+    """
+
+    def __init__(self, filename, cache_size=64):
+        self.filename = filename
+        self.cache = LRUCache(cache_size)
+        self._zip = None
+        self._memmap = None
+        with open(filename, "rb") as file:
+            magic = file.read(len(RAW_MAGIC))
+        if magic == RAW_MAGIC:
+            self._open_raw()
+        elif magic == CHUNKED_MAGIC:
+            self._open_chunked()
+        elif zipfile.is_zipfile(filename):
+            self._open_npz()
+        else:
+            raise ValueError(f"{filename} is not a known recording format")
+        self.metadata = None
+        if os.path.exists(f"{filename}.meta"):
+            self.metadata = load_metadata(f"{filename}.meta")
+            n = min(len(self.metadata), len(self.index))
+            self.index["image_number"][:n] = self.metadata["image_number"][:n]
+            self.index["timestamp"][:n] = self.metadata["timestamp"][:n]
+
+    def _open_raw(self):
+        self.format = "raw"
+        header = read_raw_header(self.filename)
+        self.header = header
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.pixel_format = header["pixel_format"]
+        self._memmap = load_raw(self.filename)
+        n = header["frame_count"]
+        self.index = self._new_index(n)
+        self.index["offset"] = RAW_HEADER_SIZE + np.arange(n) * header["frame_bytes"]
+        self.index["size"] = header["frame_bytes"]
+
+    def _open_chunked(self):
+        self.format = "chunked"
+        header = read_chunked_header(self.filename)
+        self.header = header
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.pixel_format = header["pixel_format"]
+        self.chunks = read_chunk_index(self.filename, header)
+        self.index = self._new_index(header["frame_count"])
+        # Every frame points at its chunk
+        self._frame_chunk = np.repeat(
+            np.arange(len(self.chunks)), self.chunks["frames"]
+        )
+        self.index["offset"] = self.chunks["offset"][self._frame_chunk]
+        self.index["size"] = self.chunks["size"][self._frame_chunk]
+        self._file = open(self.filename, "rb")
+        self._lock = threading.Lock()
+
+    def _open_npz(self):
+        self.format = "npz"
+        self.header = {}
+        self.pixel_format = None
+        self._zip = zipfile.ZipFile(self.filename)
+        members = []
+        for info in self._zip.infolist():
+            match = re.search(r"frame_(\d+)\.npy$", info.filename)
+            if match:
+                members.append((int(match.group(1)), info))
+        members.sort(key=lambda member: member[0])
+        self._members = [info for _, info in members]
+        self.index = self._new_index(len(self._members))
+        self.index["offset"] = [info.header_offset for info in self._members]
+        self.index["size"] = [info.compress_size for info in self._members]
+        self._lock = threading.Lock()
+        if self._members:
+            first = self.cache.get(0, self._load_npz_frame)
+            self.shape = first.shape
+            self.dtype = first.dtype
+        else:
+            self.shape = None
+            self.dtype = None
+
+    def _new_index(self, n):
+        index = np.zeros(n, dtype=FRAME_INDEX_DTYPE)
+        index["image_number"] = -1
+        index["timestamp"] = -1
+        return index
+
+    def _load_npz_frame(self, i):
+        with self._lock:
+            with self._zip.open(self._members[i]) as member:
+                frame = np.lib.format.read_array(member)
+        frame.flags.writeable = False
+        return frame
+
+    def _load_chunk(self, c):
+        offset, size, frames, _ = self.chunks[c]
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(size)
+        chunk = decode_chunk(
+            data,
+            frames,
+            self.shape,
+            self.dtype,
+            self.header["codec"],
+            self.header["filters"],
+        )
+        chunk.flags.writeable = False
+        return chunk
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i):
+        """Returns frame ``i`` as a read-only array."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"frame {i} out of range for {len(self)} frames")
+        if self.format == "raw":
+            return self._memmap[i]
+        if self.format == "chunked":
+            c = self._frame_chunk[i]
+            chunk = self.cache.get(c, self._load_chunk)
+            return chunk[i - self.chunks["first_frame"][c]]
+        return self.cache.get(i, self._load_npz_frame)
+
+    def image(self, i):
+        """Returns frame ``i`` as an image, packed formats are unpacked to
+        uint16."""
+        frame = self.frame(i)
+        if is_packed(self.pixel_format):
+            return unpack(frame, self.pixel_format)
+        return frame
+
+    def image_8bit(self, i, lo=None, hi=None):
+        """Returns frame ``i`` tone mapped to uint8, [lo, hi] defaults to the
+        full range of the pixel format."""
+        image = self.image(i)
+        bits = pixel_bits(self.pixel_format) if self.pixel_format else None
+        return to_8bit(image, bits, lo, hi)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if self.format == "raw":
+                return self._memmap[key]
+            return np.stack([self.frame(i) for i in range(*key.indices(len(self)))])
+        return self.frame(int(key))
+
+    def iter_frames(self, start=0, stop=None, step=1):
+        """Yields the frames of ``range(start, stop, step)`` one at a time."""
+        for i in range(*slice(start, stop, step).indices(len(self))):
+            yield self.frame(i)
+
+    def __iter__(self):
+        return self.iter_frames()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self.format == "chunked":
+            self._file.close()
+        self._memmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,464 @@
+"""Headless recorder for any number of Basler cameras.
+
+Does not import PySide6. Example::
+
+    python record_cli.py --config rack.json --duration 600
+
+The JSON config holds the defaults for all cameras and per-camera overrides
+keyed by serial number or camera index::
+
+    {
+        "output_dir": "recordings",
+        "defaults": {"frame_rate": 40, "pixel_format": "Mono8",
+                     "exposure": 1000, "writer": "raw_file"},
+        "cameras": {"21234567": {"exposure": 2000, "lossless": true,
+                                 "roi": [0, 0, 640, 480], "binning": 2}},
+        "trigger": {"rate": 40},
+        "preroll": {"seconds": 5, "max_mb": 1024},
+        "disk": {"min_free_mb": 4096, "downgrade": true}
+    }
+
+A ``segment`` setting such as ``{"max_seconds": 600, "max_mb": 4096,
+"fallback": "compressed"}`` splits the recordings into segments (see
+``segments.py``), ``disk`` configures the ``DiskMonitor``. A
+``backpressure`` setting such as ``{"high": 0.75, "low": 0.25}`` starts a
+``LoadController`` (see ``backpressure.py``) that degrades the writers under
+overload and logs its transitions to ``load_controller.jsonl``.
+
+Recording stops on SIGINT/SIGTERM or ``--duration`` seconds after it first
+started. On POSIX systems SIGUSR1 toggles recording on and off right away. With ``preroll`` every
+recording starts with the frames of the seconds before it was started.
+
+``--metrics-file`` exports the pipeline metrics (see ``instrumentation.py``)
+every ``--stats-interval`` seconds, ``--metrics-port`` serves them at
+http://127.0.0.1:<port>/metrics.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from pypylon import pylon
+
+from acquisition import (
+    AcquisitionEngine,
+    RecordingWorker,
+    apply_geometry,
+    configure_camera,
+)
+from backpressure import LoadController
+from instrumentation import MetricsExporter, serve_metrics
+from multiproc import ProcessRecordingWorker
+from preroll import PreRollManager
+from segments import DiskMonitor, SegmentedWriter
+from writers import FFMPEG_BINARY, make_writer_spec
+
+DEFAULT_SETTINGS = {
+    "frame_rate": 40,
+    "pixel_format": "Mono8",
+    "exposure": 1000,
+    "writer": "raw_file",
+    "writer_options": {},
+    "lossless": False,
+    "max_num_buffer": 64,
+    "process": False,
+    "queue_size": 64,
+    "segment": None,
+    "roi": None,
+    "binning": 1,
+    "decimation": 1,
+}
+
+
+def load_config(filename):
+    if filename is None:
+        return {}
+    with open(filename) as file:
+        return json.load(file)
+
+
+def camera_settings(config, idx, serial):
+    """Merges the defaults with the overrides for one camera."""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("defaults", {}))
+    overrides = config.get("cameras", {})
+    settings.update(overrides.get(str(idx), {}))
+    settings.update(overrides.get(serial, {}))
+    return settings
+
+
+class Recorder:
+    """Opens every connected camera and records them without a GUI.
+
+    Parameters
+    -----------
+
+    config
+      Dict as described in the module docstring.
+
+    output_dir
+      Directory of the recordings, overrides ``config["output_dir"]``.
+    """
+
+    def __init__(self, config, output_dir=None, ffmpeg_binary=FFMPEG_BINARY):
+        self.config = config
+        self.output_dir = output_dir or config.get("output_dir", ".")
+        self.ffmpeg_binary = ffmpeg_binary
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.cameras = []
+        self.serials = []
+        self.settings = []
+        self.crops = []
+        self.workers = []
+        self.scheduler = None
+        self.preroll = None
+        self.load_controller = None
+        self.disk_monitor = DiskMonitor(
+            self.output_dir, on_warning=print, **config.get("disk", {})
+        )
+        self.recording = False
+        self._lock = threading.Lock()
+        self._frameset_thread = None
+
+        tlFactory = pylon.TlFactory.GetInstance()
+        for idx, device in enumerate(tlFactory.EnumerateDevices()):
+            camera = pylon.InstantCamera(tlFactory.CreateDevice(device))
+            camera.Open()
+            serial = device.GetSerialNumber()
+            settings = camera_settings(config, idx, serial)
+            configure_camera(
+                camera,
+                settings["frame_rate"],
+                settings["pixel_format"],
+                settings["exposure"],
+            )
+            self.crops.append(
+                apply_geometry(
+                    camera,
+                    settings["roi"],
+                    settings["binning"],
+                    settings["decimation"],
+                )
+            )
+            camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+            self.cameras.append(camera)
+            self.serials.append(serial)
+            self.settings.append(settings)
+        if not self.cameras:
+            raise RuntimeError("No cameras found")
+
+        if "trigger" in config:
+            from trigger import enable_software_trigger
+
+            for camera in self.cameras:
+                enable_software_trigger(camera)
+        self.engine = AcquisitionEngine(self.cameras)
+        for thread, crop in zip(self.engine.threads, self.crops):
+            thread.crop = crop
+        if "trigger" in config:
+            from trigger import TriggerScheduler
+
+            self.scheduler = TriggerScheduler(self.engine, **config["trigger"])
+
+    def start(self):
+        self.engine.start()
+        self.disk_monitor.start()
+        if self.scheduler is not None:
+            self.scheduler.start()
+            self._frameset_thread = threading.Thread(
+                target=self._release_framesets, name="framesets", daemon=True
+            )
+            self._frameset_thread.start()
+        if "preroll" in self.config:
+            self.preroll = PreRollManager(self.engine, **self.config["preroll"])
+        if "backpressure" in self.config:
+            options = dict(self.config["backpressure"])
+            options.setdefault(
+                "log_file", os.path.join(self.output_dir, "load_controller.jsonl")
+            )
+            self.load_controller = LoadController(
+                self.engine,
+                on_transition=lambda t: print(
+                    f"{time.strftime('%H:%M:%S', time.localtime(t['time']))} "
+                    f"load {t['load']:.0%}: {t['from']} -> {t['to']}"
+                ),
+                **options,
+            )
+            self.load_controller.start()
+
+    def start_recording(self):
+        with self._lock:
+            if self.recording:
+                return
+            stamp = time.strftime("%Y%m%d_%H%M%S")
+            self.workers = []
+            for idx, camera in enumerate(self.cameras):
+                settings = self.settings[idx]
+                spec = self.writer_spec(idx, f"cam_{idx}_{self.serials[idx]}_{stamp}")
+                lossless = settings["lossless"]
+                if lossless:
+                    self.engine.threads[idx].set_lossless(
+                        True, settings["max_num_buffer"]
+                    )
+                if self.preroll is not None:
+                    frame_queue = self.preroll.start_recording(
+                        idx, settings["queue_size"], block=lossless
+                    )
+                else:
+                    frame_queue = self.engine.subscribe(
+                        idx, settings["queue_size"], block=lossless
+                    )
+                if settings["process"]:
+                    worker = ProcessRecordingWorker(frame_queue, spec, self.output_dir)
+                else:
+                    writer_cls, args, kwargs = spec
+                    worker = RecordingWorker(
+                        frame_queue, writer_cls(*args, **kwargs), self.output_dir
+                    )
+                if isinstance(worker.writer, SegmentedWriter):
+                    self.disk_monitor.add(worker.writer)
+                if self.load_controller is not None:
+                    self.load_controller.add(worker)
+                worker.start()
+                self.workers.append(worker)
+            self.recording = True
+        print(f"Recording {len(self.workers)} cameras to {self.output_dir}")
+
+    def stop_recording(self):
+        with self._lock:
+            if not self.recording:
+                return
+            for idx, worker in enumerate(self.workers):
+                if self.preroll is not None:
+                    self.preroll.stop_recording(idx)
+                else:
+                    self.engine.unsubscribe(idx, worker.frame_queue)
+                worker.stop()
+                if self.engine.threads[idx].lossless:
+                    self.engine.threads[idx].set_lossless(False)
+            for worker in self.workers:
+                worker.join()
+                self.disk_monitor.remove(worker.writer)
+                if self.load_controller is not None:
+                    self.load_controller.remove(worker)
+            self.recording = False
+        for idx, worker in enumerate(self.workers):
+            print(
+                f"cam {idx}: {worker.written} frames, {worker.lost} lost "
+                f"({100 * worker.loss_rate():.2f}%)"
+            )
+            if worker.error is not None:
+                print(f"cam {idx}: recording failed: {worker.error}")
+
+    def writer_spec(self, idx, filename):
+        """Returns the writer spec of camera ``idx``, wrapped in a
+        ``SegmentedWriter`` when the camera has a ``segment`` setting."""
+        camera = self.cameras[idx]
+        settings = self.settings[idx]
+        shape = self.engine.threads[idx].frame_shape()
+        fps = camera.ResultingFrameRateAbs.GetValue()
+        spec = make_writer_spec(
+            settings["writer"],
+            filename,
+            shape,
+            fps,
+            settings["pixel_format"],
+            self.ffmpeg_binary,
+            settings["writer_options"],
+        )
+        if not settings["segment"]:
+            return spec
+        segment = dict(settings["segment"])
+        fallback = segment.pop("fallback", None)
+        if fallback is not None:
+            fallback = make_writer_spec(
+                fallback,
+                filename,
+                shape,
+                fps,
+                settings["pixel_format"],
+                self.ffmpeg_binary,
+            )
+        max_mb = segment.pop("max_mb", None)
+        return (
+            SegmentedWriter,
+            (spec[1][0], spec),
+            {
+                "max_bytes": max_mb * 2**20 if max_mb else None,
+                "fallback_spec": fallback,
+                **segment,
+            },
+        )
+
+    def toggle_recording(self):
+        if self.recording:
+            self.stop_recording()
+        else:
+            self.start_recording()
+
+    def _release_framesets(self):
+        # The framesets are not used for recording, they are released as they
+        # come so that they do not hold pool buffers. close() puts None once
+        # the scheduler stopped.
+        while True:
+            frameset = self.scheduler.framesets.get()
+            if frameset is None:
+                return
+            frameset.release()
+
+    def report(self):
+        lines = []
+        for cam_stats in self.engine.stats():
+            idx = cam_stats["camera"]
+            line = f"cam {idx}: {cam_stats['fps']:.1f} fps, {cam_stats['lost']} lost"
+            if self.recording:
+                worker = self.workers[idx]
+                line += (
+                    f", {worker.written} written, "
+                    f"{worker.frame_queue.dropped} dropped by the writer"
+                )
+                if worker.error is not None:
+                    line += f", recording failed: {worker.error}"
+            lines.append(line)
+        if self.scheduler is not None:
+            trigger_stats = self.scheduler.stats()
+            lines.append(
+                f"trigger: {trigger_stats['trigger_rate']:.1f} Hz, "
+                f"{trigger_stats['incomplete']} incomplete framesets"
+            )
+        if self.disk_monitor.warning:
+            lines.append(self.disk_monitor.warning)
+        return "\n".join(lines)
+
+    def close(self):
+        self.stop_recording()
+        if self.preroll is not None:
+            self.preroll.close()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler.framesets.put(None)
+            self._frameset_thread.join()
+        self.disk_monitor.stop()
+        if self.load_controller is not None:
+            self.load_controller.stop()
+        self.engine.stop()
+        for camera in self.cameras:
+            camera.StopGrabbing()
+            camera.Close()
+
+
+def wait_until(start_at, stop_event):
+    """Waits for a wall clock time given as HH:MM[:SS] today."""
+    parts = [int(part) for part in start_at.split(":")]
+    now = time.localtime()
+    target = time.mktime(
+        (now.tm_year, now.tm_mon, now.tm_mday, *parts, *[0] * (3 - len(parts)))
+        + (0, 0, -1)
+    )
+    stop_event.wait(max(target - time.time(), 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record Basler cameras headless")
+    parser.add_argument("--config", help="JSON file with the camera settings")
+    parser.add_argument("--output-dir", help="directory of the recordings")
+    parser.add_argument("--list", action="store_true", help="list cameras and exit")
+    parser.add_argument("--start-in", type=float, default=0, help="delay in s")
+    parser.add_argument("--start-at", help="wall clock start time, HH:MM[:SS]")
+    parser.add_argument("--duration", type=float, help="recording length in s")
+    parser.add_argument(
+        "--paused",
+        action="store_true",
+        help="do not record until SIGUSR1 is received",
+    )
+    parser.add_argument("--stats-interval", type=float, default=5)
+    parser.add_argument("--ffmpeg", default=FFMPEG_BINARY)
+    parser.add_argument(
+        "--metrics-file",
+        help="export the pipeline metrics to this .csv or .json file",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve the metrics in Prometheus format on this local port",
+    )
+    args = parser.parse_args(argv)
+
+    if args.list:
+        tlFactory = pylon.TlFactory.GetInstance()
+        for idx, device in enumerate(tlFactory.EnumerateDevices()):
+            print(f"{idx}: {device.GetModelName()} {device.GetSerialNumber()}")
+        return 0
+
+    recorder = Recorder(load_config(args.config), args.output_dir, args.ffmpeg)
+    stop_event = threading.Event()
+    toggle_event = threading.Event()
+    # Set by every signal, so the main loop handles it right away
+    wake_event = threading.Event()
+
+    def request_stop(signum, frame):
+        stop_event.set()
+        wake_event.set()
+
+    def request_toggle(signum, frame):
+        toggle_event.set()
+        wake_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, request_toggle)
+
+    exporter = server = None
+    if args.metrics_file:
+        exporter = MetricsExporter(args.metrics_file, args.stats_interval)
+        exporter.start()
+    if args.metrics_port:
+        server = serve_metrics(args.metrics_port)
+
+    try:
+        recorder.start()
+        if args.start_at:
+            wait_until(args.start_at, stop_event)
+        stop_event.wait(args.start_in)
+        if not args.paused and not stop_event.is_set():
+            recorder.start_recording()
+        # The duration counts from the start of the first recording
+        started = time.monotonic() if recorder.recording else None
+        next_report = time.monotonic() + args.stats_interval
+        while not stop_event.is_set():
+            timeout = next_report - time.monotonic()
+            if args.duration and started is not None:
+                timeout = min(timeout, started + args.duration - time.monotonic())
+            wake_event.wait(max(timeout, 0))
+            wake_event.clear()
+            if stop_event.is_set():
+                break
+            if toggle_event.is_set():
+                toggle_event.clear()
+                recorder.toggle_recording()
+                if recorder.recording and started is None:
+                    started = time.monotonic()
+            now = time.monotonic()
+            if args.duration and started is not None:
+                if now - started >= args.duration:
+                    break
+            if now >= next_report:
+                print(recorder.report(), flush=True)
+                next_report = now + args.stats_interval
+    finally:
+        recorder.close()
+        if exporter is not None:
+            exporter.stop()
+            exporter.join()
+        if server is not None:
+            server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
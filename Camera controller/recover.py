@@ -0,0 +1,125 @@
+"""Recovers recordings interrupted by a crash or power loss.
+
+``RawFile_Writer`` and ``Raw_Writer`` journal the frames that reached the
+disk in ``<recording>.journal``, which is removed when the recording is
+closed. A journal left behind marks an unfinished recording::
+
+    python recover.py D:/recordings
+
+finds the journals in the given directories (or takes the recordings given
+directly) and makes every recording readable again with the frames of the
+last journal commit. A raw file only gets its header rewritten and is
+truncated, which takes the same time whatever its size. An npz archive is
+built from its journaled frame files like ``Raw_Writer.close()`` does.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from journal import read_journal
+from writers import (
+    RAW_HEADER_SIZE,
+    RAW_MAGIC,
+    Raw_Writer,
+    read_raw_header,
+    write_file_header,
+)
+
+
+def recover_raw(filename):
+    """Restores the header of a ``RawFile_Writer`` file from its journal and
+    drops the frames after the last commit. Returns the frame count."""
+    journal = f"{filename}.journal"
+    header = read_raw_header(filename)
+    frame_bytes = header["frame_bytes"]
+    available = (os.path.getsize(filename) - RAW_HEADER_SIZE) // max(frame_bytes, 1)
+    frames = min(read_journal(journal), available)
+    with open(filename, "r+b") as file:
+        file.truncate(RAW_HEADER_SIZE + frames * frame_bytes)
+        header["frame_count"] = frames
+        write_file_header(file, RAW_MAGIC, header)
+        os.fsync(file.fileno())
+    os.remove(journal)
+    return frames
+
+
+def recover_npz(filename):
+    """Builds the npz archive of a ``Raw_Writer`` recording from the frame
+    files of its journal, later frames are deleted. Returns the frame
+    count."""
+    journal = f"{filename}.journal"
+    path, name = os.path.split(filename)
+    path = path or "."
+    writer = Raw_Writer(name, sync_frames=None, sync_seconds=None)
+    writer.path = path
+    frames = read_journal(journal)
+    # Frames already moved into an archive by an interrupted close are lost
+    while frames and not os.path.exists(
+        f"{path}/{writer.tmpdir}/frame_{frames - 1}.npy"
+    ):
+        frames -= 1
+    for extra in glob.glob(f"{path}/{writer.tmpdir}/frame_*.npy"):
+        number = int(os.path.basename(extra)[len("frame_") : -len(".npy")])
+        if number >= frames:
+            os.remove(extra)
+    writer.files = frames
+    writer.close()
+    os.remove(journal)
+    return frames
+
+
+def recover(filename):
+    """Recovers one recording given by its filename."""
+    # An interrupted npz recording has no archive yet, only its journal and
+    # frame files
+    if filename.endswith(".npz"):
+        return recover_npz(filename)
+    with open(filename, "rb") as file:
+        magic = file.read(len(RAW_MAGIC))
+    if magic != RAW_MAGIC:
+        raise ValueError(f"{filename} is not a raw or npz recording")
+    return recover_raw(filename)
+
+
+def find_unfinished(paths):
+    """Returns the recordings with a journal in ``paths`` (directories or
+    recording filenames)."""
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            journals = sorted(glob.glob(os.path.join(path, "*.journal")))
+            recordings.extend(journal[: -len(".journal")] for journal in journals)
+        elif os.path.exists(f"{path}.journal"):
+            recordings.append(path)
+    return recordings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recover interrupted recordings")
+    parser.add_argument("paths", nargs="+", help="directories or recordings")
+    args = parser.parse_args(argv)
+
+    recordings = find_unfinished(args.paths)
+    if not recordings:
+        print("No unfinished recordings found")
+    failed = 0
+    for filename in recordings:
+        start = time.perf_counter()
+        try:
+            frames = recover(filename)
+        except (OSError, ValueError) as err:
+            print(f"{filename}: {err}")
+            failed += 1
+            continue
+        print(
+            f"{filename}: {frames} frames recovered in "
+            f"{1000 * (time.perf_counter() - start):.1f} ms"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
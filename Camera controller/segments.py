@@ -0,0 +1,314 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+def segment_filename(filename, index):
+    """'cam_0_output.raw' becomes 'cam_0_output_003.raw' for segment 3."""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_{index:03d}{ext}"
+
+
+def load_manifest(filename):
+    """Returns the manifest of a segmented recording, ``filename`` being the
+    name the recording was started with."""
+    with open(f"{filename}.segments.json") as file:
+        return json.load(file)
+
+
+class SegmentedWriter:
+    """Splits one recording into a sequence of files.
+
+    A new segment is started once the current one holds ``max_frames``
+    frames, ``max_bytes`` bytes of frame data or is ``max_seconds`` old. The
+    finished segment is closed on a background thread while recording goes
+    on in the next one, so slow closes (zipping the npz, flushing ffmpeg)
+    do not hold up the recording. ``<filename>.segments.json`` lists the
+    segments with their first frame, frame count and size, and is rewritten
+    whenever a segment is finalized. The frame numbers of the manifest are
+    the record numbers of the ``<filename>.meta`` sidecar.
+
+    Parameters
+    -----------
+
+    filename
+      Name of the recording, the segments are named after it
+      (see ``segment_filename``).
+
+    writer_spec
+      (writer class, args, kwargs) of the segment writer, its filename
+      argument is replaced by the segment filename.
+
+    max_frames, max_bytes, max_seconds
+      Rollover limits, None disables a limit.
+
+    fallback_spec
+      Writer spec switched to by ``downgrade()``, for example a compressed
+      writer when the disk cannot keep up with raw frames.
+    """
+
+    def __init__(
+        self,
+        filename,
+        writer_spec,
+        max_frames=None,
+        max_bytes=None,
+        max_seconds=None,
+        fallback_spec=None,
+    ):
+        self.filename = filename
+        self.writer_spec = writer_spec
+        self.fallback_spec = fallback_spec
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        # Async inner writers get the release callback, sync ones are
+        # released here
+        self.async_mode = True
+        self.file_loc = "."
+        self.frames = 0
+        self.bytes = 0
+        self.write_time = 0.0
+        self.segments = []
+        self.downgraded = False
+        self.errors = []
+        self._downgrade = None
+        self._lock = threading.Lock()
+        self._closing = queue.Queue()
+        self._finalizer = threading.Thread(
+            target=self._finalize_loop, name=f"finalize-{filename}", daemon=True
+        )
+        self._finalizer.start()
+        self._open_segment()
+
+    def _open_segment(self):
+        writer_cls, args, kwargs = self.writer_spec
+        index = len(self.segments)
+        name = segment_filename(args[0], index)
+        self.writer = writer_cls(name, *args[1:], **kwargs)
+        self.segment = {
+            "index": index,
+            "file": name,
+            "writer": writer_cls.__name__,
+            "first_frame": self.frames,
+            "frames": 0,
+            "bytes": 0,
+            "started": time.time(),
+            "finished": None,
+            "close_s": None,
+        }
+        with self._lock:
+            self.segments.append(self.segment)
+
+    def _rollover_due(self):
+        segment = self.segment
+        if segment["frames"] == 0:
+            return False
+        return (
+            self._downgrade is not None
+            or (self.max_frames is not None and segment["frames"] >= self.max_frames)
+            or (self.max_bytes is not None and segment["bytes"] >= self.max_bytes)
+            or (
+                self.max_seconds is not None
+                and time.time() - segment["started"] >= self.max_seconds
+            )
+        )
+
+    def _rollover(self):
+        self._closing.put((self.writer, self.segment))
+        if self._downgrade is not None:
+            self.writer_spec = self._downgrade
+            self._downgrade = None
+            self.downgraded = True
+        self._open_segment()
+
+    def downgrade(self, writer_spec=None):
+        """Switches to the fallback writer, or to ``writer_spec`` if given, at
+        the next frame. Returns False if there is no fallback or it is
+        already in use."""
+        if writer_spec is None:
+            if self.fallback_spec is None or self.downgraded:
+                return False
+            writer_spec = self.fallback_spec
+        self._downgrade = writer_spec
+        return True
+
+    def write_frame(self, img_array, file_loc=".", release=None):
+        self.file_loc = file_loc
+        if self._rollover_due():
+            self._rollover()
+        start = time.perf_counter()
+        if getattr(self.writer, "async_mode", False):
+            self.writer.write_frame(img_array, file_loc, release)
+        else:
+            try:
+                self.writer.write_frame(img_array, file_loc)
+            finally:
+                if release is not None:
+                    release()
+        self.write_time += time.perf_counter() - start
+        self.frames += 1
+        self.bytes += img_array.nbytes
+        self.segment["frames"] += 1
+        self.segment["bytes"] += img_array.nbytes
+
+    def _finalize_loop(self):
+        while True:
+            item = self._closing.get()
+            if item is None:
+                return
+            writer, segment = item
+            start = time.perf_counter()
+            try:
+                writer.close()
+            except Exception as err:
+                self.errors.append(err)
+                segment["error"] = str(err)
+            segment["close_s"] = time.perf_counter() - start
+            segment["finished"] = time.time()
+            self.write_manifest()
+
+    def write_manifest(self):
+        with self._lock:
+            manifest = {
+                "filename": self.filename,
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "segments": [dict(segment) for segment in self.segments],
+            }
+            path = os.path.join(self.file_loc, f"{self.filename}.segments.json")
+            with open(path, "w") as file:
+                json.dump(manifest, file, indent=1)
+
+    def stats(self):
+        """Returns the frames and bytes written, the write throughput and the
+        number of segments still being finalized."""
+        return {
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "write_MBps": (
+                self.bytes / 2**20 / self.write_time if self.write_time else 0.0
+            ),
+            "segments": len(self.segments),
+            "finalizing": self._closing.qsize(),
+            "downgraded": self.downgraded,
+        }
+
+    def close(self):
+        self._closing.put((self.writer, self.segment))
+        self._closing.put(None)
+        self._finalizer.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+class DiskMonitor(threading.Thread):
+    """Watches the free space of the recording disk and the load of the
+    ``SegmentedWriter`` objects writing to it.
+
+    Every ``interval`` seconds it measures the rate at which frame data is
+    written and the fraction of time the recording threads spent inside
+    ``write_frame``. It warns when the disk will be full within
+    ``min_minutes``, when less than ``min_free_mb`` is left, or when a
+    writer is busy more than ``max_utilization`` of the time, the point
+    where its queue starts to grow and frames are dropped. With
+    ``downgrade`` the busy writers (or all of them when space runs out)
+    switch to their fallback writer at the next frame.
+
+    The current warning is kept in ``warning`` and every warning is passed
+    to ``on_warning``. Writers in writer processes are not visible to the
+    monitor.
+    """
+
+    def __init__(
+        self,
+        path=".",
+        interval=1.0,
+        min_free_mb=1024,
+        min_minutes=10,
+        max_utilization=0.8,
+        downgrade=False,
+        on_warning=None,
+    ):
+        super().__init__(name="disk-monitor", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.min_free_mb = min_free_mb
+        self.min_minutes = min_minutes
+        self.max_utilization = max_utilization
+        self.downgrade = downgrade
+        self.on_warning = on_warning
+        self.writers = []
+        self.warning = None
+        self.last = {}
+        self._kind = None
+        self._previous = {}
+        self._stop_event = threading.Event()
+
+    def add(self, writer):
+        self.writers = self.writers + [writer]
+
+    def remove(self, writer):
+        self.writers = [w for w in self.writers if w is not writer]
+        self._previous.pop(id(writer), None)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def check(self):
+        """Takes one measurement, returns the warning or None."""
+        free = shutil.disk_usage(self.path).free
+        now = time.perf_counter()
+        rate = 0.0
+        busy = []
+        for writer in self.writers:
+            previous = self._previous.get(id(writer))
+            self._previous[id(writer)] = (now, writer.bytes, writer.write_time)
+            if previous is None:
+                continue
+            elapsed = now - previous[0]
+            if elapsed <= 0:
+                continue
+            rate += (writer.bytes - previous[1]) / elapsed
+            if (writer.write_time - previous[2]) / elapsed > self.max_utilization:
+                busy.append(writer)
+        minutes_left = free / rate / 60 if rate else None
+        self.last = {
+            "free_MB": free / 2**20,
+            "write_MBps": rate / 2**20,
+            "minutes_left": minutes_left,
+            "busy_writers": [writer.filename for writer in busy],
+        }
+
+        warning = kind = None
+        if free < self.min_free_mb * 2**20 or (
+            minutes_left is not None and minutes_left < self.min_minutes
+        ):
+            warning = f"Disk {self.path}: {free / 2**20:.0f} MB free"
+            if minutes_left is not None:
+                warning += f", full in {minutes_left:.1f} min"
+            busy = self.writers
+            kind = "space"
+        elif busy:
+            kind = "busy"
+            warning = (
+                f"Disk {self.path}: writers at capacity "
+                f"({', '.join(writer.filename for writer in busy)})"
+            )
+        if warning is not None and self.downgrade:
+            downgraded = [writer.filename for writer in busy if writer.downgrade()]
+            if downgraded:
+                warning += f", switching {', '.join(downgraded)} to fallback writers"
+        # Only report changes, the numbers of a warning change every check
+        if kind is not None and kind != self._kind and self.on_warning:
+            self.on_warning(warning)
+        self._kind = kind
+        self.warning = warning
+        return warning
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
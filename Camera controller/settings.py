@@ -13,9 +13,12 @@ from PySide6.QtWidgets import (
 
 class SettingsWindow(QWidget):
     cam_parameters = Signal(tuple)
+    # (camera index or None for all cameras, roi/binning/decimation dict)
+    cam_geometry = Signal(tuple)
 
-    def __init__(self):
+    def __init__(self, n_cams=1):
         super().__init__()
+        self.n_cams = n_cams
         self.settingsUI()
 
     def getLineEdit(self, title, value, units):
@@ -55,6 +58,9 @@ class SettingsWindow(QWidget):
         expTime_layout = self.getLineEdit("Exposure Time", "1000", "µS")
         self.v_layout.addLayout(expTime_layout)
 
+        maxBuffer_layout = self.getLineEdit("Max Num Buffer", "64", "buffers")
+        self.v_layout.addLayout(maxBuffer_layout)
+
         combo_layout = QHBoxLayout()
         self.combo_box = QComboBox(self)
         self.combo_box.setCurrentIndex(0)
@@ -63,6 +69,34 @@ class SettingsWindow(QWidget):
         combo_layout.addWidget(self.combo_box)
         self.v_layout.addLayout(combo_layout)
 
+        camera_layout = QHBoxLayout()
+        self.camera_box = QComboBox(self)
+        self.camera_box.addItem("All cameras")
+        for k in range(self.n_cams):
+            self.camera_box.addItem(f"Camera {k}")
+        camera_layout.addWidget(QLabel("Geometry of"))
+        camera_layout.addWidget(self.camera_box)
+        self.v_layout.addLayout(camera_layout)
+
+        roi_layout = self.getLineEdit("ROI x, y, width, height", "", "pixels")
+        self.roi_edit = self.newLineEdit
+        self.roi_edit.setPlaceholderText("full sensor")
+        self.v_layout.addLayout(roi_layout)
+
+        binning_layout = self.getLineEdit("Binning", "1", "x")
+        self.binning_edit = self.newLineEdit
+        self.v_layout.addLayout(binning_layout)
+
+        decimation_layout = self.getLineEdit("Decimation", "1", "x")
+        self.decimation_edit = self.newLineEdit
+        self.v_layout.addLayout(decimation_layout)
+
+        self.error_label = QLabel(self)
+        self.error_label.setStyleSheet("color: red")
+        self.error_label.setWordWrap(True)
+        self.error_label.hide()
+        self.v_layout.addWidget(self.error_label)
+
         self.okButton = QPushButton("Ok", self)
         self.okButton.clicked.connect(self.connectToStream)
         self.v_layout.addWidget(self.okButton)
@@ -72,8 +106,57 @@ class SettingsWindow(QWidget):
     def closeEvent(self, event):
         event.accept()
 
+    def showError(self, message):
+        self.error_label.setText(message)
+        self.error_label.setVisible(bool(message))
+
+    def readSettings(self):
+        """Returns the camera parameters and the geometry entered, raises
+        ValueError with a message for the user if a value is invalid."""
+        values = []
+        for idx, name in enumerate(("frame rate", "exposure time", "max num buffer")):
+            try:
+                value = self.getLineEditText(idx, 1)
+            except (ValueError, OverflowError):
+                raise ValueError(f"The {name} must be a number") from None
+            if value <= 0:
+                raise ValueError(f"The {name} must be positive")
+            values.append(value)
+        roi_text = self.roi_edit.text().strip()
+        roi = None
+        if roi_text:
+            try:
+                roi = tuple(int(float(value)) for value in roi_text.split(","))
+            except (ValueError, OverflowError):
+                raise ValueError("The ROI must be numbers") from None
+            if len(roi) != 4:
+                raise ValueError("The ROI needs x, y, width and height")
+            if min(roi[:2]) < 0 or min(roi[2:]) <= 0:
+                raise ValueError("The ROI needs a positive width and height")
+        geometry = {"roi": roi}
+        for name, edit in (
+            ("binning", self.binning_edit),
+            ("decimation", self.decimation_edit),
+        ):
+            try:
+                geometry[name] = int(float(edit.text()))
+            except (ValueError, OverflowError):
+                raise ValueError(f"The {name} must be a number") from None
+            if geometry[name] < 1:
+                raise ValueError(f"The {name} must be at least 1")
+        camera_idx = self.camera_box.currentIndex() - 1
+        return (
+            (self.combo_box.currentText(), *values),
+            (None if camera_idx < 0 else camera_idx, geometry),
+        )
+
     def connectToStream(self):
-        format_str = self.combo_box.currentText()
-        current_fr = self.getLineEditText(0, 1)
-        current_ExpTime = self.getLineEditText(1, 1)
-        self.cam_parameters.emit((format_str, current_fr, current_ExpTime))
+        # Everything is checked before anything is applied
+        try:
+            parameters, geometry = self.readSettings()
+        except ValueError as err:
+            self.showError(str(err))
+            return
+        self.showError("")
+        self.cam_parameters.emit(parameters)
+        self.cam_geometry.emit(geometry)
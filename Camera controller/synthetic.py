@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+
+from acquisition import AcquisitionEngine, Frame, GrabThread
+from buffers import FramePool
+from packed import is_packed, pack, packed_shape, pixel_bits
+
+
+def synthetic_images(shape, dtype=np.uint8, count=8):
+    """Returns ``count`` images of a lab like scene: a static gradient with
+    sensor noise and a moving bright square."""
+    rng = np.random.default_rng(0)
+    info = np.iinfo(dtype)
+    height, width = shape
+    scene = np.add.outer(np.linspace(0, 0.5, height), np.linspace(0, 0.25, width))
+    images = []
+    for i in range(count):
+        image = scene + rng.normal(0, 0.01, size=shape)
+        top = (i * height // count) % max(height - height // 8, 1)
+        image[top : top + height // 8, width // 4 : width // 4 + width // 8] = 0.9
+        images.append((np.clip(image, 0, 1) * info.max).astype(dtype))
+    return images
+
+
+class SyntheticGrabThread(GrabThread):
+    """A ``GrabThread`` producing synthetic frames at a fixed rate instead of
+    grabbing from a camera. Frames go through the same ``FramePool`` copy
+    and subscriber queues as grabbed ones. With a packed ``pixel_format``
+    the frames are packed like the camera delivers them."""
+
+    def __init__(
+        self,
+        camera_idx,
+        shape,
+        dtype=np.uint8,
+        fps=100,
+        pool_size=16,
+        pixel_format=None,
+    ):
+        super().__init__(None, camera_idx, pool_size=pool_size)
+        if is_packed(pixel_format):
+            shift = 16 - pixel_bits(pixel_format)
+            self.images = [
+                pack(image >> shift, pixel_format)
+                for image in synthetic_images(shape, np.uint16)
+            ]
+            shape, dtype = packed_shape(shape, pixel_format), np.uint8
+        else:
+            self.images = synthetic_images(shape, dtype)
+        self.period = 1.0 / fps
+        self.pool = FramePool(shape, dtype, pool_size)
+
+    def run(self):
+        image_number = 0
+        next_frame = time.perf_counter()
+        while not self._stop_event.is_set():
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame += self.period
+            start = time.perf_counter()
+            image_number += 1
+            subscribers = self.subscribers
+            if subscribers:
+                image = self.images[image_number % len(self.images)]
+                self._ensure_pool(image.shape, image.dtype, subscribers)
+                lease = self.pool.acquire(refs=len(subscribers))
+                if lease is None:
+                    self.stats.lost += 1
+                    continue
+                self.pool.fill(lease, image)
+            host_timestamp = time.perf_counter()
+            self.stats.add(host_timestamp, host_timestamp - start)
+            if subscribers:
+                self.copy_time.observe(host_timestamp - start)
+            if not subscribers:
+                continue
+            frame = Frame(
+                self.camera_idx,
+                lease.array,
+                image_number,
+                int(host_timestamp * 1e9),
+                host_timestamp,
+                lease,
+            )
+            for frame_queue in subscribers:
+                frame_queue.put(frame)
+            self.publish_time.observe(time.perf_counter() - host_timestamp)
+
+
+class SyntheticEngine(AcquisitionEngine):
+    """An ``AcquisitionEngine`` of ``n_cams`` synthetic cameras."""
+
+    def __init__(self, n_cams, shape, dtype=np.uint8, fps=100, pixel_format=None):
+        self.cameras = []
+        self.threads = [
+            SyntheticGrabThread(idx, shape, dtype, fps, pixel_format=pixel_format)
+            for idx in range(n_cams)
+        ]
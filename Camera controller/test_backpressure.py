@@ -0,0 +1,82 @@
+"""Tests of the degradation steps of ``LoadController``."""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from acquisition import FrameQueue
+from backpressure import LEVELS, LoadController, cheap_spec
+from reader import RecordingReader
+from segments import SegmentedWriter
+from writers import ChunkedCompressed_Writer, FFMPEG_VideoWriter, make_writer_spec
+
+
+def make_worker(writer):
+    return SimpleNamespace(writer=writer, frame_queue=FrameQueue(8, block=True))
+
+
+def make_controller(tmp_path, workers):
+    controller = LoadController(
+        SimpleNamespace(threads=[]),
+        escalate_after=1,
+        recover_after=1,
+        log_file=str(tmp_path / "load_controller.jsonl"),
+    )
+    for worker in workers:
+        controller.add(worker)
+    return controller
+
+
+def set_load(controller, load, level):
+    controller.measure = lambda: load
+    while controller.level != LEVELS.index(level):
+        controller.check()
+
+
+def test_cheap_writers_stops_compressing(tmp_path):
+    writer = ChunkedCompressed_Writer("cam.bcz", chunk_frames=2, threads=1)
+    worker = make_worker(writer)
+    controller = make_controller(tmp_path, [worker])
+    frames = [np.full((32, 32), value, np.uint8) for value in range(4)]
+    writer.write_frame(frames[0], str(tmp_path))
+    writer.write_frame(frames[1], str(tmp_path))
+    set_load(controller, 1.0, "cheap_writers")
+    assert writer.level == 0
+    writer.write_frame(frames[2], str(tmp_path))
+    writer.write_frame(frames[3], str(tmp_path))
+    set_load(controller, 0.0, "no_preview")
+    assert writer.level == 1
+    writer.close()
+    stats = writer.chunk_stats
+    # The second chunk is stored, larger than the raw frames
+    assert stats[0]["compressed_bytes"] < stats[0]["raw_bytes"]
+    assert stats[1]["compressed_bytes"] > stats[1]["raw_bytes"]
+    with RecordingReader(str(tmp_path / "cam.bcz")) as reader:
+        for idx, frame in enumerate(frames):
+            np.testing.assert_array_equal(reader.frame(idx), frame)
+
+
+def test_cheap_writers_switches_the_next_segment(tmp_path):
+    spec = make_writer_spec(
+        "compressed", "cam", (32, 32), 30, options={"chunk_frames": 2}
+    )
+    writer = SegmentedWriter("cam.bcz", spec)
+    controller = make_controller(tmp_path, [make_worker(writer)])
+    frame = np.zeros((32, 32), np.uint8)
+    writer.write_frame(frame, str(tmp_path))
+    set_load(controller, 1.0, "drop_frames")
+    writer.write_frame(frame, str(tmp_path))
+    writer.close()
+    assert [segment["frames"] for segment in writer.segments] == [1, 1]
+    assert writer.writer.level == 0
+
+
+def test_cheap_spec():
+    x264 = (FFMPEG_VideoWriter, ("cam.avi", (32, 32)), {"codec": "libx264"})
+    assert cheap_spec(x264)[2]["preset"] == "ultrafast"
+    assert cheap_spec(cheap_spec(x264)) is None
+    # Raw video has no encoder to speed up
+    assert cheap_spec(make_writer_spec("ffmpeg", "cam", (32, 32), 30)) is None
+    zlib = make_writer_spec("compressed", "cam", (32, 32), 30)
+    assert cheap_spec(zlib)[2]["level"] == 0
+    assert cheap_spec(make_writer_spec("raw_file", "cam", (32, 32), 30)) is None
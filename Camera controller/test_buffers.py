@@ -0,0 +1,158 @@
+"""Tests of the accounting of ``FramePool`` and ``FrameQueue``."""
+
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from acquisition import Frame, FrameQueue
+from buffers import FramePool
+
+
+def make_frame(pool, number, refs=1):
+    lease = pool.acquire(refs)
+    pool.fill(lease, np.full(pool.shape, number, pool.dtype))
+    return Frame(0, lease.array, number, 0, time.perf_counter(), lease)
+
+
+def numbers(frame_queue):
+    frames = []
+    while frame_queue.qsize():
+        frames.append(frame_queue.get(timeout=0))
+    for frame in frames:
+        frame.release()
+    return [frame.image_number for frame in frames]
+
+
+def test_pool_overrun_and_release():
+    pool = FramePool((4, 4), np.uint8, size=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert pool.acquire() is None
+    assert pool.overruns == 1
+    assert pool.in_use() == 2
+    first.release()
+    assert pool.in_use() == 1
+    assert pool.acquire() is first
+    first.release()
+    second.release()
+    assert pool.in_use() == 0
+    assert pool.acquired == 3
+
+
+def test_pool_lease_goes_back_after_every_holder_released():
+    pool = FramePool((4, 4), np.uint8, size=1)
+    lease = pool.acquire(refs=2)
+    lease.release()
+    assert pool.in_use() == 1
+    lease.release()
+    assert pool.in_use() == 0
+
+
+def test_pool_acquire_waits_for_a_release():
+    pool = FramePool((4, 4), np.uint8, size=1)
+    lease = pool.acquire()
+    threading.Timer(0.05, lease.release).start()
+    assert pool.acquire(timeout=5) is lease
+    assert pool.overruns == 0
+    lease.release()
+    assert pool.acquire(timeout=0.01) is not None
+    assert pool.acquire(timeout=0.01) is None
+    assert pool.overruns == 1
+
+
+def test_pool_views_are_read_only():
+    pool = FramePool((4, 4), np.uint8, size=1)
+    frame = make_frame(pool, 7)
+    assert (frame.array == 7).all()
+    with pytest.raises(ValueError):
+        frame.array[0, 0] = 1
+
+
+def test_drop_oldest_counts_the_drops():
+    pool = FramePool((4, 4), np.uint8, size=8)
+    frame_queue = FrameQueue(maxsize=2)
+    for number in range(5):
+        frame_queue.put(make_frame(pool, number))
+    assert frame_queue.dropped == 3
+    assert pool.dropped == 3
+    assert pool.in_use() == 2
+    assert numbers(frame_queue) == [3, 4]
+    assert pool.in_use() == 0
+
+
+def test_block_waits_for_the_consumer():
+    pool = FramePool((4, 4), np.uint8, size=8)
+    frame_queue = FrameQueue(maxsize=1, block=True, block_timeout=5)
+    frame_queue.put(make_frame(pool, 0))
+    taken = []
+    threading.Timer(0.05, lambda: taken.append(frame_queue.get())).start()
+    start = time.perf_counter()
+    frame_queue.put(make_frame(pool, 1))
+    assert time.perf_counter() - start >= 0.04
+    assert frame_queue.dropped == 0
+    assert [frame.image_number for frame in taken] == [0]
+    taken[0].release()
+    assert numbers(frame_queue) == [1]
+    assert pool.in_use() == 0
+
+
+def test_block_drops_after_the_timeout():
+    pool = FramePool((4, 4), np.uint8, size=8)
+    frame_queue = FrameQueue(maxsize=1, block=True, block_timeout=0.05)
+    frame_queue.put(make_frame(pool, 0))
+    frame_queue.put(make_frame(pool, 1))
+    assert frame_queue.dropped == 1
+    assert pool.dropped == 1
+    assert numbers(frame_queue) == [1]
+
+
+def test_latest_replaces_without_counting():
+    pool = FramePool((4, 4), np.uint8, size=8)
+    frame_queue = FrameQueue(maxsize=2, latest=True)
+    for number in range(5):
+        frame_queue.put(make_frame(pool, number))
+    assert pool.in_use() == 2
+    frame = frame_queue.get_latest()
+    assert frame.image_number == 4
+    # The older frame was skipped on purpose
+    assert frame_queue.qsize() == 0
+    assert pool.in_use() == 1
+    frame.release()
+    assert frame_queue.get_latest() is None
+    assert frame_queue.dropped == 0
+    assert pool.dropped == 0
+    assert pool.in_use() == 0
+
+
+@pytest.mark.parametrize("latest", [False, True])
+def test_close_drops_queued_and_later_frames(latest):
+    pool = FramePool((4, 4), np.uint8, size=8)
+    frame_queue = FrameQueue(maxsize=4, latest=latest)
+    frame_queue.put(make_frame(pool, 0))
+    frame_queue.close()
+    frame_queue.put(make_frame(pool, 1))
+    assert frame_queue.qsize() == 0
+    assert pool.in_use() == 0
+    # Frames discarded by a latest queue are not drops
+    assert frame_queue.dropped == pool.dropped == (0 if latest else 2)
+
+
+def test_shared_frame_released_once_per_subscriber():
+    pool = FramePool((4, 4), np.uint8, size=1)
+    queues = [FrameQueue(maxsize=1), FrameQueue(maxsize=1, latest=True)]
+    frame = make_frame(pool, 0, refs=len(queues))
+    for frame_queue in queues:
+        frame_queue.put(frame)
+    queues[0].get().release()
+    assert pool.in_use() == 1
+    queues[1].get_latest().release()
+    assert pool.in_use() == 0
+
+
+def test_get_times_out():
+    frame_queue = FrameQueue()
+    with pytest.raises(queue.Empty):
+        frame_queue.get(timeout=0.01)
@@ -0,0 +1,202 @@
+"""Tests of the async mode of ``FFMPEG_VideoWriter``.
+
+A Python script stands in for ffmpeg: it waits until the file named by
+``STANDIN_GO`` exists, then copies stdin to its last argument, so a test can
+hold the pipe full while it fills the writer queue. Its arguments are saved
+to ``STANDIN_ARGV``. The frames are larger
+than a pipe buffer, so the writer thread blocks on the first one.
+"""
+
+import json
+import os
+import stat
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from writers import FFMPEG_VideoWriter
+
+SHAPE = (1024, 1024)
+STANDIN = """#!{python}
+import json, os, shutil, sys, time
+with open(os.environ["STANDIN_ARGV"], "w") as argv:
+    json.dump(sys.argv[1:], argv)
+go = os.environ["STANDIN_GO"]
+if go == "exit":
+    sys.exit(1)
+while not os.path.exists(go):
+    time.sleep(0.01)
+with open(sys.argv[-1], "wb") as output:
+    shutil.copyfileobj(sys.stdin.buffer, output)
+"""
+
+
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(STANDIN.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    go = tmp_path / "go"
+    monkeypatch.setenv("STANDIN_GO", str(go))
+    monkeypatch.setenv("STANDIN_ARGV", str(tmp_path / "argv.json"))
+    return str(path), go
+
+
+def make_writer(binary, policy="block", queue_size=2):
+    return FFMPEG_VideoWriter(
+        "out.avi",
+        SHAPE,
+        30,
+        pixfmt="gray",
+        ffmpeg_binary=binary,
+        async_mode=True,
+        queue_size=queue_size,
+        policy=policy,
+    )
+
+
+def frames(count):
+    return [np.full(SHAPE, value, np.uint8) for value in range(count)]
+
+
+class Releases:
+    """Counts the release calls of every frame."""
+
+    def __init__(self, count):
+        self.counts = [0] * count
+
+    def callback(self, idx):
+        def release():
+            self.counts[idx] += 1
+
+        return release
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def written_values(path):
+    data = np.fromfile(path, np.uint8).reshape(-1, *SHAPE)
+    return [int(frame[0, 0]) for frame in data]
+
+
+def fill_queue(writer, images, releases, file_loc):
+    """Writes the first frame, waits until the writer thread is stuck on it,
+    then fills the queue with the next ``queue_size`` frames."""
+    writer.write_frame(images[0], file_loc, releases.callback(0))
+    wait_until(lambda: not writer.frame_queue)
+    for idx in range(1, writer.queue_size + 1):
+        writer.write_frame(images[idx], file_loc, releases.callback(idx))
+    assert len(writer.frame_queue) == writer.queue_size
+
+
+def test_release_once_per_frame(standin, tmp_path):
+    binary, go = standin
+    go.touch()
+    images = frames(10)
+    releases = Releases(len(images))
+    writer = make_writer(binary)
+    for idx, image in enumerate(images):
+        writer.write_frame(image, str(tmp_path), releases.callback(idx))
+    writer.close()
+    assert releases.counts == [1] * len(images)
+    assert written_values(tmp_path / "out.avi") == list(range(len(images)))
+
+
+def test_single_output_argument(standin, tmp_path, monkeypatch):
+    binary, go = standin
+    go.touch()
+    cwd = tmp_path / "cwd"
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    output = tmp_path / "recordings"
+    output.mkdir()
+    images = frames(2)
+    releases = Releases(len(images))
+    writer = make_writer(binary)
+    for idx, image in enumerate(images):
+        writer.write_frame(image, str(output), releases.callback(idx))
+    writer.close()
+    argv = json.loads((tmp_path / "argv.json").read_text())
+    # The output is only given once, as the last argument
+    assert argv[-1] == f"{output}/out.avi"
+    assert [arg for arg in argv if arg.endswith("out.avi")] == [argv[-1]]
+    assert list(cwd.iterdir()) == []
+    assert written_values(output / "out.avi") == [0, 1]
+
+
+def test_block_waits_for_the_queue(standin, tmp_path):
+    binary, go = standin
+    images = frames(4)
+    releases = Releases(len(images))
+    writer = make_writer(binary, "block")
+    fill_queue(writer, images, releases, str(tmp_path))
+    blocked = threading.Thread(
+        target=writer.write_frame,
+        args=(images[3], str(tmp_path), releases.callback(3)),
+    )
+    blocked.start()
+    time.sleep(0.2)
+    assert blocked.is_alive()
+    go.touch()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.close()
+    assert writer.dropped == 0
+    assert releases.counts == [1] * len(images)
+    assert written_values(tmp_path / "out.avi") == [0, 1, 2, 3]
+
+
+def test_drop_oldest(standin, tmp_path):
+    binary, go = standin
+    images = frames(4)
+    releases = Releases(len(images))
+    writer = make_writer(binary, "drop-oldest")
+    fill_queue(writer, images, releases, str(tmp_path))
+    writer.write_frame(images[3], str(tmp_path), releases.callback(3))
+    # The oldest queued frame goes, not the one being written
+    assert releases.counts == [0, 1, 0, 0]
+    go.touch()
+    writer.close()
+    assert writer.dropped == 1
+    assert releases.counts == [1] * len(images)
+    assert written_values(tmp_path / "out.avi") == [0, 2, 3]
+
+
+def test_drop_newest(standin, tmp_path):
+    binary, go = standin
+    images = frames(4)
+    releases = Releases(len(images))
+    writer = make_writer(binary, "drop-newest")
+    fill_queue(writer, images, releases, str(tmp_path))
+    writer.write_frame(images[3], str(tmp_path), releases.callback(3))
+    assert releases.counts == [0, 0, 0, 1]
+    go.touch()
+    writer.close()
+    assert writer.dropped == 1
+    assert releases.counts == [1] * len(images)
+    assert written_values(tmp_path / "out.avi") == [0, 1, 2]
+
+
+def test_dead_process_raises(standin, tmp_path, monkeypatch):
+    binary, _ = standin
+    monkeypatch.setenv("STANDIN_GO", "exit")
+    images = frames(2)
+    releases = Releases(len(images))
+    writer = make_writer(binary)
+    writer.write_frame(images[0], str(tmp_path), releases.callback(0))
+    wait_until(lambda: writer.error is not None)
+    with pytest.raises(IOError):
+        writer.write_frame(images[1], str(tmp_path), releases.callback(1))
+    with pytest.raises(IOError):
+        writer.close()
+    assert releases.counts == [1, 1]
+    assert not os.path.exists(tmp_path / "out.avi")
@@ -0,0 +1,25 @@
+"""Tests of ``ImageStats`` on a synthetic camera."""
+
+import time
+
+from imagestats import ImageStats
+from synthetic import SyntheticEngine
+
+
+def test_stop_releases_the_queued_frames():
+    engine = SyntheticEngine(1, (64, 64), fps=200)
+    engine.start()
+    try:
+        for _ in range(5):
+            # Toggled on and off without reading, a frame is left queued
+            stats = ImageStats(engine)
+            deadline = time.perf_counter() + 5
+            while not stats.queues[0].qsize():
+                assert time.perf_counter() < deadline, "no frame arrived"
+                time.sleep(0.005)
+            stats.stop()
+    finally:
+        engine.stop()
+    pool = engine.threads[0].pool
+    assert pool.in_use() == 0
+    assert pool.dropped == 0
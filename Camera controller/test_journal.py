@@ -0,0 +1,95 @@
+"""Tests of the commit journal of ``journal.py``."""
+
+import os
+
+import numpy as np
+import pytest
+
+from journal import JOURNAL_CHECK, JOURNAL_DTYPE, JOURNAL_MAGIC, Journal, read_journal
+
+
+def make_journal(tmp_path, **kwargs):
+    syncs = []
+    journal = Journal(
+        str(tmp_path / "cam.raw.journal"), lambda: syncs.append(1), **kwargs
+    )
+    return journal, syncs
+
+
+def test_commits_every_sync_frames(tmp_path):
+    journal, syncs = make_journal(tmp_path, sync_frames=3, sync_seconds=None)
+    for _ in range(7):
+        journal.written()
+    assert journal.commits == len(syncs) == 2
+    assert journal.committed == 6
+    assert read_journal(journal.filename) == 6
+    journal.commit()
+    assert read_journal(journal.filename) == 7
+    # Nothing new, no sync
+    journal.commit()
+    assert journal.commits == len(syncs) == 3
+    journal.close(remove=False)
+    assert read_journal(journal.filename) == 7
+
+
+def test_commits_after_sync_seconds(tmp_path):
+    journal, _ = make_journal(tmp_path, sync_frames=None, sync_seconds=0)
+    journal.written(4)
+    journal.written()
+    assert journal.commits == 2
+    assert read_journal(journal.filename) == 5
+    journal.close()
+
+
+def test_no_limits_commit_on_request(tmp_path):
+    journal, syncs = make_journal(tmp_path, sync_frames=None, sync_seconds=None)
+    journal.written(100)
+    assert not syncs
+    assert read_journal(journal.filename) == 0
+    journal.commit()
+    assert read_journal(journal.filename) == 100
+    journal.close()
+
+
+def test_close_removes_the_journal(tmp_path):
+    journal, _ = make_journal(tmp_path, sync_frames=1)
+    journal.written()
+    journal.close()
+    assert not os.path.exists(journal.filename)
+    # A second close does nothing
+    journal.close()
+
+
+def write_records(filename, frames, tail=b""):
+    records = np.array([(n, n ^ JOURNAL_CHECK) for n in frames], JOURNAL_DTYPE)
+    with open(filename, "wb") as file:
+        file.write(JOURNAL_MAGIC + records.tobytes() + tail)
+    return records
+
+
+def test_torn_record_is_ignored(tmp_path):
+    filename = str(tmp_path / "cam.raw.journal")
+    write_records(filename, [2, 4], tail=b"\x06\x00\x00")
+    assert read_journal(filename) == 4
+
+
+def test_corrupted_record_is_ignored(tmp_path):
+    filename = str(tmp_path / "cam.raw.journal")
+    records = write_records(filename, [2, 4, 6])
+    records[-1]["frames"] = 600
+    with open(filename, "wb") as file:
+        file.write(JOURNAL_MAGIC + records.tobytes())
+    assert read_journal(filename) == 4
+
+
+def test_empty_journal(tmp_path):
+    filename = str(tmp_path / "cam.raw.journal")
+    write_records(filename, [])
+    assert read_journal(filename) == 0
+
+
+def test_not_a_journal(tmp_path):
+    filename = tmp_path / "cam.raw.journal"
+    filename.write_bytes(b"BCRAW001")
+    with pytest.raises(ValueError):
+        read_journal(str(filename))
@@ -0,0 +1,65 @@
+"""Tests of the packed pixel formats of ``packed.py``."""
+
+import numpy as np
+import pytest
+
+from packed import (
+    PACKED_FORMATS,
+    frame_nbytes,
+    pack,
+    packed_shape,
+    pixel_bits,
+    preview_8bit,
+    to_8bit,
+    unpack,
+    unpacked_shape,
+)
+
+
+@pytest.mark.parametrize("pixel_format", sorted(PACKED_FORMATS))
+def test_pack_round_trip(pixel_format):
+    bits, pixels, nbytes = PACKED_FORMATS[pixel_format]
+    shape = (6, 8 * pixels)
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 2**bits, shape, dtype=np.uint16)
+    packed = pack(image, pixel_format)
+    assert packed.dtype == np.uint8
+    assert packed.shape == packed_shape(shape, pixel_format) == (6, 8 * nbytes)
+    assert unpacked_shape(packed.shape, pixel_format) == shape
+    assert packed.size == frame_nbytes(shape, pixel_format)
+    np.testing.assert_array_equal(unpack(packed, pixel_format), image)
+
+
+@pytest.mark.parametrize("pixel_format", sorted(PACKED_FORMATS))
+def test_pack_extremes(pixel_format):
+    bits, pixels, _ = PACKED_FORMATS[pixel_format]
+    image = np.zeros((2, 2 * pixels), np.uint16)
+    image[0] = 2**bits - 1
+    image[:, ::2] ^= 2**bits - 1
+    np.testing.assert_array_equal(unpack(pack(image, pixel_format), pixel_format), image)
+
+
+def test_known_layouts():
+    image = np.array([[0x123, 0x456]], np.uint16)
+    assert pack(image, "Mono12p").tolist() == [[0x23, 0x61, 0x45]]
+    assert pack(image, "Mono12Packed").tolist() == [[0x12, 0x63, 0x45]]
+
+
+def test_width_must_fill_the_groups():
+    with pytest.raises(ValueError):
+        packed_shape((4, 6), "Mono10p")
+
+
+def test_unpacked_formats():
+    assert pixel_bits("Mono12p") == 12
+    assert pixel_bits("Mono16") == 16
+    assert pixel_bits("BayerRG8") == 8
+    assert frame_nbytes((4, 6), "Mono16", np.uint16) == 48
+
+
+def test_to_8bit():
+    image = np.array([[0, 2048, 4095]], np.uint16)
+    assert to_8bit(image, bits=12).tolist() == [[0, 127, 255]]
+    assert to_8bit(image, lo=2048, hi=3071).tolist() == [[0, 0, 255]]
+    packed = pack(np.array([[0, 4095]], np.uint16), "Mono12p")
+    assert preview_8bit(packed, "Mono12p").tolist() == [[0, 255]]
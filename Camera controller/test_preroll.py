@@ -0,0 +1,40 @@
+"""Tests of ``PreRollBuffer`` on a synthetic camera."""
+
+import queue
+import time
+
+from preroll import PreRollManager
+from synthetic import SyntheticEngine
+
+
+def test_recording_continues_the_preroll():
+    engine = SyntheticEngine(1, (64, 64), fps=200)
+    preroll = PreRollManager(engine, seconds=0.5, max_mb=16)
+    engine.start()
+    try:
+        time.sleep(0.8)
+        output_queue = preroll.start_recording(0, maxsize=64)
+        numbers = []
+        deadline = time.perf_counter() + 0.5
+        while time.perf_counter() < deadline:
+            try:
+                frame = output_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            numbers.append(frame.image_number)
+            frame.release()
+        preroll.stop_recording(0)
+    finally:
+        preroll.close()
+        engine.stop()
+    # The pre-roll and the live frames follow each other in order, frames
+    # are only missing where the buffer or the grab thread counted a loss
+    assert numbers == sorted(set(numbers))
+    missing = numbers[-1] - numbers[0] + 1 - len(numbers)
+    assert missing <= (
+        preroll.buffers[0].input_queue.dropped + engine.threads[0].stats.lost
+    )
+    stats = preroll.stats()[0]
+    assert 0.4 < stats["flushed_seconds"] <= 0.5
+    assert stats["flush_drain_ms"] is not None
+    assert output_queue.dropped == 0
@@ -0,0 +1,105 @@
+"""Round trips of the writers through ``RecordingReader``."""
+
+import numpy as np
+import pytest
+
+from compression import apply_filters, available_codecs, undo_filters
+from packed import pack
+from reader import RecordingReader
+from writers import ChunkedCompressed_Writer, RawFile_Writer, Raw_Writer
+
+SHAPE = (24, 32)
+FRAMES = 12
+
+
+def make_frames(dtype=np.uint8, bits=8):
+    # A drifting ramp plus noise, so that the delta and shuffle filters have
+    # something to do and the pixels use every byte
+    rng = np.random.default_rng(0)
+    ramp = np.add.outer(np.arange(SHAPE[0]), np.arange(SHAPE[1]))
+    frames = [
+        (ramp * 7 + 13 * i + rng.integers(0, 4, SHAPE)) % 2**bits
+        for i in range(FRAMES)
+    ]
+    return [frame.astype(dtype) for frame in frames]
+
+
+def write(writer, frames, path):
+    for frame in frames:
+        writer.write_frame(frame, str(path))
+    writer.close()
+    return str(path / writer.filename)
+
+
+def check_frames(filename, frames):
+    with RecordingReader(filename) as reader:
+        assert len(reader) == len(frames)
+        assert reader.shape == frames[0].shape
+        assert reader.dtype == frames[0].dtype
+        for idx, frame in enumerate(frames):
+            np.testing.assert_array_equal(reader[idx], frame)
+        np.testing.assert_array_equal(reader[-1], frames[-1])
+        np.testing.assert_array_equal(reader[2:11:3], np.stack(frames[2:11:3]))
+        np.testing.assert_array_equal(
+            np.stack(list(reader.iter_frames(1, step=4))), np.stack(frames[1::4])
+        )
+        with pytest.raises(IndexError):
+            reader.frame(len(frames))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_raw_file(tmp_path, dtype):
+    frames = make_frames(dtype, 12 if dtype == np.uint16 else 8)
+    filename = write(RawFile_Writer("cam.raw", grow_frames=5), frames, tmp_path)
+    check_frames(filename, frames)
+
+
+def test_npz(tmp_path):
+    frames = make_frames()
+    filename = write(Raw_Writer("cam.npz"), frames, tmp_path)
+    # frame_10 sorts before frame_2 by name
+    check_frames(filename, frames)
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+@pytest.mark.parametrize("filters", [(), ("delta",), ("shuffle",), ("delta", "shuffle")])
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_chunked(tmp_path, codec, filters, dtype):
+    frames = make_frames(dtype, 12 if dtype == np.uint16 else 8)
+    # A partial last chunk
+    writer = ChunkedCompressed_Writer(
+        "cam.bcz", codec=codec, filters=filters, chunk_frames=5, threads=2
+    )
+    filename = write(writer, frames, tmp_path)
+    assert [stats["frames"] for stats in writer.chunk_stats] == [5, 5, 2]
+    check_frames(filename, frames)
+
+
+@pytest.mark.parametrize("filters", [("delta",), ("shuffle",), ("delta", "shuffle")])
+def test_filters_round_trip(filters):
+    chunk = np.stack(make_frames(np.uint16, 16))
+    data = apply_filters(chunk, filters)
+    assert data.nbytes == chunk.nbytes
+    restored = undo_filters(data.tobytes(), FRAMES, SHAPE, chunk.dtype, filters)
+    np.testing.assert_array_equal(restored, chunk)
+
+
+@pytest.mark.parametrize("writer_cls", [RawFile_Writer, ChunkedCompressed_Writer])
+def test_packed_frames(tmp_path, writer_cls):
+    images = make_frames(np.uint16, 12)
+    frames = [pack(image, "Mono12p") for image in images]
+    writer = writer_cls("cam.rec", pixel_format="Mono12p")
+    filename = write(writer, frames, tmp_path)
+    check_frames(filename, frames)
+    with RecordingReader(filename) as reader:
+        assert reader.pixel_format == "Mono12p"
+        for idx, image in enumerate(images):
+            np.testing.assert_array_equal(reader.image(idx), image)
+        assert reader.image_8bit(0).dtype == np.uint8
+
+
+def test_unknown_file(tmp_path):
+    filename = tmp_path / "cam.txt"
+    filename.write_bytes(b"not a recording")
+    with pytest.raises(ValueError):
+        RecordingReader(str(filename))
@@ -0,0 +1,113 @@
+"""Tests of ``recover.py`` on recordings whose writer process was killed.
+
+The writer runs in a child process that writes ``FRAMES`` frames with a
+journal commit every ``SYNC_FRAMES`` frames, reports that it is done and
+waits to be killed, so the recording is left without ``close()``.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import zipfile
+
+import numpy as np
+import pytest
+
+import recover
+from writers import RawFile_Writer, load_raw
+
+SHAPE = (64, 48)
+FRAMES = 7
+SYNC_FRAMES = 2
+WRITER = """
+import sys, time
+import numpy as np
+import writers
+writer = getattr(writers, sys.argv[1])(sys.argv[2], sync_frames={sync}, sync_seconds=None)
+for value in range({frames}):
+    writer.write_frame(np.full({shape}, value, np.uint8), sys.argv[3])
+print("written", flush=True)
+time.sleep(60)
+"""
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def kill_writer(writer_cls, filename, path):
+    """Writes ``FRAMES`` frames in a child process and kills it."""
+    script = WRITER.format(sync=SYNC_FRAMES, frames=FRAMES, shape=SHAPE)
+    child = subprocess.Popen(
+        [sys.executable, "-c", script, writer_cls, filename, str(path)],
+        cwd=HERE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert child.stdout.readline().strip() == "written"
+    finally:
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+        child.stdout.close()
+
+
+# The frames after the last commit are dropped
+COMMITTED = FRAMES - FRAMES % SYNC_FRAMES
+
+
+@pytest.mark.skipif(os.name == "nt", reason="uses SIGKILL")
+def test_recover_killed_raw_writer(tmp_path):
+    kill_writer("RawFile_Writer", "cam1.raw", tmp_path)
+    filename = str(tmp_path / "cam1.raw")
+    assert recover.find_unfinished([str(tmp_path)]) == [filename]
+    assert recover.recover(filename) == COMMITTED
+    assert not os.path.exists(f"{filename}.journal")
+    frames = load_raw(filename)
+    assert frames.shape == (COMMITTED, *SHAPE)
+    assert [int(frame[0, 0]) for frame in frames] == list(range(COMMITTED))
+
+
+@pytest.mark.skipif(os.name == "nt", reason="uses SIGKILL")
+def test_recover_killed_npz_writer(tmp_path):
+    kill_writer("Raw_Writer", "cam1.npz", tmp_path)
+    filename = str(tmp_path / "cam1.npz")
+    # Only the journal and the frame files exist
+    assert not os.path.exists(filename)
+    assert recover.find_unfinished([str(tmp_path)]) == [filename]
+    assert recover.recover(filename) == COMMITTED
+    assert not os.path.exists(f"{filename}.journal")
+    assert not os.path.exists(tmp_path / "cam1")
+    with zipfile.ZipFile(filename) as archive:
+        assert len(archive.namelist()) == COMMITTED
+    frames = np.load(filename)
+    values = [int(frames[f"cam1/frame_{fnum}"][0, 0]) for fnum in range(COMMITTED)]
+    assert values == list(range(COMMITTED))
+
+
+def abandon_raw_writer(path, filename, frames):
+    """Writes ``frames`` frames and drops the writer without ``close()``."""
+    writer = RawFile_Writer(filename, sync_frames=SYNC_FRAMES, sync_seconds=None)
+    for value in range(frames):
+        writer.write_frame(np.full(SHAPE, value, np.uint8), str(path))
+    writer.file.close()
+    writer.journal.file.close()
+
+
+def test_main_recovers_a_directory(tmp_path, capsys):
+    abandon_raw_writer(tmp_path, "cam1.raw", FRAMES)
+    abandon_raw_writer(tmp_path, "cam2.raw", 4)
+    assert recover.main([str(tmp_path)]) == 0
+    output = capsys.readouterr().out
+    assert f"cam1.raw: {COMMITTED} frames recovered" in output
+    assert "cam2.raw: 4 frames recovered" in output
+    assert len(load_raw(str(tmp_path / "cam2.raw"))) == 4
+    assert recover.main([str(tmp_path)]) == 0
+    assert "No unfinished recordings found" in capsys.readouterr().out
+
+
+def test_main_reports_other_files(tmp_path, capsys):
+    (tmp_path / "notes.txt").write_bytes(b"not a recording")
+    (tmp_path / "notes.txt.journal").write_bytes(b"")
+    with pytest.raises(ValueError):
+        recover.recover(str(tmp_path / "notes.txt"))
+    assert recover.main([str(tmp_path)]) == 1
+    assert "not a raw or npz recording" in capsys.readouterr().out
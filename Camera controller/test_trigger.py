@@ -0,0 +1,130 @@
+"""Tests of the frame matching of ``TriggerScheduler``.
+
+Fake cameras deliver one frame per software trigger, synchronously, with
+the trigger id in the frame data, so every frame can be checked against
+the frameset it was put in.
+"""
+
+import queue
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from acquisition import Frame, FrameQueue
+from trigger import TriggerScheduler
+
+TRIGGERS = 20
+
+
+class FakeCamera:
+    """Delivers the frame of every trigger except those in ``lose`` (lost
+    by the camera, reported in ``Frame.lost``) and ``discard`` (skipped
+    image numbers, like frames dropped from a queue). Grabbing is restarted
+    before trigger ``restart_at``, which is then not fired."""
+
+    def __init__(self, idx, engine, lose=(), discard=(), restart_at=None):
+        self.idx = idx
+        self.engine = engine
+        self.lose = set(lose)
+        self.discard = set(discard)
+        self.restart_at = restart_at
+        self.checks = 0
+        self.image_number = 0
+        self.lost = 0
+
+    def WaitForFrameTriggerReady(self, timeout, handling):
+        # Every trigger checks every camera once, in order
+        self.checks += 1
+        if self.checks - 1 == self.restart_at:
+            self.engine.threads[self.idx].generation += 1
+            self.image_number = 0
+            self.lost = 0
+        return True
+
+    def ExecuteSoftwareTrigger(self):
+        trigger_id = self.checks - 1
+        if trigger_id in self.lose:
+            # The camera does not number the frames it lost
+            self.lost += 1
+            return
+        self.image_number += 1
+        if trigger_id in self.discard:
+            return
+        frame = Frame(
+            self.idx,
+            np.array([trigger_id]),
+            self.image_number,
+            0,
+            time.perf_counter(),
+            lost=self.lost,
+            generation=self.engine.threads[self.idx].generation,
+        )
+        self.lost = 0
+        self.engine.frame_queue.put(frame)
+
+
+class FakeEngine:
+    def __init__(self, n_cams):
+        self.threads = [SimpleNamespace(generation=0) for _ in range(n_cams)]
+        self.cameras = []
+        self.frame_queue = None
+
+    def subscribe_all(self, maxsize=64, block=False):
+        self.frame_queue = FrameQueue(maxsize, block)
+        return self.frame_queue
+
+    def unsubscribe_all(self, frame_queue):
+        pass
+
+
+def run_scheduler(engine):
+    scheduler = TriggerScheduler(engine, rate=500, timeout_ms=200)
+    framesets = []
+    scheduler.start()
+    while scheduler.fired < TRIGGERS:
+        try:
+            framesets.append(scheduler.framesets.get(timeout=0.01))
+        except queue.Empty:
+            pass
+    scheduler.stop()
+    while not scheduler.framesets.empty():
+        framesets.append(scheduler.framesets.get())
+    assert [frameset.trigger_id for frameset in framesets] == list(
+        range(scheduler.fired)
+    )
+    for frameset in framesets:
+        for frame in frameset.frames.values():
+            assert frame.array[0] == frameset.trigger_id
+    return framesets
+
+
+def missing(framesets, idx):
+    return [
+        frameset.trigger_id for frameset in framesets if idx in frameset.missing
+    ]
+
+
+def test_matches_frames_to_their_trigger():
+    engine = FakeEngine(2)
+    engine.cameras = [
+        FakeCamera(0, engine),
+        FakeCamera(1, engine, lose=[3], discard=[7, 8]),
+    ]
+    framesets = run_scheduler(engine)
+    assert missing(framesets, 0) == []
+    assert missing(framesets, 1) == [3, 7, 8]
+
+
+def test_restarted_grabbing():
+    engine = FakeEngine(2)
+    engine.cameras = [
+        FakeCamera(0, engine),
+        # The frame of trigger 5 is discarded by the restart
+        FakeCamera(1, engine, lose=[2], discard=[5], restart_at=6),
+    ]
+    framesets = run_scheduler(engine)
+    assert missing(framesets, 0) == []
+    # Trigger 6 was not fired, the camera was restarted while checking
+    assert missing(framesets, 1) == [2, 5, 6]
+    assert all(1 in frameset.frames for frameset in framesets[7:])
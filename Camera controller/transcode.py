@@ -0,0 +1,272 @@
+"""Batch transcoder for recordings.
+
+Converts npz, raw and compressed recordings, or a range of their frames, to
+video with ``FFMPEG_VideoWriter`` or to the single-file raw format of
+``RawFile_Writer``. Example::
+
+    python transcode.py D:/captures/*.npz --to ffmpeg --output-dir D:/videos
+    python transcode.py cam_0_output.raw --to ffmpeg --range 60:120
+
+Every recording is a job run in a process pool. Inside a job a reader
+thread loads and decodes the frames ahead of the writer, and the ffmpeg
+writer encodes in its own process, so reading, decoding and encoding
+overlap. Finished jobs are kept in ``<output-dir>/transcode_state.json``;
+running the same command again skips them, so an interrupted batch resumes
+where it stopped.
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from packed import is_packed, unpacked_shape
+from reader import RecordingReader
+from writers import FFMPEG_BINARY, make_writer_spec
+
+STATE_FILE = "transcode_state.json"
+# Frames decoded ahead of the writer
+PREFETCH_FRAMES = 32
+
+
+def frame_range(reader, frames=None, seconds=None):
+    """Returns the (start, stop) frame indices of a job.
+
+    ``frames`` is a (start, stop) pair of frame indices and ``seconds`` a
+    (start, stop) pair of seconds from the first frame, using the host
+    timestamps of the metadata sidecar. None means the start or end of the
+    recording."""
+    start, stop = 0, len(reader)
+    if frames is not None:
+        start, stop, _ = slice(*frames).indices(len(reader))
+    if seconds is not None:
+        if reader.metadata is None:
+            raise ValueError(f"{reader.filename} has no metadata for a time range")
+        times = reader.metadata["host_timestamp"][: len(reader)]
+        times = times - times[0]
+        first, last = seconds
+        if first is not None:
+            start = max(start, int(np.searchsorted(times, first)))
+        if last is not None:
+            stop = min(stop, int(np.searchsorted(times, last)))
+    return start, max(start, stop)
+
+
+def recording_fps(reader, default=30.0):
+    """Frame rate of a recording from its metadata, or ``default``."""
+    if reader.metadata is None or len(reader.metadata) < 2:
+        return default
+    interval = np.median(np.diff(reader.metadata["host_timestamp"]))
+    return 1.0 / interval if interval > 0 else default
+
+
+def _prefetch(reader, start, stop, frames, stop_event):
+    try:
+        for i in range(start, stop):
+            if stop_event.is_set():
+                return
+            # The copy reads memory mapped frames here, not in the writer
+            frames.put(np.array(reader.frame(i)))
+    finally:
+        frames.put(None)
+
+
+def transcode(job):
+    """Runs one job and returns its result dict.
+
+    ``job`` holds the input ``filename``, the ``writer`` name ('ffmpeg' or
+    'raw_file'), the ``output_dir``, optional ``frames`` and ``seconds``
+    ranges (see ``frame_range``), ``fps`` to override the recorded rate,
+    ``codec`` and ``ffmpeg_binary``."""
+    started = time.perf_counter()
+    with RecordingReader(job["filename"]) as reader:
+        start, stop = frame_range(reader, job.get("frames"), job.get("seconds"))
+        pixel_format = reader.pixel_format
+        if pixel_format is None:
+            # npz archives do not store the pixel format
+            pixel_format = "Mono8" if reader.dtype == np.uint8 else "Mono16"
+        shape = reader.shape
+        if is_packed(pixel_format):
+            # The reader gives the stored shape, the video has the image shape
+            shape = unpacked_shape(shape, pixel_format)
+        name = os.path.splitext(os.path.basename(job["filename"]))[0]
+        if (start, stop) != (0, len(reader)):
+            name = f"{name}_{start}-{stop}"
+        options = {}
+        if job["writer"] == "ffmpeg":
+            options = {"codec": job.get("codec", "libx264")}
+            if options["codec"] == "libx264":
+                # Playable by common players and browsers
+                options["ffmpeg_params"] = ["-pix_fmt", "yuv420p"]
+        writer_cls, args, kwargs = make_writer_spec(
+            job["writer"],
+            name,
+            shape,
+            job.get("fps") or recording_fps(reader),
+            pixel_format,
+            job.get("ffmpeg_binary", FFMPEG_BINARY),
+            options,
+        )
+        writer = writer_cls(*args, **kwargs)
+        frames = queue.Queue(PREFETCH_FRAMES)
+        stop_event = threading.Event()
+        prefetch = threading.Thread(
+            target=_prefetch,
+            args=(reader, start, stop, frames, stop_event),
+            daemon=True,
+        )
+        prefetch.start()
+        written = 0
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                writer.write_frame(frame, job["output_dir"])
+                written += 1
+        finally:
+            stop_event.set()
+            # Unblocks the reader thread if the writer failed
+            while prefetch.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            writer.close()
+    seconds = time.perf_counter() - started
+    return {
+        "output": os.path.join(job["output_dir"], writer.filename),
+        "frames": written,
+        "seconds": seconds,
+        "fps": written / seconds if seconds > 0 else 0.0,
+        "MB": written * int(np.prod(reader.shape)) * reader.dtype.itemsize / 1e6,
+    }
+
+
+def job_key(job):
+    """Identifies a job and the version of its input file."""
+    stat = os.stat(job["filename"])
+    return json.dumps(
+        [
+            os.path.abspath(job["filename"]),
+            stat.st_size,
+            int(stat.st_mtime),
+            job["writer"],
+            job.get("frames"),
+            job.get("seconds"),
+            job.get("codec"),
+        ]
+    )
+
+
+def load_state(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as file:
+        return json.load(file)
+
+
+def save_state(filename, state):
+    # Written to a temporary file first, an interrupted save keeps the old
+    # state
+    with open(f"{filename}.tmp", "w") as file:
+        json.dump(state, file, indent=1)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def run_jobs(jobs, workers=None, state_file=None, log=print):
+    """Runs ``jobs`` on a pool of ``workers`` processes (one per core by
+    default) and returns the results of the jobs run now.
+
+    Jobs found in ``state_file`` are skipped and every finished job is added
+    to it. Failed jobs are reported with ``log`` and run again next time."""
+    state = load_state(state_file) if state_file else {}
+    pending = [job for job in jobs if job_key(job) not in state]
+    if len(pending) < len(jobs):
+        log(f"Skipping {len(jobs) - len(pending)} finished jobs")
+    results = []
+    if not pending:
+        return results
+    started = time.perf_counter()
+    frames = 0
+    megabytes = 0.0
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(transcode, job): job for job in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                log(f"[{done}/{len(pending)}] {job['filename']} failed: {exc}")
+                continue
+            results.append(result)
+            frames += result["frames"]
+            megabytes += result["MB"]
+            elapsed = time.perf_counter() - started
+            log(
+                f"[{done}/{len(pending)}] {job['filename']} -> {result['output']}: "
+                f"{result['frames']} frames at {result['fps']:.0f} fps; "
+                f"total {frames / elapsed:.0f} frames/s, {megabytes / elapsed:.0f} MB/s"
+            )
+            if state_file:
+                state[job_key(job)] = result
+                save_state(state_file, state)
+    return results
+
+
+def parse_range(text, cast):
+    """Parses 'START:STOP' where either side may be empty."""
+    start, _, stop = text.partition(":")
+    return (cast(start) if start else None, cast(stop) if stop else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcode recordings in batch")
+    parser.add_argument("inputs", nargs="+", help="recordings, glob patterns allowed")
+    parser.add_argument("--to", choices=["ffmpeg", "raw_file"], default="ffmpeg")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--frames", help="frame range START:STOP")
+    parser.add_argument("--range", help="time range START:STOP in seconds")
+    parser.add_argument("--fps", type=float, help="override the recorded rate")
+    parser.add_argument("--codec", default="libx264")
+    parser.add_argument("--workers", type=int, help="processes, one per core")
+    parser.add_argument("--ffmpeg", default=FFMPEG_BINARY)
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the finished jobs"
+    )
+    args = parser.parse_args(argv)
+
+    filenames = []
+    for pattern in args.inputs:
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [
+        {
+            "filename": filename,
+            "writer": args.to,
+            "output_dir": args.output_dir,
+            "frames": parse_range(args.frames, int) if args.frames else None,
+            "seconds": parse_range(args.range, float) if args.range else None,
+            "fps": args.fps,
+            "codec": args.codec,
+            "ffmpeg_binary": args.ffmpeg,
+        }
+        for filename in filenames
+    ]
+    state_file = os.path.join(args.output_dir, STATE_FILE)
+    if args.restart and os.path.exists(state_file):
+        os.remove(state_file)
+    run_jobs(jobs, args.workers, state_file)
+    state = load_state(state_file)
+    return 0 if all(job_key(job) in state for job in jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
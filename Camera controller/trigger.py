@@ -0,0 +1,377 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from pypylon import pylon
+
+from acquisition import AcquisitionEngine, open_cameras
+
+# The trigger thread sleeps until this close to a trigger, then spins
+SPIN_SECONDS = 0.0002
+
+
+def enable_software_trigger(camera):
+    """Switches a camera to software triggered frames and restarts grabbing
+    with ``GrabStrategy_OneByOne`` so that every trigger yields one frame."""
+    camera.StopGrabbing()
+    camera.TriggerSelector.SetValue("FrameStart")
+    camera.TriggerMode.SetValue("On")
+    camera.TriggerSource.SetValue("Software")
+    camera.StartGrabbing(pylon.GrabStrategy_OneByOne)
+
+
+def disable_software_trigger(camera):
+    camera.StopGrabbing()
+    camera.TriggerSelector.SetValue("FrameStart")
+    camera.TriggerMode.SetValue("Off")
+    camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+
+
+def raise_thread_priority():
+    """Best effort to run the calling thread at a high priority.
+
+    Returns True if the priority was raised."""
+    try:
+        if os.name == "nt":
+            import ctypes
+
+            THREAD_PRIORITY_TIME_CRITICAL = 15
+            kernel32 = ctypes.windll.kernel32
+            return bool(
+                kernel32.SetThreadPriority(
+                    kernel32.GetCurrentThread(), THREAD_PRIORITY_TIME_CRITICAL
+                )
+            )
+        if sys.platform.startswith("linux"):
+            # On Linux pid 0 is the calling thread, this needs CAP_SYS_NICE
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+            return True
+    except (AttributeError, OSError):
+        pass
+    return False
+
+
+class Frameset:
+    """The frames of all cameras for one trigger.
+
+    ``frames`` maps the camera index to its ``Frame``. ``missing`` lists the
+    cameras that delivered no frame and ``late`` the cameras whose frame
+    arrived more than ``late_s`` after the trigger. Call ``release()`` once
+    done with the frames.
+    """
+
+    def __init__(self, trigger_id, fire_time, n_cams):
+        self.trigger_id = trigger_id
+        self.fire_time = fire_time
+        self.n_cams = n_cams
+        self.frames = {}
+        self.missing = []
+        self.late = []
+        # Camera index to the number of the trigger among those it accepted
+        self.accepted = {}
+
+    def complete(self):
+        return len(self.frames) + len(self.missing) == self.n_cams
+
+    def skew(self):
+        """Spread of the frame arrival times over the cameras, in seconds."""
+        if len(self.frames) < 2:
+            return 0.0
+        times = [frame.host_timestamp for frame in self.frames.values()]
+        return max(times) - min(times)
+
+    def release(self):
+        for frame in self.frames.values():
+            frame.release()
+
+
+class TriggerScheduler:
+    """Fires ``ExecuteSoftwareTrigger`` on every camera at a fixed rate and
+    assembles the resulting frames into ``Frameset`` objects.
+
+    The trigger thread runs at a raised priority and sleeps until
+    ``SPIN_SECONDS`` before each trigger, then spins to fire on time. A
+    camera that is not ready for a trigger is not fired and is reported
+    missing in that frameset.
+
+    Frames are matched to triggers by a per-camera frame counter, not by
+    arrival order: the image number relative to the first frame plus the
+    frames the camera lost so far. The frame numbered k belongs to the k-th
+    trigger the camera accepted. Frames lost, dropped from the queue or
+    arriving after their frameset expired therefore leave the pairing of
+    the later frames intact, and a late frame is discarded. When grabbing
+    is restarted (``GrabThread.generation``, e.g. by ``set_lossless``) the
+    image numbers start over, so the numbering does too, from the first
+    trigger accepted in the new generation; the frames of the triggers
+    accepted before the restart are missing.
+
+    Parameters
+    -----------
+
+    engine
+      An ``AcquisitionEngine`` whose cameras are in software trigger mode
+      (see ``enable_software_trigger``).
+
+    rate
+      Triggers per second.
+
+    late_ms
+      Frames arriving later than this after their trigger are reported late.
+
+    timeout_ms
+      Framesets still incomplete after this time are emitted with the
+      cameras that did not deliver reported missing.
+
+    Framesets are put on the ``framesets`` queue in trigger order.
+    """
+
+    def __init__(self, engine, rate=20, late_ms=50, timeout_ms=1000, maxsize=64):
+        self.engine = engine
+        self.cameras = engine.cameras
+        self.period = 1.0 / rate
+        self.late_s = late_ms / 1000
+        self.timeout_s = timeout_ms / 1000
+        self.framesets = queue.Queue(maxsize)
+        self.frame_queue = engine.subscribe_all(maxsize=8 * len(self.cameras))
+        self.fired = 0
+        self.emitted = 0
+        self.incomplete = 0
+        self.late = 0
+        self.overflow = 0
+        self.fire_skews = deque(maxlen=1000)
+        self.arrival_skews = deque(maxlen=1000)
+        self.high_priority = False
+        self._pending = {}
+        # Per camera: accepted trigger number to trigger id, the number of
+        # triggers accepted, the first trigger accepted in each grab
+        # generation, and the generation, the image number of its first
+        # frame and the frames lost since, giving the frame numbers
+        self._accepted = [{} for _ in self.cameras]
+        self._n_accepted = [0] * len(self.cameras)
+        self._first_accepted = [{} for _ in self.cameras]
+        self._generation = [None] * len(self.cameras)
+        self._first_image = [None] * len(self.cameras)
+        self._lost = [0] * len(self.cameras)
+        self._next_frame = [0] * len(self.cameras)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._start_time = None
+        self._stop_time = None
+        self._trigger_thread = threading.Thread(
+            target=self._fire_loop, name="trigger", daemon=True
+        )
+        self._assembler_thread = threading.Thread(
+            target=self._assemble_loop, name="frameset", daemon=True
+        )
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._assembler_thread.start()
+        self._trigger_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._trigger_thread.join()
+        self._stop_time = time.perf_counter()
+        self._assembler_thread.join()
+        self.engine.unsubscribe_all(self.frame_queue)
+
+    def _fire_loop(self):
+        self.high_priority = raise_thread_priority()
+        next_fire = time.perf_counter()
+        trigger_id = 0
+        while not self._stop_event.is_set():
+            # Sleeps can overshoot, so the deadline is approached in
+            # shrinking steps and only the last SPIN_SECONDS hold the GIL
+            while True:
+                remaining = next_fire - time.perf_counter()
+                if remaining <= SPIN_SECONDS:
+                    break
+                time.sleep(remaining - 0.001 if remaining > 0.002 else remaining / 2)
+            while time.perf_counter() < next_fire:
+                pass
+
+            fire_time = time.perf_counter()
+            frameset = Frameset(trigger_id, fire_time, len(self.cameras))
+            with self._lock:
+                self._pending[trigger_id] = frameset
+            for idx, camera in enumerate(self.cameras):
+                thread = self.engine.threads[idx]
+                generation = thread.generation
+                # A camera restarted while checking is not fired, its frame
+                # could belong to either generation
+                if (
+                    camera.WaitForFrameTriggerReady(0, pylon.TimeoutHandling_Return)
+                    and thread.generation == generation
+                ):
+                    # Registered first, the frame can arrive before the
+                    # trigger call returns
+                    with self._lock:
+                        number = self._n_accepted[idx]
+                        self._n_accepted[idx] += 1
+                        self._accepted[idx][number] = trigger_id
+                        self._first_accepted[idx].setdefault(generation, number)
+                        frameset.accepted[idx] = number
+                    camera.ExecuteSoftwareTrigger()
+                else:
+                    with self._lock:
+                        frameset.missing.append(idx)
+            self.fire_skews.append(time.perf_counter() - fire_time)
+            self.fired += 1
+            trigger_id += 1
+            next_fire += self.period
+            # Do not try to catch up on triggers missed by a stall
+            next_fire = max(next_fire, time.perf_counter())
+
+    def _assemble_loop(self):
+        while not self._stop_event.is_set() or self._pending:
+            try:
+                frame = self.frame_queue.get(timeout=self.period)
+            except queue.Empty:
+                frame = None
+            with self._lock:
+                if frame is not None:
+                    self._add_frame(frame)
+                self._emit_ready()
+            if self._stop_event.is_set() and frame is None:
+                # No more frames will arrive for the pending triggers
+                with self._lock:
+                    for trigger_id in sorted(self._pending):
+                        self._expire(self._pending[trigger_id])
+                    self._emit_ready(flush=True)
+
+    def _frame_number(self, frame):
+        """Returns the accepted trigger number of a frame, None for a frame
+        of a grab generation that no trigger was accepted in."""
+        idx = frame.camera_idx
+        first_accepted = self._first_accepted[idx]
+        if frame.generation != self._generation[idx]:
+            if frame.generation not in first_accepted:
+                return None
+            # Image numbers start over with the new generation
+            self._generation[idx] = frame.generation
+            self._first_image[idx] = frame.image_number
+            self._lost[idx] = 0
+            for generation in list(first_accepted):
+                if generation < frame.generation:
+                    del first_accepted[generation]
+        # Frames lost by the camera used up their triggers
+        self._lost[idx] += frame.lost
+        return (
+            first_accepted[frame.generation]
+            + frame.image_number
+            - self._first_image[idx]
+            + self._lost[idx]
+        )
+
+    def _add_frame(self, frame):
+        idx = frame.camera_idx
+        accepted = self._accepted[idx]
+        number = self._frame_number(frame)
+        if number is None:
+            frame.release()
+            return
+        # Triggers skipped over lost their frame, it was lost by the camera
+        # or dropped from the queue
+        for skipped in range(self._next_frame[idx], number):
+            lost_id = accepted.pop(skipped, None)
+            if lost_id in self._pending:
+                self._pending[lost_id].missing.append(idx)
+        self._next_frame[idx] = max(self._next_frame[idx], number + 1)
+        trigger_id = accepted.pop(number, None)
+        frameset = self._pending.get(trigger_id)
+        if frameset is None:
+            # The frameset expired and was emitted without this camera
+            frame.release()
+            return
+        frameset.frames[idx] = frame
+        if frame.host_timestamp - frameset.fire_time > self.late_s:
+            frameset.late.append(idx)
+            self.late += 1
+
+    def _expire(self, frameset):
+        for idx in range(frameset.n_cams):
+            if idx not in frameset.frames and idx not in frameset.missing:
+                frameset.missing.append(idx)
+                # A frame arriving later finds no trigger and is discarded
+                self._accepted[idx].pop(frameset.accepted.get(idx), None)
+
+    def _emit_ready(self, flush=False):
+        now = time.perf_counter()
+        for trigger_id in sorted(self._pending):
+            frameset = self._pending[trigger_id]
+            if not frameset.complete():
+                if not flush and now - frameset.fire_time < self.timeout_s:
+                    break
+                self._expire(frameset)
+            del self._pending[trigger_id]
+            if frameset.missing:
+                self.incomplete += 1
+            if len(frameset.frames) > 1:
+                self.arrival_skews.append(frameset.skew())
+            self.emitted += 1
+            try:
+                self.framesets.put_nowait(frameset)
+            except queue.Full:
+                self.overflow += 1
+                frameset.release()
+
+    def stats(self):
+        """Returns the achieved trigger rate and the inter-camera skews."""
+        if self._start_time is None:
+            elapsed = 0
+        else:
+            elapsed = (self._stop_time or time.perf_counter()) - self._start_time
+        fire_skews = sorted(self.fire_skews) or [0.0]
+        arrival_skews = sorted(self.arrival_skews) or [0.0]
+        return {
+            "fired": self.fired,
+            "trigger_rate": self.fired / elapsed if elapsed else 0.0,
+            "framesets": self.emitted,
+            "incomplete": self.incomplete,
+            "late": self.late,
+            "overflow": self.overflow,
+            "high_priority": self.high_priority,
+            "fire_skew_ms_max": 1000 * fire_skews[-1],
+            "arrival_skew_ms_median": 1000 * arrival_skews[len(arrival_skews) // 2],
+            "arrival_skew_ms_max": 1000 * arrival_skews[-1],
+        }
+
+
+if __name__ == "__main__":
+    # Triggers emulated cameras and reports the achieved rate and skew
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cams", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--exposure", type=float, default=1000)
+    args = parser.parse_args()
+
+    os.environ["PYLON_CAMEMU"] = str(args.cams)
+    cameras = open_cameras(expTime=args.exposure)
+    for camera in cameras:
+        enable_software_trigger(camera)
+    engine = AcquisitionEngine(cameras)
+    scheduler = TriggerScheduler(engine, rate=args.rate)
+    engine.start()
+    scheduler.start()
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        try:
+            scheduler.framesets.get(timeout=0.1).release()
+        except queue.Empty:
+            pass
+    scheduler.stop()
+    engine.stop()
+    while not scheduler.framesets.empty():
+        scheduler.framesets.get().release()
+    for camera in cameras:
+        camera.StopGrabbing()
+        camera.Close()
+    for key, value in scheduler.stats().items():
+        print(f"{key}: {value}")
@@ -1,49 +1,451 @@
+import json
 import os
 import subprocess as sp
+import threading
+import time
 import zipfile
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
+from compression import check_codec, encode_chunk
+from instrumentation import METRICS
+from journal import Journal, fsync_dir, fsync_file
+from packed import is_packed, pixel_bits, unpack
+
+RAW_MAGIC = b"BCRAW001"
+RAW_HEADER_SIZE = 4096
+CHUNKED_MAGIC = b"BCCHK001"
+FFMPEG_BINARY = r"C:\Users\ARUNA\IR Labs\ffmpeg-6.0-essentials_build\ffmpeg-6.0-essentials_build\bin/ffmpeg"
+CHUNK_INDEX_DTYPE = np.dtype(
+    [("offset", "<i8"), ("size", "<i8"), ("frames", "<i8"), ("first_frame", "<i8")]
+)
+
+
+def write_all(file, data):
+    """Writes all of ``data``, unbuffered files may take a part of it."""
+    view = memoryview(data).cast("B")
+    while view:
+        view = view[file.write(view) :]
+
+
+def write_file_header(file, magic, header):
+    """Writes ``magic`` and the JSON ``header`` padded to RAW_HEADER_SIZE at
+    the start of ``file``."""
+    header = magic + json.dumps(header).encode()
+    if len(header) >= RAW_HEADER_SIZE:
+        raise ValueError("Recording header is too large")
+    file.seek(0)
+    write_all(file, header.ljust(RAW_HEADER_SIZE - 1) + b"\n")
+
+
+def read_file_header(filename, magic):
+    with open(filename, "rb") as file:
+        header = file.read(RAW_HEADER_SIZE)
+    if not header.startswith(magic):
+        raise ValueError(f"{filename} is not a recording of the expected type")
+    return json.loads(header[len(magic) :].decode())
+
 
 class Raw_Writer:
     """A class to write the raw frames from a Basler camera to a Numpy npz archive
 
     Temporarily saved the frames as separate files (in folder cam1_out) and creates the npz upon file closing
 
+    The frames that reached the disk are recorded in a ``<filename>.journal``
+    (see ``journal.py``) so that ``recover.py`` can build the npz after a
+    crash.
+
     Parameters
     -----------
 
     filename
       Any filename, should end with '.npz'
+
+    sync_frames, sync_seconds
+      The frame files are flushed to disk and journaled every
+      ``sync_frames`` frames or ``sync_seconds`` seconds. Both None (the
+      default) disables the journal: every commit costs one fsync per frame
+      file, so use ``RawFile_Writer`` when a recording has to survive a
+      crash.
     """
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, sync_frames=None, sync_seconds=None) -> None:
         self.filename = filename
         self.tmpdir = filename[:-4]
-        if not Path(self.tmpdir).is_dir():
-            Path(self.tmpdir).mkdir()
         self.files = 0
+        self.path = "."
+        self.sync_frames = sync_frames
+        self.sync_seconds = sync_seconds
+        self.journal = None
+        self.unsynced = []
+
+    def _sync(self):
+        # One fsync per frame file, then one for their new directory entries
+        for tmpfilename in self.unsynced:
+            fsync_file(tmpfilename)
+        self.unsynced = []
+        fsync_dir(f"{self.path}/{self.tmpdir}")
 
     def write_frame(self, img_array, path="."):
         if not os.path.exists(f"{path}/{self.tmpdir}"):
             # if the demo_folder directory is not present
             # then create it.
             os.makedirs(f"{path}/{self.tmpdir}")
+        if self.journal is None and (
+            self.sync_frames is not None or self.sync_seconds is not None
+        ):
+            self.journal = Journal(
+                f"{path}/{self.filename}.journal",
+                self._sync,
+                self.sync_frames,
+                self.sync_seconds,
+            )
         tmpfilename = f"{path}/{self.tmpdir}/frame_{self.files}.npy"
         np.save(tmpfilename, img_array)
         self.files += 1
+        self.path = path
+        if self.journal is not None:
+            self.unsynced.append(tmpfilename)
+            self.journal.written()
 
     def close(self):
         self.file = zipfile.ZipFile(
-            self.filename, mode="w", compression=zipfile.ZIP_DEFLATED
+            f"{self.path}/{self.filename}", mode="w", compression=zipfile.ZIP_DEFLATED
         )
         for fnum in range(self.files):
-            tmpfilename = f"{self.tmpdir}/frame_{fnum}.npy"
-            self.file.write(tmpfilename)
+            arcname = f"{self.tmpdir}/frame_{fnum}.npy"
+            tmpfilename = f"{self.path}/{arcname}"
+            self.file.write(tmpfilename, arcname)
             os.remove(tmpfilename)
         self.file.close()
         self.file = None
+        if os.path.isdir(f"{self.path}/{self.tmpdir}"):
+            os.rmdir(f"{self.path}/{self.tmpdir}")
+        if self.journal is not None:
+            # The archive is durable before the journal goes
+            fsync_file(f"{self.path}/{self.filename}")
+            fsync_dir(self.path)
+            self.journal.close()
+
+
+class RawFile_Writer:
+    """A class to append raw frames from a Basler camera to a single file
+
+    The file starts with a fixed size header (magic, then a JSON description
+    of the frame shape, dtype, pixel format and frame count) followed by the
+    frames back to back. The file is grown in steps of ``grow_frames`` frames
+    so that appending does not extend it on every write, and closing only
+    truncates it and rewrites the header. Use ``load_raw`` to open the result
+    as a ``np.memmap``.
+
+    The header holds the frame count only after ``close()``. While recording
+    the number of frames that reached the disk is appended to a
+    ``<filename>.journal`` (see ``journal.py``), from which ``recover.py``
+    restores the header after a crash without reading the frames.
+
+    Parameters
+    -----------
+
+    filename
+      Any filename, '.raw' is recommended.
+
+    pixel_format
+      Pixel format of the camera, stored in the header. Packed formats are
+      stored as delivered, see ``packed.py``.
+
+    grow_frames
+      Number of frames the file is extended by when it is full.
+
+    sync_frames, sync_seconds
+      The file is flushed to disk and journaled every ``sync_frames`` frames
+      or ``sync_seconds`` seconds. Both None disables the journal.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        pixel_format="Mono8",
+        grow_frames=256,
+        sync_frames=None,
+        sync_seconds=1.0,
+    ) -> None:
+        self.filename = filename
+        self.pixel_format = pixel_format
+        self.grow_frames = grow_frames
+        self.sync_frames = sync_frames
+        self.sync_seconds = sync_seconds
+        self.journal = None
+        self.file = None
+        self.shape = None
+        self.dtype = None
+        self.frame_bytes = 0
+        self.capacity = 0
+        self.files = 0
+
+    def _open(self, img_array, path):
+        self.shape = img_array.shape
+        self.dtype = img_array.dtype
+        self.frame_bytes = img_array.nbytes
+        self.file = open(f"{path}/{self.filename}", "w+b", buffering=0)
+        self._write_header()
+        self.file.seek(RAW_HEADER_SIZE)
+        if self.sync_frames is not None or self.sync_seconds is not None:
+            self.journal = Journal(
+                f"{path}/{self.filename}.journal",
+                lambda: os.fsync(self.file.fileno()),
+                self.sync_frames,
+                self.sync_seconds,
+            )
+
+    def _write_header(self):
+        header = {
+            "shape": list(self.shape),
+            "dtype": self.dtype.str,
+            "pixel_format": self.pixel_format,
+            "frame_count": self.files,
+            "frame_bytes": self.frame_bytes,
+        }
+        write_file_header(self.file, RAW_MAGIC, header)
+
+    def write_frame(self, img_array, path="."):
+        if self.file is None:
+            self._open(img_array, path)
+        if self.files == self.capacity:
+            self.capacity += self.grow_frames
+            self.file.truncate(RAW_HEADER_SIZE + self.capacity * self.frame_bytes)
+        write_all(self.file, np.ascontiguousarray(img_array))
+        self.files += 1
+        if self.journal is not None:
+            self.journal.written()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.truncate(RAW_HEADER_SIZE + self.files * self.frame_bytes)
+        self._write_header()
+        if self.journal is not None:
+            # The header is durable before the journal goes
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        if self.journal is not None:
+            self.journal.close()
+
+
+def read_raw_header(filename):
+    """Returns the header dict of a file written by ``RawFile_Writer``."""
+    return read_file_header(filename, RAW_MAGIC)
+
+
+def load_raw(filename, mode="r"):
+    """Opens a file written by ``RawFile_Writer`` as a ``np.memmap`` of shape
+    (frames, height, width)."""
+    header = read_raw_header(filename)
+    if header["frame_count"] == 0:
+        return np.empty((0, *header["shape"]), dtype=np.dtype(header["dtype"]))
+    return np.memmap(
+        filename,
+        dtype=np.dtype(header["dtype"]),
+        mode=mode,
+        offset=RAW_HEADER_SIZE,
+        shape=(header["frame_count"], *header["shape"]),
+    )
+
+
+class ChunkedCompressed_Writer:
+    """A class to write compressed raw frames while recording
+
+    Frames are collected into chunks of ``chunk_frames`` frames. Every full
+    chunk is filtered and compressed on a thread pool and appended to the
+    file in order, so the recording is complete as soon as the last chunk
+    is written. The file has the same fixed size header as ``RawFile_Writer``
+    followed by the compressed chunks and a chunk index written on close.
+
+    Parameters
+    -----------
+
+    filename
+      Any filename, '.bcz' is recommended.
+
+    codec
+      'zlib', 'lz4', 'zstd' or 'none'. lz4 and zstd need the 'lz4' and
+      'zstandard' packages.
+
+    level
+      Compression level passed to the codec. Low levels are fast enough for
+      real time recording.
+
+    filters
+      Tuple of 'delta' (frame differences within a chunk, good for near
+      static scenes) and/or 'shuffle' (byte shuffle for 16 bit formats).
+
+    chunk_frames
+      Number of frames per chunk.
+
+    threads
+      Number of compression threads, defaults to the number of cores.
+
+    max_pending
+      Number of chunks that may wait for compression before ``write_frame``
+      blocks.
+
+    pixel_format
+      Pixel format of the camera, stored in the header. Packed formats are
+      stored as delivered, see ``packed.py``.
+    """
+
+    def __init__(
+        self,
+        filename,
+        codec="zlib",
+        level=1,
+        filters=(),
+        chunk_frames=16,
+        threads=None,
+        max_pending=None,
+        pixel_format="Mono8",
+    ):
+        check_codec(codec)
+        self.filename = filename
+        self.codec = codec
+        self.level = level
+        self.filters = tuple(filters)
+        self.chunk_frames = chunk_frames
+        self.pixel_format = pixel_format
+        self.threads = threads or os.cpu_count()
+        self.max_pending = max_pending or 2 * self.threads
+        self.executor = None
+        self.file = None
+        self.chunk = None
+        self.chunk_fill = 0
+        self.pending = deque()
+        self.index = []
+        self.chunk_stats = []
+        self.files = 0
+
+    def _open(self, img_array, path):
+        self.shape = img_array.shape
+        self.dtype = img_array.dtype
+        self.file = open(f"{path}/{self.filename}", "w+b")
+        self._write_header()
+        self.file.seek(RAW_HEADER_SIZE)
+        self.executor = ThreadPoolExecutor(self.threads)
+
+    def _write_header(self, index_offset=0):
+        header = {
+            "shape": list(self.shape),
+            "dtype": self.dtype.str,
+            "pixel_format": self.pixel_format,
+            "frame_count": self.files,
+            "codec": self.codec,
+            "level": self.level,
+            "filters": list(self.filters),
+            "chunk_frames": self.chunk_frames,
+            "chunk_count": len(self.index),
+            "index_offset": index_offset,
+        }
+        write_file_header(self.file, CHUNKED_MAGIC, header)
+
+    def _encode(self, chunk, level):
+        start = time.perf_counter()
+        data = encode_chunk(chunk, self.codec, level, self.filters)
+        return data, time.perf_counter() - start
+
+    def _submit_chunk(self):
+        chunk = self.chunk[: self.chunk_fill]
+        first_frame = self.files - self.chunk_fill
+        # The level is taken now, it can be changed while the chunk waits
+        self.pending.append(
+            (
+                self.executor.submit(self._encode, chunk, self.level),
+                first_frame,
+                chunk.nbytes,
+            )
+        )
+        # The pool works on this chunk, the next frames go to a new buffer
+        self.chunk = None
+        self.chunk_fill = 0
+
+    def _write_done_chunks(self, block=False):
+        # Chunks are written in submission order
+        while self.pending and (
+            block or len(self.pending) > self.max_pending or self.pending[0][0].done()
+        ):
+            future, first_frame, raw_bytes = self.pending.popleft()
+            data, encode_time = future.result()
+            offset = self.file.tell()
+            self.file.write(data)
+            frames = raw_bytes // (self.dtype.itemsize * int(np.prod(self.shape)))
+            self.index.append((offset, len(data), frames, first_frame))
+            self.chunk_stats.append(
+                {
+                    "first_frame": first_frame,
+                    "frames": frames,
+                    "raw_bytes": raw_bytes,
+                    "compressed_bytes": len(data),
+                    "ratio": raw_bytes / max(len(data), 1),
+                    "encode_s": encode_time,
+                    "MBps": raw_bytes / max(encode_time, 1e-9) / 1e6,
+                }
+            )
+
+    def write_frame(self, img_array, path="."):
+        if self.file is None:
+            self._open(img_array, path)
+        if self.chunk is None:
+            self.chunk = np.empty((self.chunk_frames, *self.shape), dtype=self.dtype)
+        self.chunk[self.chunk_fill] = img_array
+        self.chunk_fill += 1
+        self.files += 1
+        if self.chunk_fill == self.chunk_frames:
+            self._submit_chunk()
+        self._write_done_chunks()
+
+    def stats(self):
+        """Returns the totals over all chunks written so far."""
+        raw = sum(c["raw_bytes"] for c in self.chunk_stats)
+        compressed = sum(c["compressed_bytes"] for c in self.chunk_stats)
+        encode_time = sum(c["encode_s"] for c in self.chunk_stats)
+        return {
+            "chunks": len(self.chunk_stats),
+            "raw_bytes": raw,
+            "compressed_bytes": compressed,
+            "ratio": raw / max(compressed, 1),
+            "MBps_per_thread": raw / max(encode_time, 1e-9) / 1e6,
+            "pending": len(self.pending),
+        }
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.chunk_fill:
+            self._submit_chunk()
+        self._write_done_chunks(block=True)
+        self.executor.shutdown()
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=CHUNK_INDEX_DTYPE).tobytes())
+        self._write_header(index_offset)
+        self.file.close()
+        self.file = None
+
+
+def read_chunked_header(filename):
+    """Returns the header dict of a file written by
+    ``ChunkedCompressed_Writer``."""
+    return read_file_header(filename, CHUNKED_MAGIC)
+
+
+def read_chunk_index(filename, header=None):
+    """Returns the chunk index (offset, size, frames, first_frame) of a file
+    written by ``ChunkedCompressed_Writer``."""
+    if header is None:
+        header = read_chunked_header(filename)
+    with open(filename, "rb") as file:
+        file.seek(header["index_offset"])
+        data = file.read(header["chunk_count"] * CHUNK_INDEX_DTYPE.itemsize)
+    return np.frombuffer(data, dtype=CHUNK_INDEX_DTYPE)
 
 
 class FFMPEG_VideoWriter:
@@ -98,6 +500,27 @@ class FFMPEG_VideoWriter:
       Boolean. Set to ``True`` if there is a mask in the video to be
       encoded.
 
+    ffmpeg_binary
+      Path of the ffmpeg executable.
+
+    async_mode
+      Set to ``True`` to hand frames to a writer thread through a bounded
+      queue instead of writing to the ffmpeg pipe in ``write_frame``.
+
+    queue_size
+      Number of frames the async queue holds, besides the frame being
+      written.
+
+    policy
+      What ``write_frame`` does when the async queue is full: 'block' waits,
+      'drop-oldest' discards the oldest queued frame and 'drop-newest'
+      discards the new frame. Dropped frames are counted in ``dropped``.
+
+    pixel_format
+      Camera pixel format of the frames. Packed formats (see ``packed.py``)
+      are unpacked before they are piped to ffmpeg, use ``ffmpeg_pixfmt``
+      for the matching ``pixfmt``.
+
     """
 
     def __init__(
@@ -113,17 +536,48 @@ class FFMPEG_VideoWriter:
         logfile=None,
         threads=None,
         ffmpeg_params=None,
+        ffmpeg_binary=FFMPEG_BINARY,
+        async_mode=False,
+        queue_size=8,
+        policy="block",
+        pixel_format=None,
     ):
         if logfile is None:
             logfile = sp.PIPE
+        if policy not in ("block", "drop-oldest", "drop-newest"):
+            raise ValueError(
+                "policy must be one of 'block', 'drop-oldest' or 'drop-newest'"
+            )
         self.count = 0
-        # self.proc = None
+        self.proc = None
+        self.async_mode = async_mode
+        self.queue_size = queue_size
+        self.policy = policy
+        self.frame_queue = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.closing = False
+        self.error = None
+        self.dropped = 0
+        self.max_depth = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
         self.filename = filename
+        self.packed_format = pixel_format if is_packed(pixel_format) else None
+        # A pipe write longer than one frame interval means ffmpeg has
+        # fallen behind and the pipe is full
+        self.stall_seconds = 1.0 / fps
+        self.pipe_time = METRICS.histogram("ffmpeg_pipe_write_seconds", file=filename)
+        self.stalls = METRICS.counter("ffmpeg_pipe_stalls", file=filename)
+        METRICS.gauge(
+            "ffmpeg_queue_depth", lambda: len(self.frame_queue), file=filename
+        )
+        METRICS.gauge("ffmpeg_dropped", lambda: self.dropped, file=filename)
         self.codec = codec
         self.ext = self.filename.split(".")[-1]
         # order is important
         self.cmd = [
-            r"C:\Users\ARUNA\IR Labs\ffmpeg-6.0-essentials_build\ffmpeg-6.0-essentials_build\bin/ffmpeg",
+            ffmpeg_binary,
             "-y",
             "-loglevel",
             "error" if logfile == sp.PIPE else "info",
@@ -155,8 +609,6 @@ class FFMPEG_VideoWriter:
         if threads is not None:
             self.cmd.extend(["-threads", str(threads)])
 
-        self.cmd.extend([self.filename])
-
         self.popen_params = {"stdout": sp.DEVNULL, "stderr": logfile, "stdin": sp.PIPE}
 
         # This was added so that no extra unwanted window opens on windows
@@ -164,83 +616,205 @@ class FFMPEG_VideoWriter:
         if os.name == "nt":
             self.popen_params["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
 
-    def write_frame(self, img_array, file_loc):
-        """Writes one frame in the file."""
+    def _start(self, file_loc):
+        if file_loc is None:
+            raise ValueError(
+                "File path is not set. Please specify the output video location."
+            )
 
-        try:
-            if file_loc is None:
-                raise ValueError(
-                    "File path is not set. Please specify the output video location."
-                )
+        # Create a new subprocess with the output file as the last argument
+        self.proc = sp.Popen(
+            self.cmd + [file_loc + "/" + self.filename], **self.popen_params
+        )
 
-            # Create a new subprocess and add file location as the last element
-            if self.count == 0:
-                self.cmd.extend([file_loc + "/" + self.filename])
+        if self.async_mode:
+            self.thread = threading.Thread(target=self._drain, daemon=True)
+            self.thread.start()
+
+    def _write_array(self, img_array):
+        if self.packed_format is not None:
+            img_array = unpack(img_array, self.packed_format)
+        # The pipe takes the frame buffer directly, without a tobytes() copy
+        start = time.perf_counter()
+        self.proc.stdin.write(memoryview(np.ascontiguousarray(img_array)).cast("B"))
+        elapsed = time.perf_counter() - start
+        self.pipe_time.observe(elapsed)
+        if elapsed > self.stall_seconds:
+            self.stalls.inc()
+
+    def write_frame(self, img_array, file_loc, release=None):
+        """Writes one frame in the file.
 
-                self.proc = sp.Popen(self.cmd, **self.popen_params)
+        ``release`` is called once the frame has been written (or dropped).
+        In async mode ``img_array`` must stay valid until then."""
+
+        if self.async_mode:
+            self._enqueue(img_array, file_loc, release)
+            return
+
+        try:
+            if self.count == 0:
+                self._start(file_loc)
 
             # Check if the subprocess is still running before writing the frame
             if self.proc.poll() is None:
-                self.proc.stdin.write(img_array.tobytes())
+                self._write_array(img_array)
                 self.count += 1
             else:
                 print("Process has terminated.")
 
         except IOError as err:
-            _, ffmpeg_error = self.proc.communicate()
-            error = str(err) + (
-                "\n\nMoviePy error: FFMPEG encountered "
-                "the following error while writing file %s:"
-                "\n\n %s" % (self.filename, str(ffmpeg_error))
+            raise IOError(self._ffmpeg_error(err))
+
+        finally:
+            if release is not None:
+                release()
+
+    def _enqueue(self, img_array, file_loc, release):
+        if self.error is not None:
+            if release is not None:
+                release()
+            raise self.error
+
+        if self.proc is None:
+            try:
+                self._start(file_loc)
+            except Exception:
+                if release is not None:
+                    release()
+                raise
+
+        item = (img_array, release, time.perf_counter())
+        with self.cond:
+            if len(self.frame_queue) >= self.queue_size:
+                if self.policy == "block":
+                    self.cond.wait_for(
+                        lambda: len(self.frame_queue) < self.queue_size
+                        or self.error is not None
+                    )
+                elif self.policy == "drop-oldest":
+                    _, dropped_release, _ = self.frame_queue.popleft()
+                    self.dropped += 1
+                    if dropped_release is not None:
+                        dropped_release()
+                else:
+                    self.dropped += 1
+                    if release is not None:
+                        release()
+                    return
+            self.frame_queue.append(item)
+            self.max_depth = max(self.max_depth, len(self.frame_queue))
+            self.cond.notify_all()
+
+    def _drain(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.frame_queue or self.closing)
+                if not self.frame_queue:
+                    return
+                # Taken off the queue before writing, so that a drop-oldest
+                # write_frame cannot drop (and release) the frame being written
+                img_array, release, queued_at = self.frame_queue.popleft()
+                self.cond.notify_all()
+            try:
+                if self.error is None:
+                    self._write_array(img_array)
+                    self.count += 1
+                    lag = time.perf_counter() - queued_at
+                    self.lag_total += lag
+                    self.lag_max = max(self.lag_max, lag)
+            except IOError as err:
+                self.error = IOError(self._ffmpeg_error(err))
+            finally:
+                if release is not None:
+                    release()
+
+    def stats(self):
+        """Returns the queue depth and encode lag metrics of the async mode.
+
+        The encode lag is the time from ``write_frame`` until the frame was
+        handed to ffmpeg."""
+        return {
+            "frames": self.count,
+            "queue_depth": len(self.frame_queue),
+            "max_queue_depth": self.max_depth,
+            "dropped": self.dropped,
+            "lag_mean_ms": 1000 * self.lag_total / max(self.count, 1),
+            "lag_max_ms": 1000 * self.lag_max,
+        }
+
+    def _ffmpeg_error(self, err):
+        _, ffmpeg_error = self.proc.communicate()
+        ffmpeg_error = ffmpeg_error or b""
+        error = str(err) + (
+            "\n\nMoviePy error: FFMPEG encountered "
+            "the following error while writing file %s:"
+            "\n\n %s" % (self.filename, str(ffmpeg_error))
+        )
+
+        if b"Unknown encoder" in ffmpeg_error:
+            error = error + (
+                "\n\nThe video export "
+                "failed because FFMPEG didn't find the specified "
+                "codec for video encoding (%s). Please install "
+                "this codec or change the codec when calling "
+                "write_videofile. For instance:\n"
+                "  >>> clip.write_videofile('myvid.webm', codec='libvpx')"
+            ) % (self.codec)
+
+        elif b"incorrect codec parameters ?" in ffmpeg_error:
+            error = error + (
+                "\n\nThe video export "
+                "failed, possibly because the codec specified for "
+                "the video (%s) is not compatible with the given "
+                "extension (%s). Please specify a valid 'codec' "
+                "argument in write_videofile. This would be 'libx264' "
+                "or 'mpeg4' for mp4, 'libtheora' for ogv, 'libvpx for webm. "
+                "Another possible reason is that the audio codec was not "
+                "compatible with the video codec. For instance the video "
+                "extensions 'ogv' and 'webm' only allow 'libvorbis' (default) as a"
+                "video codec."
+            ) % (self.codec, self.ext)
+
+        elif b"encoder setup failed" in ffmpeg_error:
+            error = error + (
+                "\n\nThe video export "
+                "failed, possibly because the bitrate you specified "
+                "was too high or too low for the video codec."
+            )
+
+        elif b"Invalid encoder type" in ffmpeg_error:
+            error = error + (
+                "\n\nThe video export failed because the codec "
+                "or file extension you provided is not a video"
             )
 
-            if b"Unknown encoder" in ffmpeg_error:
-                error = error + (
-                    "\n\nThe video export "
-                    "failed because FFMPEG didn't find the specified "
-                    "codec for video encoding (%s). Please install "
-                    "this codec or change the codec when calling "
-                    "write_videofile. For instance:\n"
-                    "  >>> clip.write_videofile('myvid.webm', codec='libvpx')"
-                ) % (self.codec)
-
-            elif b"incorrect codec parameters ?" in ffmpeg_error:
-                error = error + (
-                    "\n\nThe video export "
-                    "failed, possibly because the codec specified for "
-                    "the video (%s) is not compatible with the given "
-                    "extension (%s). Please specify a valid 'codec' "
-                    "argument in write_videofile. This would be 'libx264' "
-                    "or 'mpeg4' for mp4, 'libtheora' for ogv, 'libvpx for webm. "
-                    "Another possible reason is that the audio codec was not "
-                    "compatible with the video codec. For instance the video "
-                    "extensions 'ogv' and 'webm' only allow 'libvorbis' (default) as a"
-                    "video codec."
-                ) % (self.codec, self.ext)
-
-            elif b"encoder setup failed" in ffmpeg_error:
-                error = error + (
-                    "\n\nThe video export "
-                    "failed, possibly because the bitrate you specified "
-                    "was too high or too low for the video codec."
-                )
-
-            elif b"Invalid encoder type" in ffmpeg_error:
-                error = error + (
-                    "\n\nThe video export failed because the codec "
-                    "or file extension you provided is not a video"
-                )
-
-            raise IOError(error)
+        return error
 
     def close(self):
+        if self.thread is not None:
+            with self.cond:
+                self.closing = True
+                self.cond.notify_all()
+            self.thread.join()
+            self.thread = None
         if self.proc:
-            self.proc.stdin.close()
-            if self.proc.stderr is not None:
-                self.proc.stderr.close()
+            if self.error is None:
+                self.proc.stdin.close()
+                if self.proc.stderr is not None:
+                    self.proc.stderr.close()
             self.proc.wait()
 
         self.proc = None
+        METRICS.unregister(
+            "ffmpeg_pipe_write_seconds",
+            "ffmpeg_pipe_stalls",
+            "ffmpeg_queue_depth",
+            "ffmpeg_dropped",
+            file=self.filename,
+        )
+        if self.error is not None:
+            raise self.error
 
     # Support the Context Manager protocol, to ensure that resources are cleaned up.
 
@@ -249,3 +823,59 @@ class FFMPEG_VideoWriter:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
+
+
+def ffmpeg_pixfmt(pixel_format):
+    """Returns the ffmpeg input pixel format of a Mono camera pixel format."""
+    bits = pixel_bits(pixel_format)
+    if bits == 8:
+        return "gray"
+    if bits in (10, 12):
+        return f"gray{bits}le"
+    return "gray16le"
+
+
+def make_writer_spec(
+    name,
+    filename,
+    shape,
+    fps,
+    pixel_format="Mono8",
+    ffmpeg_binary=FFMPEG_BINARY,
+    options=None,
+):
+    """Returns the (writer class, args, kwargs) spec of a writer by name.
+
+    ``name`` is one of 'raw_npz', 'raw_file', 'compressed' or 'ffmpeg' and
+    ``filename`` the output name without extension. ``options`` are extra
+    keyword arguments for the writer."""
+    options = dict(options or {})
+    if name == "raw_npz":
+        return (Raw_Writer, (f"{filename}.npz",), options)
+    if name == "raw_file":
+        return (
+            RawFile_Writer,
+            (f"{filename}.raw",),
+            {"pixel_format": pixel_format, **options},
+        )
+    if name == "compressed":
+        return (
+            ChunkedCompressed_Writer,
+            (f"{filename}.bcz",),
+            {"pixel_format": pixel_format, "filters": ("delta",), **options},
+        )
+    if name == "ffmpeg":
+        return (
+            FFMPEG_VideoWriter,
+            (f"{filename}.avi", shape),
+            {
+                "fps": fps,
+                "codec": "rawvideo",
+                "pixfmt": ffmpeg_pixfmt(pixel_format),
+                "pixel_format": pixel_format,
+                "ffmpeg_binary": ffmpeg_binary,
+                "async_mode": True,
+                **options,
+            },
+        )
+    raise ValueError(f"Unknown writer '{name}'")